@@ -0,0 +1,466 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cerbero.errors import ConfigurationError
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+# Bump it when the format of the artifacts or the way keys are computed
+# changes, to invalidate all the existing artifacts
+ARTIFACTS_VERSION = 1
+
+# Configuration properties that change the output of a recipe
+CONFIG_KEYS = ['target_platform', 'target_arch', 'target_distro',
+               'target_distro_version', 'prefix', 'libdir', 'host', 'build',
+               'target', 'lib_suffix', 'py_prefix', 'toolchain_version',
+               'min_osx_sdk_version', 'osx_target_sdk_version',
+               'ios_min_version', 'ios_platform', 'sysroot',
+               'target_arch_flags', 'universal_archs', 'allow_system_libs']
+
+
+def check_members(tar, path):
+    '''
+    Checks that extracting an archive in a directory only writes regular
+    files, directories and links inside it, as the artifacts can come from a
+    remote store
+
+    @param tar: the archive
+    @type tar: L{tarfile.TarFile}
+    @param path: directory where it's extracted
+    @type path: str
+    @raise tarfile.TarError: if a member of the archive is not safe
+    '''
+    root = os.path.realpath(path)
+
+    def inside(name):
+        if os.path.isabs(name):
+            return False
+        dest = os.path.normpath(os.path.join(root, name))
+        return dest == root or dest.startswith(root + os.sep)
+
+    for member in tar.getmembers():
+        if not inside(member.name):
+            raise tarfile.TarError(_("%s is outside the prefix") %
+                                   member.name)
+        if not (member.isfile() or member.isdir() or member.issym() or
+                member.islnk()):
+            raise tarfile.TarError(_("%s is not a file, a directory or a "
+                                     "link") % member.name)
+        if member.issym():
+            target = os.path.join(os.path.dirname(member.name),
+                                  member.linkname)
+        else:
+            target = member.linkname
+        if (member.issym() or member.islnk()) and \
+                (os.path.isabs(member.linkname) or not inside(target)):
+            raise tarfile.TarError(_("%s links outside the prefix") %
+                                   member.name)
+
+
+class LocalStore (object):
+    '''
+    Stores the artifacts in a directory, either local or in a shared
+    filesystem
+
+    @ivar path: path of the directory
+    @type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, name, dest):
+        '''
+        Copies an artifact to a local file
+
+        @param name: name of the artifact
+        @type name: str
+        @param dest: path of the local file
+        @type dest: str
+        @return: True if the artifact was found
+        @rtype: bool
+        '''
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, dest)
+        return True
+
+    def put(self, name, src):
+        '''
+        Copies a local file to the store
+
+        @param name: name of the artifact
+        @type name: str
+        @param src: path of the local file
+        @type src: str
+        '''
+        # Concurrent builds sharing the store never see a partial artifact
+        with shell.atomic_write(os.path.join(self.path, name), 'wb') as f:
+            with open(src, 'rb') as s:
+                shutil.copyfileobj(s, f)
+
+
+class HTTPStore (object):
+    '''
+    Stores the artifacts in an HTTP server with GET and PUT requests, like
+    the one in tools/artifact-cache-server.py
+
+    @ivar url: base URL of the artifacts
+    @type url: str
+    @ivar timeout: timeout of the requests in seconds
+    @type timeout: float
+    '''
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/') + '/'
+        self.timeout = timeout
+
+    def get(self, name, dest):
+        '''
+        Downloads an artifact to a local file
+
+        @param name: name of the artifact
+        @type name: str
+        @param dest: path of the local file
+        @type dest: str
+        @return: True if the artifact was found
+        @rtype: bool
+        '''
+        try:
+            response = urllib.request.urlopen(self._url(name),
+                                              timeout=self.timeout)
+        except urllib.error.HTTPError as ex:
+            if ex.code == 404:
+                return False
+            raise
+        with response, open(dest, 'wb') as f:
+            shutil.copyfileobj(response, f)
+        return True
+
+    def put(self, name, src):
+        '''
+        Uploads a local file to the server
+
+        @param name: name of the artifact
+        @type name: str
+        @param src: path of the local file
+        @type src: str
+        '''
+        with open(src, 'rb') as f:
+            request = urllib.request.Request(self._url(name), data=f,
+                method='PUT', headers={
+                    'Content-Length': str(os.path.getsize(src)),
+                    'Content-Type': 'application/octet-stream'})
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+
+    def _url(self, name):
+        return urllib.parse.urljoin(self.url, urllib.parse.quote(name))
+
+
+# Remote stores by URL scheme
+REMOTE_STORES = {'http': HTTPStore, 'https': HTTPStore}
+
+
+def remote_store(url):
+    '''
+    Creates the store for the URL of a remote artifact cache
+
+    @param url: URL of the cache
+    @type url: str
+    @return: the store
+    @rtype: L{cerbero.build.artifacts.HTTPStore}
+    '''
+    scheme = urllib.parse.urlparse(url).scheme
+    if scheme not in REMOTE_STORES:
+        raise ConfigurationError(_("Unsupported artifact cache URL: %s") %
+                                 url)
+    return REMOTE_STORES[scheme](url)
+
+
+class ArtifactCache (object):
+    '''
+    Cache of the files installed by the recipes, indexed by a hash of all the
+    inputs of the build: the recipe file, its patches, the version of its
+    sources, the relevant configuration and the keys of its dependencies.
+
+    Artifacts are always kept in a local store. When a remote store is used
+    too, the ones missing locally are downloaded from it and the new ones
+    are uploaded to it in the background. Any error talking to the remote
+    store disables it for the rest of the build.
+
+    @ivar config: configuration used
+    @type config: L{cerbero.config.Config}
+    @ivar cookbook: cookbook with the recipes
+    @type cookbook: L{cerbero.build.cookbook.CookBook}
+    @ivar store: where the artifacts are stored
+    @type store: L{cerbero.build.artifacts.LocalStore}
+    @ivar remote: remote store shared with other hosts
+    @type remote: L{cerbero.build.artifacts.HTTPStore}
+    '''
+
+    # Concurrent transfers with the remote store
+    TRANSFERS = 4
+
+    def __init__(self, config, cookbook, store=None, remote=None):
+        self.config = config
+        self.cookbook = cookbook
+        if store is None:
+            store = LocalStore(config.artifact_cache or
+                               os.path.join(config.home_dir, 'artifacts'))
+        self.store = store
+        if remote is None and config.artifact_cache_remote:
+            remote = remote_store(config.artifact_cache_remote)
+        self.remote = remote
+        self._keys = {}
+        self._dependents = {}
+        self._lock = threading.RLock()
+        self._downloads = {}
+        self._uploads = []
+        self._executor = None
+        if self.remote is not None:
+            self._executor = ThreadPoolExecutor(self.TRANSFERS)
+
+    def recipe_key(self, recipe_name):
+        '''
+        Gets the cache key of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: hex digest or None if the inputs of the recipe can't be
+                 known yet, like the commit of a git repository not cloned
+        @rtype: str
+        '''
+        with self._lock:
+            if recipe_name not in self._keys:
+                self._keys[recipe_name] = self._compute_key(recipe_name)
+            return self._keys[recipe_name]
+
+    def restore(self, recipe):
+        '''
+        Installs the files of a recipe from the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @return: True if the recipe was found in the cache
+        @rtype: bool
+        '''
+        name = self._artifact_name(recipe)
+        if name is None:
+            return False
+        fd, tmp = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(fd)
+        try:
+            if not self.store.get(name, tmp):
+                if not self._download(name).result():
+                    return False
+                if not self.store.get(name, tmp):
+                    return False
+            with tarfile.open(tmp, 'r:gz') as tar:
+                check_members(tar, self.config.prefix)
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(self.config.prefix, filter='data')
+                else:
+                    tar.extractall(self.config.prefix)
+            return True
+        except (OSError, tarfile.TarError) as ex:
+            m.warning(_("Could not restore %s from the artifact cache: %s") %
+                      (recipe.name, ex))
+            return False
+        finally:
+            os.remove(tmp)
+
+    def save(self, recipe, files):
+        '''
+        Stores the files installed by a recipe in the cache
+
+        @param recipe: the recipe
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param files: files installed, relative to the prefix. The ones
+                      missing are ignored
+        @type files: list
+        @return: True if the files were stored
+        @rtype: bool
+        '''
+        name = self._artifact_name(recipe)
+        files = [f for f in files if
+                 os.path.lexists(os.path.join(self.config.prefix, f))]
+        if name is None or not files:
+            return False
+        fd, tmp = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(fd)
+        try:
+            with tarfile.open(tmp, 'w:gz') as tar:
+                for f in sorted(files):
+                    tar.add(os.path.join(self.config.prefix, f), f,
+                            recursive=False)
+            self.store.put(name, tmp)
+        except (OSError, tarfile.TarError) as ex:
+            # The cache is an optimization, never fail a build because of it
+            m.warning(_("Could not store %s in the artifact cache: %s") %
+                      (recipe.name, ex))
+            return False
+        finally:
+            os.remove(tmp)
+        with self._lock:
+            if self.remote is not None:
+                self._uploads.append(self._executor.submit(self._upload,
+                                                           name))
+        return True
+
+    def prefetch(self, recipes):
+        '''
+        Starts downloading the artifacts of some recipes from the remote
+        store, so that they are available locally when they are restored
+
+        @param recipes: the recipes
+        @type recipes: list
+        '''
+        for recipe in recipes:
+            name = self._artifact_name(recipe)
+            if name is not None:
+                self._download(name)
+
+    def close(self):
+        '''
+        Waits for the pending uploads and cancels the pending downloads
+        '''
+        if self._executor is None:
+            return
+        with self._lock:
+            for future in self._downloads.values():
+                future.cancel()
+            uploads = [x for x in self._uploads if not x.done()]
+        if uploads:
+            m.message(_("Waiting for %d uploads to the artifact cache") %
+                      len(uploads))
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def invalidate(self, recipe_name):
+        '''
+        Forgets the cached key of a recipe and the ones depending on it, for
+        instance after fetching new sources
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        '''
+        with self._lock:
+            self._keys.pop(recipe_name, None)
+            for name in self._dependents.pop(recipe_name, []):
+                self.invalidate(name)
+
+    def _download(self, name):
+        with self._lock:
+            if name not in self._downloads:
+                if self.remote is None or \
+                        os.path.exists(os.path.join(self.store.path, name)):
+                    future = Future()
+                    future.set_result(False)
+                    return future
+                self._downloads[name] = self._executor.submit(self._transfer,
+                        self._get, name)
+            return self._downloads[name]
+
+    def _get(self, remote, name):
+        fd, tmp = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(fd)
+        try:
+            if not remote.get(name, tmp):
+                return False
+            self.store.put(name, tmp)
+            return True
+        finally:
+            os.remove(tmp)
+
+    def _upload(self, name):
+        self._transfer(lambda remote, name: remote.put(name,
+                       os.path.join(self.store.path, name)), name)
+
+    def _transfer(self, func, name):
+        remote = self.remote
+        if remote is None:
+            return False
+        try:
+            return func(remote, name)
+        except Exception as ex:
+            # Fall back to building the recipes quietly, but only once
+            with self._lock:
+                if self.remote is None:
+                    return False
+                self.remote = None
+            m.warning(_("Not using the remote artifact cache anymore, "
+                        "%s failed: %s") % (name, ex))
+            return False
+
+    def _artifact_name(self, recipe):
+        key = self.recipe_key(recipe.name)
+        if key is None:
+            return None
+        return '%s/%s.tar.gz' % (recipe.name, key)
+
+    def _compute_key(self, recipe_name):
+        recipe = self.cookbook.get_recipe(recipe_name)
+        h = hashlib.sha256()
+
+        def update(value):
+            h.update(str(value).encode('utf-8'))
+            h.update(b'\0')
+
+        def update_file(path):
+            update(os.path.basename(path))
+            with open(path, 'rb') as f:
+                h.update(f.read())
+
+        update(ARTIFACTS_VERSION)
+        update(recipe_name)
+        try:
+            update(recipe.built_version())
+        except Exception:
+            return None
+        update_file(recipe.__file__)
+        custom = os.path.join(recipe.recipe_dir(), 'custom.py')
+        if os.path.exists(custom):
+            update_file(custom)
+        for patch in getattr(recipe, 'patches', []):
+            if not os.path.isabs(patch):
+                patch = recipe.relative_path(patch)
+            update_file(patch)
+        for prop in CONFIG_KEYS:
+            update('%s=%r' % (prop, getattr(self.config, prop, None)))
+        variants = getattr(self.config, 'variants', None)
+        update(sorted(getattr(variants, '__dict__', {}).items()))
+        for dep in sorted(self.cookbook.list_recipe_direct_deps(recipe_name)):
+            key = self.recipe_key(dep)
+            self._dependents.setdefault(dep, set()).add(recipe_name)
+            if key is None:
+                return None
+            update('%s=%s' % (dep, key))
+        return h.hexdigest()
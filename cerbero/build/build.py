@@ -18,13 +18,24 @@
 
 import os
 
+from cerbero.build import ninjalog
+from cerbero.build.configurecache import ConfigureCache
+from cerbero.build.configurestamp import ConfigureStamp
 from cerbero.config import Platform, Architecture, Distro
-from cerbero.utils import shell, to_unixpath, add_system_libs
+from cerbero.utils import _, shell, jobserver, to_unixpath, add_system_libs
+from cerbero.utils import compilercache, trace
 from cerbero.utils import messages as m
 import shutil
 import shlex
 import copy
 import re
+import time
+
+
+# Scripts replaced in the sources by our copies and directories in which
+# they are not searched for
+CONFIG_SCRIPTS = ['config.guess', 'config.sub']
+CONFIG_SCRIPTS_SKIP_DIRS = ['.git', 'po', 'tests']
 
 
 class Build (object):
@@ -35,9 +46,24 @@ class Build (object):
     @type recipe: L{cerbero.recipe.Recipe}
     @ivar config: cerbero's configuration
     @type config: L{cerbero.config.Config}
+    @cvar staged_install: whether the install step can install the files in
+                          the DESTDIR set in destdir
+    @type staged_install: bool
+    @ivar destdir: staging directory the install step must install to
+    @type destdir: str
+    @ivar force_configure: whether to run the configure step even if its
+                           inputs didn't change since the last run
+    @type force_configure: bool
+    @ivar deps_fingerprints: fingerprints of the builds of the dependencies,
+                             which configure runs again when they change
+    @type deps_fingerprints: dict
     '''
 
     _properties_keys = []
+    staged_install = False
+    destdir = None
+    force_configure = False
+    deps_fingerprints = None
 
     def configure(self):
         '''
@@ -63,6 +89,44 @@ class Build (object):
         '''
         pass
 
+    def update_config_scripts(self, srcdir):
+        '''
+        Replaces the config.guess and config.sub scripts found in the sources
+        with the ones shipped with cerbero, which know about all the
+        platforms we build for
+
+        @param srcdir: directory of the sources
+        @type srcdir: str
+        '''
+        datadir = os.path.join(self.config._relative_path('data'),
+                               'autotools')
+        for f in shell.find_files_named(srcdir, CONFIG_SCRIPTS,
+                                        CONFIG_SCRIPTS_SKIP_DIRS):
+            o = os.path.join(datadir, os.path.basename(f))
+            if shell.copy_if_changed(o, f):
+                m.action("copying %s to %s" % (o, f))
+
+    def compiler_cache_stats(self):
+        '''
+        Gets the hits and misses of the compiler cache in the last compile
+        step
+
+        @return: number of hits and misses, or None if they are unknown
+        @rtype: tuple
+        '''
+        return compilercache.read_stats(self.build_dir)
+
+    def slowest_targets(self):
+        '''
+        Gets the slowest compilation units and link steps of the last
+        compile step
+
+        @return: list of (kind, output, duration), or None if they are
+                 unknown
+        @rtype: list
+        '''
+        return None
+
 
 class CustomBuild(Build):
 
@@ -77,17 +141,19 @@ class CustomBuild(Build):
 
 
 def modify_environment(func):
-    ''' Decorator to modify the build environment '''
+    ''' Decorator to run a build step with the recipe environment '''
     def call(*args):
         self = args[0]
-        append_env = self.append_env
-        new_env = self.new_env.copy()
-        if self.use_system_libs and self.config.allow_system_libs:
-            self._add_system_libs(new_env)
-        old_env = self._modify_env(append_env, new_env)
-        res = func(*args)
-        self._restore_env(old_env)
-        return res
+        if self.env is not None:
+            # Nested call, the environment is already set up
+            return func(*args)
+        # Steps get their own copy in case they modify it
+        self.env = shell.Environment(self._get_env())
+        try:
+            with shell.environment(self.env):
+                return func(*args)
+        finally:
+            self.env = None
 
     call.__name__ = func.__name__
     return call
@@ -96,6 +162,9 @@ def modify_environment(func):
 class ModifyEnvBase:
     '''
     Base class for build systems that require extra env variables
+
+    @ivar env: environment of the build step being run
+    @type env: L{cerbero.utils.shell.Environment}
     '''
 
     append_env = None
@@ -107,53 +176,33 @@ class ModifyEnvBase:
             self.append_env = {}
         if self.new_env is None:
             self.new_env = {}
-        self._old_env = None
+        self.env = None
+        self._env = None
+        self._env_key = None
 
-    def _modify_env(self, append_env, new_env):
+    def _get_env(self):
         '''
-        Modifies the build environment appending the values in
-        append_env or replacing the values in new_env
+        Gets the build environment of the configuration appending the values
+        in append_env or replacing the values in new_env. It's only built
+        again if the recipe changed them.
         '''
-        if self._old_env is not None:
-            return None
-
-        self._old_env = {}
-        for var in list(append_env.keys()) + list(new_env.keys()):
-            self._old_env[var] = os.environ.get(var, None)
-
-        for var, val in append_env.items():
-            if var not in os.environ:
-                os.environ[var] = val
-            else:
-                os.environ[var] = '%s %s' % (os.environ[var], val)
-
-        for var, val in new_env.items():
-            if val is None:
-                if var in os.environ:
-                    del os.environ[var]
-            else:
-                os.environ[var] = val
-        return self._old_env
-
-    def _restore_env(self, old_env):
-        ''' Restores the old environment '''
-        if old_env is None:
-            return
-
-        for var, val in old_env.items():
-            if val is None:
-                if var in os.environ:
-                    del os.environ[var]
-            else:
-                os.environ[var] = val
-        self._old_env = None
+        new_env = self.new_env.copy()
+        if self.use_system_libs and self.config.allow_system_libs:
+            self._add_system_libs(new_env)
+        key = (sorted(self.append_env.items()),
+               sorted(new_env.items(), key=lambda x: x[0]))
+        if self._env is None or key != self._env_key:
+            self._env = self.config.get_build_env().modify(self.append_env,
+                                                           new_env)
+            self._env_key = key
+        return self._env
 
     def _add_system_libs(self, new_env):
         '''
         Add /usr/lib/pkgconfig to PKG_CONFIG_PATH so the system's .pc file
         can be found.
         '''
-        add_system_libs(self.config, new_env)
+        add_system_libs(self.config, new_env, self.config.get_build_env())
 
 
 class MakefilesBase (Build, ModifyEnvBase):
@@ -171,6 +220,7 @@ class MakefilesBase (Build, ModifyEnvBase):
     allow_parallel_build = True
     srcdir = '.'
     requires_non_src_build = False
+    staged_install = True
 
     def __init__(self):
         Build.__init__(self)
@@ -181,10 +231,6 @@ class MakefilesBase (Build, ModifyEnvBase):
             self.make_dir = os.path.join (self.config_src_dir, "cerbero-build-dir")
         else:
             self.make_dir = self.config_src_dir
-        if self.config.allow_parallel_build and self.allow_parallel_build \
-                and self.config.num_of_cpus > 1:
-            self.make += ' -j%d' % self.config.num_of_cpus
-
         # Make sure user's env doesn't mess up with our build.
         self.new_env['MAKEFLAGS'] = None
 
@@ -198,22 +244,49 @@ class MakefilesBase (Build, ModifyEnvBase):
         if self.requires_non_src_build:
             self.config_sh = os.path.join('../', self.config_sh)
 
-        shell.call(self.configure_tpl % {'config-sh': self.config_sh,
+        cmd = self.configure_tpl % {'config-sh': self.config_sh,
             'prefix': to_unixpath(self.config.prefix),
             'libdir': to_unixpath(self.config.libdir),
             'host': self.config.host,
             'target': self.config.target,
             'build': self.config.build,
-            'options': self.configure_options},
-            self.make_dir)
+            'options': self.configure_options}
+        stamp = ConfigureStamp(self.config, self.env, self.make_dir, cmd,
+            self._configure_inputs(),
+            [os.path.join(self.make_dir, 'Makefile')],
+            list(self.new_env) + list(self.append_env),
+            self.deps_fingerprints)
+        if stamp.is_current() and not self.force_configure:
+            m.action(_("Configure inputs didn't change, skipping it"))
+            return
+        stamp.remove()
+        self._run_configure(cmd)
+        stamp.save()
+
+    def _run_configure(self, cmd):
+        shell.call(cmd, self.make_dir)
+
+    def _configure_inputs(self):
+        '''
+        Gets the files that require running configure again when modified
+        '''
+        if not self.config_sh:
+            return []
+        return [os.path.join(self.make_dir, self.config_sh)]
 
     @modify_environment
     def compile(self):
-        shell.call(self.make, self.make_dir)
+        compilercache.collect_stats(self.config, self.env, self.build_dir)
+        with jobserver.make_slot(self.env, self.config.num_of_cpus,
+                                 self._parallel_build()):
+            shell.call(self.make, self.make_dir)
 
     @modify_environment
     def install(self):
-        shell.call(self.make_install, self.make_dir)
+        if self.destdir:
+            self.env['DESTDIR'] = self.destdir
+        with jobserver.make_slot(self.env, 1, False):
+            shell.call(self.make_install, self.make_dir)
 
     @modify_environment
     def clean(self):
@@ -222,7 +295,11 @@ class MakefilesBase (Build, ModifyEnvBase):
     @modify_environment
     def check(self):
         if self.make_check:
-            shell.call(self.make_check, self.build_dir)
+            with jobserver.make_slot(self.env, 1, False):
+                shell.call(self.make_check, self.build_dir)
+
+    def _parallel_build(self):
+        return self.config.allow_parallel_build and self.allow_parallel_build
 
 
 class Autotools (MakefilesBase):
@@ -253,33 +330,12 @@ class Autotools (MakefilesBase):
         else:
             self.configure_tpl += " --disable-introspection "
 
-        if self.autoreconf:
-            shell.call(self.autoreconf_sh, self.config_src_dir)
-
-        files = shell.check_call('find %s -type f -name config.guess' %
-                                 self.config_src_dir).split('\n')
-        files.remove('')
-        for f in files:
-            o = os.path.join(self.config._relative_path('data'), 'autotools',
-                             'config.guess')
-            m.action("copying %s to %s" % (o, f))
-            shutil.copy(o, f)
-
-        files = shell.check_call('find %s -type f -name config.sub' %
-                                 self.config_src_dir).split('\n')
-        files.remove('')
-        for f in files:
-            o = os.path.join(self.config._relative_path('data'), 'autotools',
-                             'config.sub')
-            m.action("copying %s to %s" % (o, f))
-            shutil.copy(o, f)
-
         if self.config.platform == Platform.WINDOWS and \
                 self.supports_cache_variables:
             # On windows, environment variables are upperscase, but we still
             # need to pass things like am_cv_python_platform in lowercase for
             # configure and autogen.sh
-            for k, v in os.environ.items():
+            for k, v in self._get_env().items():
                 if k[2:6] == '_cv_':
                     self.configure_tpl += ' %s="%s"' % (k, v)
 
@@ -291,22 +347,41 @@ class Autotools (MakefilesBase):
             if self.config.target is not None:
                 self.configure_tpl += ' --target=%(target)s'
 
-        use_configure_cache = self.config.use_configure_cache
-        if self.use_system_libs and self.config.allow_system_libs:
-            use_configure_cache = False
-
-        if self.new_env or self.append_env:
-            use_configure_cache = False
-
-        if use_configure_cache and self.can_use_configure_cache:
-            cache = os.path.join(self.config.sources, '.configure.cache')
-            self.configure_tpl += ' --cache-file=%s' % cache
+        # The cache is shared with the recipes using the same toolchain,
+        # which includes the variables modified by this recipe
+        self._configure_cache = None
+        if self.config.use_configure_cache and self.can_use_configure_cache:
+            self._configure_cache = ConfigureCache(self.config,
+                self._get_env(), self.build_dir,
+                list(self.new_env) + list(self.append_env))
+            self.configure_tpl += ' --cache-file=%s' % \
+                self._configure_cache.local_path
 
         # Add at the very end to allow recipes to override defaults
         self.configure_tpl += "  %(options)s "
 
         MakefilesBase.configure(self)
 
+    def _run_configure(self, cmd):
+        if self.autoreconf:
+            shell.call(self.autoreconf_sh, self.config_src_dir)
+
+        self.update_config_scripts(self.config_src_dir)
+
+        if self._configure_cache is not None:
+            self._configure_cache.prepare()
+        MakefilesBase._run_configure(self, cmd)
+        if self._configure_cache is not None:
+            self._configure_cache.save()
+
+    def _configure_inputs(self):
+        inputs = [os.path.join(self.config_src_dir, x) for x in
+                  ['configure.ac', 'configure.in']]
+        # configure is generated again with autoreconf
+        if not self.autoreconf:
+            inputs += MakefilesBase._configure_inputs(self)
+        return inputs
+
 
 class CMake (MakefilesBase):
     '''
@@ -321,14 +396,19 @@ class CMake (MakefilesBase):
 
     @modify_environment
     def configure(self):
-        cc = os.environ.get('CC', 'gcc')
-        cxx = os.environ.get('CXX', 'g++')
-        cflags = os.environ.get('CFLAGS', '')
-        cxxflags = os.environ.get('CXXFLAGS', '')
-        # FIXME: CMake doesn't support passing "ccache $CC"
+        cc = self.env.get('CC', 'gcc')
+        cxx = self.env.get('CXX', 'g++')
+        cflags = self.env.get('CFLAGS', '')
+        cxxflags = self.env.get('CXXFLAGS', '')
+        # CMake doesn't support passing "ccache $CC", it's set as the launcher
         if self.config.use_ccache:
-            cc = cc.replace('ccache', '').strip()
-            cxx = cxx.replace('ccache', '').strip()
+            launcher = self.config.compiler_cache
+            cc = cc.replace(launcher, '').strip()
+            cxx = cxx.replace(launcher, '').strip()
+            self.configure_options += ' -DCMAKE_C_COMPILER_LAUNCHER=%s ' % \
+                launcher
+            self.configure_options += ' -DCMAKE_CXX_COMPILER_LAUNCHER=%s ' % \
+                launcher
         cc = cc.split(' ')[0]
         cxx = cxx.split(' ')[0]
 
@@ -350,13 +430,19 @@ class CMake (MakefilesBase):
         self.configure_options += ' -DCMAKE_C_FLAGS="%s"' % cflags
         self.configure_options += ' -DCMAKE_CXX_FLAGS="%s"' % cxxflags
         self.configure_options += ' -DLIB_SUFFIX=%s ' % self.config.lib_suffix
+        MakefilesBase.configure(self)
+
+    def _run_configure(self, cmd):
         cmake_cache = os.path.join(self.build_dir, 'CMakeCache.txt')
         cmake_files = os.path.join(self.build_dir, 'CMakeFiles')
         if os.path.exists(cmake_cache):
             os.remove(cmake_cache)
         if os.path.exists(cmake_files):
             shutil.rmtree(cmake_files)
-        MakefilesBase.configure(self)
+        MakefilesBase._run_configure(self, cmd)
+
+    def _configure_inputs(self):
+        return [os.path.join(self.config_src_dir, 'CMakeLists.txt')]
 
 
 # Note: We force stpcpy to be false because our ancient version of the mingw
@@ -400,12 +486,14 @@ class Meson (Build, ModifyEnvBase) :
             --backend=%(backend)s ..'
     meson_default_library = 'shared'
     meson_backend = 'ninja'
+    staged_install = True
 
     def __init__(self):
         Build.__init__(self)
         ModifyEnvBase.__init__(self)
 
         self.meson_dir = os.path.join(self.build_dir, "_builddir")
+        self._ninja_timings = None
 
         # HACK: CC and CXX must be the native toolchain
         # https://bugzilla.gnome.org/show_bug.cgi?id=791670
@@ -429,12 +517,13 @@ class Meson (Build, ModifyEnvBase) :
             self.make_clean = self.make + ' clean'
 
     def write_meson_cross_file(self):
-        # Take CC and CXX from _old_env because we modified env to make them be
-        # the native toolchain.
-        cc = self._old_env.get('CC', '').split(' ')
-        cxx = self._old_env.get('CXX', '').split(' ')
-        ar=os.environ.get('AR', '').split(' ')
-        strip=os.environ.get('STRIP', '').split(' ')
+        # Take CC and CXX from the configuration environment because we
+        # modified env to make them be the native toolchain.
+        config_env = self.config.get_build_env()
+        cc = config_env.get('CC', '').split(' ')
+        cxx = config_env.get('CXX', '').split(' ')
+        ar = self.env.get('AR', '').split(' ')
+        strip = self.env.get('STRIP', '').split(' ')
 
         # *FLAGS are only passed to the native compiler, so while
         # cross-compiling we need to pass these through the cross file.
@@ -448,10 +537,10 @@ class Meson (Build, ModifyEnvBase) :
             f.write('*link_libgcc:\n')
             f.write('%D -L{0}/lib{1}\n'.format(self.config.prefix, self.config.lib_suffix))
         c_link_args = ['-specs=' + specs_file]
-        c_link_args += shlex.split(os.environ.get('LDFLAGS', ''))
+        c_link_args += shlex.split(self.env.get('LDFLAGS', ''))
         cpp_link_args = c_link_args
-        c_args = shlex.split(os.environ.get('CFLAGS', ''))
-        cpp_args = shlex.split(os.environ.get('CXXFLAGS', ''))
+        c_args = shlex.split(self.env.get('CFLAGS', ''))
+        cpp_args = shlex.split(self.env.get('CXXFLAGS', ''))
 
         # Operate on a copy of the recipe properties to avoid accumulating args
         # from all archs when doing universal builds
@@ -486,14 +575,6 @@ class Meson (Build, ModifyEnvBase) :
 
     @modify_environment
     def configure(self):
-        if os.path.exists(self.meson_dir):
-            # Only remove if it's not empty
-            if os.listdir(self.meson_dir):
-                shutil.rmtree(self.meson_dir)
-                os.makedirs(self.meson_dir)
-        else:
-            os.makedirs(self.meson_dir)
-
         if self.config.variants.debug:
             buildtype = 'debug'
         elif self.config.variants.nodebug:
@@ -510,21 +591,58 @@ class Meson (Build, ModifyEnvBase) :
             'backend': self.meson_backend }
 
         if self.config.cross_compiling():
-            f = self.write_meson_cross_file()
-            meson_cmd += ' --cross-file=' + f
+            # The cross file is written below, once the build dir is clean
+            meson_cmd += ' --cross-file=' + os.path.join(self.meson_dir,
+                'meson-cross-file.txt')
 
         for (key, value) in self.meson_options.items():
             meson_cmd += ' -D%s=%s' % (key, str(value))
 
+        stamp = ConfigureStamp(self.config, self.env, self.meson_dir,
+            '%s %r' % (meson_cmd, sorted(self.meson_cross_properties.items())),
+            [os.path.join(self.build_dir, x) for x in
+             ['meson.build', 'meson_options.txt']],
+            [os.path.join(self.meson_dir, 'build.ninja')],
+            list(self.new_env) + list(self.append_env),
+            self.deps_fingerprints)
+        if stamp.is_current() and not self.force_configure:
+            m.action(_("Configure inputs didn't change, skipping it"))
+            return
+
+        if os.path.exists(self.meson_dir):
+            # Only remove if it's not empty
+            if os.listdir(self.meson_dir):
+                shutil.rmtree(self.meson_dir)
+                os.makedirs(self.meson_dir)
+        else:
+            os.makedirs(self.meson_dir)
+
+        if self.config.cross_compiling():
+            self.write_meson_cross_file()
+
         shell.call(meson_cmd, self.meson_dir)
+        stamp.save()
 
     @modify_environment
     def compile(self):
-        shell.call(self.make, self.meson_dir)
+        compilercache.collect_stats(self.config, self.env, self.build_dir)
+        self._ninja_timings = None
+        log = ninjalog.NinjaLog(self.meson_dir)
+        log.mark()
+        started = time.time()
+        self._ninja(self.make)
+        targets = log.read_new()
+        self._ninja_timings = ninjalog.targets_timings(targets)
+        tracer = trace.get()
+        if tracer is not None:
+            ninjalog.trace_targets(tracer, targets, started, '%s (%s) ninja' %
+                                   (self.name, self.config.target_arch))
 
     @modify_environment
     def install(self):
-        shell.call(self.make_install, self.meson_dir)
+        if self.destdir:
+            self.env['DESTDIR'] = self.destdir
+        self._ninja(self.make_install)
 
     @modify_environment
     def clean(self):
@@ -534,6 +652,24 @@ class Meson (Build, ModifyEnvBase) :
     def check(self):
         shell.call(self.make_check, self.meson_dir)
 
+    def slowest_targets(self):
+        if self._ninja_timings is None:
+            return None
+        return ninjalog.slowest_targets(self._ninja_timings)
+
+    def _ninja(self, cmd):
+        ninja, args = (cmd.split(' ', 1) + [''])[:2]
+        with jobserver.ninja_slot(self.env, self.config.num_of_cpus,
+                                  ninja) as jobs:
+            opts = []
+            if jobs is not None:
+                opts.append('-j%d' % jobs)
+            if self.config.load_limit:
+                opts.append('-l%s' % self.config.load_limit)
+            if opts:
+                cmd = '%s %s %s' % (ninja, ' '.join(opts), args)
+            shell.call(cmd, self.meson_dir)
+
 
 class BuildType (object):
 
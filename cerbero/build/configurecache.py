@@ -0,0 +1,134 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import hashlib
+import os
+import shutil
+
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+from cerbero.utils.compilercache import CCACHE, SCCACHE
+
+
+CACHES_DIR = '.configure-caches'
+LOCAL_CACHE = 'cerbero-config.cache'
+
+# Variables changing the results of the configure checks
+FINGERPRINT_VARS = ['CC', 'CXX', 'CPP', 'CXXCPP', 'OBJC', 'CFLAGS',
+                    'CXXFLAGS', 'CPPFLAGS', 'OBJCFLAGS', 'LDFLAGS', 'LIBS',
+                    'PATH', 'PKG_CONFIG', 'PKG_CONFIG_PATH',
+                    'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_SYSROOT_DIR']
+
+
+def _compiler_id(command, path):
+    # Path, modification time and size of the compiler, skipping launchers
+    # like ccache
+    for word in command.split():
+        if word.startswith('-') or word in [CCACHE, SCCACHE]:
+            continue
+        exe = shell.which(word, path) if not os.path.isabs(word) else word
+        if exe is None or not os.path.exists(exe):
+            return word
+        st = os.stat(exe)
+        return '%s:%d:%d' % (exe, st.st_mtime_ns, st.st_size)
+    return ''
+
+
+def fingerprint(config, env, extra_vars=None):
+    '''
+    Gets the fingerprint of the toolchain used to configure a module, which
+    changes with the compilers, their flags and the host triplet
+
+    @param config: the configuration
+    @type config: L{cerbero.config.Config}
+    @param env: environment of the configure step
+    @type env: dict
+    @param extra_vars: other variables set for the module
+    @type extra_vars: list
+    @return: the fingerprint
+    @rtype: str
+    '''
+    names = set(FINGERPRINT_VARS + list(extra_vars or []))
+    # Cache variables set in the environment override the checks
+    names.update([x for x in env if '_cv_' in x])
+    h = hashlib.sha1()
+    for triplet in [config.host, config.build, config.target]:
+        h.update(('%s\n' % triplet).encode('utf-8'))
+    for name in sorted(names):
+        h.update(('%s=%s\n' % (name, env.get(name))).encode('utf-8'))
+    for name in ['CC', 'CXX']:
+        if env.get(name):
+            compiler = _compiler_id(env[name], env.get('PATH'))
+            h.update(('%s\n' % compiler).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ConfigureCache (object):
+    '''
+    Autotools configure cache shared by the modules configured with the same
+    toolchain. Each configure run works on its own copy of the cache, that
+    replaces the shared one after it succeeds.
+
+    @ivar path: path of the shared cache
+    @type path: str
+    @ivar local_path: path of the copy used by the configure run
+    @type local_path: str
+    '''
+
+    def __init__(self, config, env, build_dir, extra_vars=None):
+        '''
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @param env: environment of the configure step
+        @type env: dict
+        @param build_dir: build directory of the module
+        @type build_dir: str
+        @param extra_vars: other variables set for the module
+        @type extra_vars: list
+        '''
+        self.path = os.path.join(config.sources, CACHES_DIR, '%s.cache' %
+                                 fingerprint(config, env, extra_vars))
+        self.local_path = os.path.join(build_dir, LOCAL_CACHE)
+
+    def prepare(self):
+        '''
+        Copies the shared cache for a configure run
+
+        @return: path of the cache the configure run must use
+        @rtype: str
+        '''
+        if os.path.exists(self.local_path):
+            os.remove(self.local_path)
+        if os.path.exists(self.path):
+            shutil.copy(self.path, self.local_path)
+        return self.local_path
+
+    def save(self):
+        '''
+        Replaces the shared cache with the one updated by the configure run
+        '''
+        if not os.path.exists(self.local_path):
+            return
+        try:
+            # Other recipes might be reading it
+            with shell.atomic_write(self.path, 'wb') as f:
+                with open(self.local_path, 'rb') as local:
+                    shutil.copyfileobj(local, f)
+        except OSError as ex:
+            m.warning(_("Could not save the configure cache %s: %s") %
+                      (self.path, ex))
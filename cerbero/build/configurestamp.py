@@ -0,0 +1,104 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import hashlib
+import os
+
+from cerbero.build.configurecache import fingerprint
+
+
+STAMP = '.cerbero-configure.stamp'
+
+
+class ConfigureStamp (object):
+    '''
+    Stamp of a configure run, to skip running it again when its inputs
+    didn't change: the configure command, the toolchain used, the
+    modification time of the configure scripts and the builds of the
+    dependencies it found.
+
+    @ivar path: path of the stamp
+    @type path: str
+    @ivar key: hash of the inputs of the configure run
+    @type key: str
+    '''
+
+    def __init__(self, config, env, build_dir, command, inputs, outputs,
+                 extra_vars=[], deps=None):
+        '''
+        @param config: the configuration
+        @type config: L{cerbero.config.Config}
+        @param env: environment of the configure step
+        @type env: dict
+        @param build_dir: directory in which the configure step runs
+        @type build_dir: str
+        @param command: the configure command
+        @type command: str
+        @param inputs: paths of the configure scripts
+        @type inputs: list
+        @param outputs: paths of the files configure generates, which must
+                        exist to skip it
+        @type outputs: list
+        @param extra_vars: other variables set for the module
+        @type extra_vars: list
+        @param deps: fingerprints of the builds of the dependencies, by name
+        @type deps: dict
+        '''
+        self.path = os.path.join(build_dir, STAMP)
+        self.outputs = outputs
+        h = hashlib.sha1()
+        h.update(('%s\n' % command).encode('utf-8'))
+        h.update(('%s\n' % fingerprint(config, env, extra_vars))
+                 .encode('utf-8'))
+        h.update(('%r\n' % sorted((deps or {}).items())).encode('utf-8'))
+        for path in sorted(inputs):
+            mtime = None
+            if os.path.exists(path):
+                mtime = os.stat(path).st_mtime_ns
+            h.update(('%s:%s\n' % (path, mtime)).encode('utf-8'))
+        self.key = h.hexdigest()
+
+    def is_current(self):
+        '''
+        Checks if configure already ran with the same inputs
+
+        @rtype: bool
+        '''
+        for path in self.outputs:
+            if not os.path.exists(path):
+                return False
+        try:
+            with open(self.path) as f:
+                return f.read().strip() == self.key
+        except OSError:
+            return False
+
+    def remove(self):
+        '''
+        Removes the stamp before running configure, so that it's only
+        written again if it succeeds
+        '''
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self):
+        '''
+        Writes the stamp after a successful configure run
+        '''
+        with open(self.path, 'w') as f:
+            f.write('%s\n' % self.key)
@@ -17,23 +17,35 @@
 # Boston, MA 02111-1307, USA.
 
 from collections import defaultdict
+import hashlib
 import os
 import pickle
+import sqlite3
+import threading
 import time
-import imp
 
 from cerbero.config import CONFIG_DIR, Platform, Architecture, Distro,\
     DistroVersion, License
 from cerbero.build.build import BuildType
+from cerbero.build.depgraph import DependencyGraph
+from cerbero.build.recipesindex import RecipesIndex, index_path, \
+    recipe_entry
+from cerbero.build.statusstore import StatusStore, store_path
 from cerbero.build.source import SourceType
 from cerbero.errors import FatalError, RecipeNotFoundError, InvalidRecipeError
 from cerbero.utils import _, shell, parse_file
+from cerbero.utils.codecache import CodeCache
 from cerbero.utils import messages as m
 from cerbero.build import recipe as crecipe
 
 
 COOKBOOK_NAME = 'cookbook'
 COOKBOOK_FILE = os.path.join(CONFIG_DIR, COOKBOOK_NAME)
+# Compiled code of the recipes, shared by all the configurations
+RECIPES_CODE_CACHE = 'recipes-code.cache'
+# Estimated build time in seconds of a recipe that was never built, used when
+# there are no other recipes with recorded durations to estimate it
+DEFAULT_RECIPE_DURATION = 60.0
 
 
 class RecipeStatus (object):
@@ -54,16 +66,36 @@ class RecipeStatus (object):
     @type built_version: str
     @ivar file_hash: hash of the file with the recipe description
     @type file_hash: int
+    @ivar steps_duration: wall time in seconds of the last run of each step
+    @type steps_duration: dict
+    @ivar fingerprint: hash of the inputs of the last build, including the
+                       fingerprints of the dependencies it was built against
+    @type fingerprint: str
+    @ivar deps_fingerprints: fingerprints of the dependencies the recipe was
+                             built against
+    @type deps_fingerprints: dict
+    @ivar reset_reason: why the status was reset
+    @type reset_reason: str
+    @ivar manifest: files installed by the last build, with their size, hash
+                    and type by path relative to the prefix
+    @type manifest: dict
     '''
 
     def __init__(self, filepath, steps=[], needs_build=True,
-                 mtime=time.time(), built_version=None, file_hash=0):
+                 mtime=time.time(), built_version=None, file_hash=0,
+                 steps_duration=None, fingerprint=None,
+                 deps_fingerprints=None, reset_reason=None, manifest=None):
         self.steps = steps
         self.needs_build = needs_build
         self.mtime = mtime
         self.filepath = filepath
         self.built_version = built_version
         self.file_hash = file_hash
+        self.steps_duration = steps_duration or {}
+        self.fingerprint = fingerprint
+        self.deps_fingerprints = deps_fingerprints
+        self.reset_reason = reset_reason
+        self.manifest = manifest or {}
 
     def touch(self):
         ''' Touches the recipe updating its modification time '''
@@ -76,7 +108,7 @@ class RecipeStatus (object):
 class CookBook (object):
     '''
     Stores a list of recipes and their build status saving it's state to a
-    cache file
+    L{cerbero.build.statusstore.StatusStore}
 
     @ivar recipes: dictionary with L{cerbero.recipe.Recipe} availables
     @type recipes: dict
@@ -86,11 +118,26 @@ class CookBook (object):
 
     RECIPE_EXT = '.recipe'
 
-    def __init__(self, config, load=True):
+    def __init__(self, config, load=True, lazy=False):
+        '''
+        @param load: whether to load the recipes and their status
+        @type load: bool
+        @param lazy: only load the recipes when they are needed, using the
+                     recipes index if it's up to date
+        @type lazy: bool
+        '''
         self.set_config(config)
         self.recipes = {}  # recipe_name -> recipe
         self._invalid_recipes = {} # recipe -> error
         self._mtimes = {}
+        # Recipes can be cooked concurrently, guard the status updates
+        self._lock = threading.RLock()
+        self._store = None
+        self._code_cache = None
+        # Index of the recipes not loaded yet when loading them lazily
+        self._index = None
+        self._customs = {}
+        self._graph = None
 
         if not load:
             return
@@ -100,6 +147,8 @@ class CookBook (object):
         if not os.path.exists(config.recipes_dir):
             raise FatalError(_("Recipes dir %s not found") %
                              config.recipes_dir)
+        if lazy and self._load_index():
+            return
         self.update()
 
     def set_config(self, config):
@@ -143,6 +192,7 @@ class CookBook (object):
         @return: list of recipes
         @rtype: list
         '''
+        self._load_all()
         recipes = list(self.recipes.values())
         recipes.sort(key=lambda x: x.name)
         return recipes
@@ -155,6 +205,7 @@ class CookBook (object):
         @type  recipe: L{cerbero.build.cookbook.Recipe}
         '''
         self.recipes[recipe.name] = recipe
+        self._graph = None
 
     def get_recipe(self, name):
         '''
@@ -163,13 +214,15 @@ class CookBook (object):
         @param name: name of the recipe
         @type name: str
         '''
+        if name not in self.recipes and self._index is not None:
+            self._load_indexed_recipe(name)
         if name in self._invalid_recipes:
             raise self._invalid_recipes[name]
         if name not in self.recipes:
             raise RecipeNotFoundError(name)
         return self.recipes[name]
 
-    def update_step_status(self, recipe_name, step):
+    def update_step_status(self, recipe_name, step, duration=None):
         '''
         Updates the status of a recipe's step
 
@@ -177,12 +230,20 @@ class CookBook (object):
         @type recipe: str
         @param step: name of the step
         @type step: str
+        @param duration: wall time in seconds it took to run the step
+        @type duration: float
         '''
-        status = self._recipe_status(recipe_name)
-        status.steps.append(step)
-        status.touch()
-        self.status[recipe_name] = status
-        self.save()
+        with self._lock:
+            status = self._recipe_status(recipe_name)
+            status.steps.append(step)
+            if duration is not None:
+                # steps_duration was added afterwards
+                if not hasattr(status, 'steps_duration'):
+                    status.steps_duration = {}
+                status.steps_duration[step] = duration
+            status.touch()
+            self.status[recipe_name] = status
+            self.save(recipe_name)
 
     def update_build_status(self, recipe_name, built_version):
         '''
@@ -193,12 +254,47 @@ class CookBook (object):
         @param built_version: built version or None to reset it
         @type built_version: str
         '''
-        status = self._recipe_status(recipe_name)
-        status.needs_build = built_version == None
-        status.built_version = built_version
-        status.touch()
-        self.status[recipe_name] = status
-        self.save()
+        with self._lock:
+            status = self._recipe_status(recipe_name)
+            status.needs_build = built_version == None
+            status.built_version = built_version
+            if built_version is not None:
+                status.deps_fingerprints = self.deps_fingerprints(recipe_name)
+                status.fingerprint = self._fingerprint(recipe_name, status)
+            status.touch()
+            self.status[recipe_name] = status
+            self.save(recipe_name)
+
+    def update_manifest(self, recipe_name, manifest, replace=False):
+        '''
+        Records the files installed by a step of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @param manifest: installed files, see L{cerbero.build.staging.install}
+        @type manifest: dict
+        @param replace: whether to forget the files of the previous build
+        @type replace: bool
+        '''
+        with self._lock:
+            status = self._recipe_status(recipe_name)
+            # manifest was added afterwards
+            if replace or not hasattr(status, 'manifest'):
+                status.manifest = {}
+            status.manifest.update(manifest)
+            self.save(recipe_name)
+
+    def recipe_manifest(self, recipe_name):
+        '''
+        Gets the files installed by the last build of a recipe
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the manifest or None if it was not recorded
+        @rtype: dict
+        '''
+        status = self.status.get(recipe_name)
+        return getattr(status, 'manifest', None) or None
 
     def recipe_built_version (self, recipe_name):
         '''
@@ -223,27 +319,199 @@ class CookBook (object):
         '''
         return step in self._recipe_status(recipe_name).steps
 
-    def reset_recipe_status(self, recipe_name):
+    def reset_recipe_status(self, recipe_name, reason=None):
         '''
         Resets the build status of a recipe
 
         @param recipe_name: name of the recipe
         @type recipe_name: str
+        @param reason: why it needs to be built again
+        @type reason: str
         '''
-        if recipe_name in self.status:
-            del self.status[recipe_name]
-            self.save()
+        with self._lock:
+            if recipe_name in self.status:
+                old = self.status.pop(recipe_name)
+                status = self._recipe_status(recipe_name)
+                # Keep the recorded durations, they are still a good estimate
+                status.steps_duration = getattr(old, 'steps_duration', {})
+                # The files of the last build are still installed, the
+                # recipes depending on it don't need a rebuild until it's
+                # built again with different inputs
+                status.fingerprint = getattr(old, 'fingerprint', None)
+                status.manifest = getattr(old, 'manifest', {})
+                status.reset_reason = reason
+                self.save(recipe_name)
 
     def recipe_needs_build(self, recipe_name):
         '''
-        Whether a recipe needs to be build or not
+        Whether a recipe needs to be build or not, which is also the case
+        when it was built against dependencies that were rebuilt since with
+        different inputs
 
         @param recipe_name: name of the recipe
         @type recipe_name: str
         @return: True if the recipe needs to be build
         @rtype: bool
         '''
-        return self._recipe_status(recipe_name).needs_build
+        return self.rebuild_reason(recipe_name) is not None
+
+    def rebuild_reason(self, recipe_name):
+        '''
+        Gets why a recipe needs to be built, without modifying its status
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the reason or None if it doesn't need to be built
+        @rtype: str
+        '''
+        with self._lock:
+            return self._rebuild_reason(recipe_name,
+                                        self.status.get(recipe_name))
+
+    def changed_deps(self, recipe_name):
+        '''
+        Lists the dependencies of a built recipe that were rebuilt with
+        different inputs since it was built against them
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: names of the dependencies
+        @rtype: list
+        '''
+        with self._lock:
+            status = self.status.get(recipe_name)
+            if status is None or status.needs_build:
+                return []
+            return self._changed_deps(recipe_name, status)
+
+    def rebuild_plan(self, recipes_names, force=False):
+        '''
+        Finds out which recipes of a build need to be built and why, taking
+        into account the reverse dependencies of the recipes that will be
+        built with different inputs
+
+        @param recipes_names: names of the recipes in build order
+        @type recipes_names: list
+        @param force: whether all the recipes will be built
+        @type force: bool
+        @return: list of (recipe name, reason) in build order
+        @rtype: list
+        '''
+        fingerprints = {}
+        plan = []
+        for name in recipes_names:
+            if force:
+                reason = _("forced")
+            else:
+                reason = self._rebuild_reason(name, self.status.get(name),
+                                              fingerprints)
+                if reason is None:
+                    continue
+            plan.append((name, reason))
+            fingerprints[name] = self._next_fingerprint(name, fingerprints)
+        return plan
+
+    def recipe_fingerprint(self, recipe_name):
+        '''
+        Gets the fingerprint of the last build of a recipe, which changes
+        whenever the recipe or any of its dependencies is built with
+        different inputs
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: the fingerprint or None if it was never recorded
+        @rtype: str
+        '''
+        return getattr(self.status.get(recipe_name), 'fingerprint', None)
+
+    def deps_fingerprints(self, recipe_name):
+        '''
+        Gets the fingerprints of the last build of the direct dependencies of
+        a recipe, the ones it would be built against now
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: dictionary of fingerprints by dependency name
+        @rtype: dict
+        '''
+        return dict([(x, self.recipe_fingerprint(x)) for x in
+                     self.list_recipe_direct_deps(recipe_name)])
+
+    def recipe_duration(self, recipe_name):
+        '''
+        Gets the time it took to build a recipe the last time, adding up the
+        recorded durations of its steps
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: duration in seconds or None if it was never recorded
+        @rtype: float
+        '''
+        status = self.status.get(recipe_name)
+        durations = getattr(status, 'steps_duration', None)
+        if not durations:
+            return None
+        return sum(durations.values())
+
+    def critical_path(self, recipes_names, skip_built=True, durations=None):
+        '''
+        Computes the priority of each recipe as the length of the longest
+        chain of recipes depending on it, including itself, weighted by the
+        recorded build times. Recipes never built are estimated with the
+        average build time of the others.
+
+        @param recipes_names: names of the recipes being built
+        @type recipes_names: list
+        @param skip_built: count recipes already built as taking no time
+        @type skip_built: bool
+        @param durations: build time of the recipes, defaults to the ones
+                          recorded in the status
+        @type durations: dict
+        @return: dictionary with the remaining time in seconds of each recipe
+        @rtype: dict
+        '''
+        if durations is None:
+            durations = {}
+            for name in self.status:
+                duration = self.recipe_duration(name)
+                if duration is not None:
+                    durations[name] = duration
+        default = DEFAULT_RECIPE_DURATION
+        if durations:
+            default = sum(durations.values()) / len(durations)
+
+        rdeps = self.list_recipes_reverse_deps(recipes_names)
+        priorities = {}
+
+        def priority(name):
+            if name not in priorities:
+                if skip_built and not self.recipe_needs_build(name):
+                    duration = 0
+                else:
+                    duration = durations.get(name, default)
+                priorities[name] = duration + \
+                    max([priority(r) for r in rdeps[name]] + [0])
+            return priorities[name]
+
+        for name in recipes_names:
+            priority(name)
+        return priorities
+
+    def list_recipes_reverse_deps(self, recipes_names):
+        '''
+        Lists the recipes depending directly on each recipe of a set, only
+        taking into account the recipes in the set
+
+        @param recipes_names: names of the recipes
+        @type recipes_names: list
+        @return: dictionary with the names of the reverse dependencies of each
+                 recipe
+        @rtype: dict
+        '''
+        graph = self.dependency_graph()
+        names = set(recipes_names)
+        return dict([(n, [x for x in graph.direct_rdeps(n) if x in names])
+                     for n in recipes_names])
 
     def list_recipe_deps(self, recipe_name):
         '''
@@ -255,8 +523,35 @@ class CookBook (object):
         @return: list of L{cerbero.recipe.Recipe}
         @rtype: list
         '''
-        recipe = self.get_recipe(recipe_name)
-        return self._find_deps(recipe, {}, [])
+        return self.list_recipes_deps([recipe_name])
+
+    def list_recipes_deps(self, recipes_names):
+        '''
+        List the recipes that need to be built in the correct build order for
+        a list of recipes, without duplicates
+
+        @param recipes_names: names of the recipes
+        @type recipes_names: list
+        @return: list of L{cerbero.recipe.Recipe}
+        @rtype: list
+        '''
+        for name in recipes_names:
+            self.get_recipe(name)
+        graph = self.dependency_graph()
+        return [self.get_recipe(x) for x in graph.build_order(recipes_names)]
+
+    def list_recipe_direct_deps(self, recipe_name):
+        '''
+        List the names of the recipes that must be built right before this
+        one, including the runtime dependencies common to all recipes
+
+        @param recipe_name: name of the recipe
+        @type recipe_name: str
+        @return: list of recipe names
+        @rtype: list
+        '''
+        graph = self._recipe_graph(recipe_name)
+        return graph.direct_deps(recipe_name)
 
     def list_recipe_reverse_deps(self, recipe_name):
         '''
@@ -267,11 +562,42 @@ class CookBook (object):
         @return: list of reverse dependencies L{cerbero.recipe.Recipe}
         @rtype: list
         '''
-        recipe = self.get_recipe(recipe_name)
-        return [r for r in list(self.recipes.values()) if recipe.name in r.deps]
+        graph = self._recipe_graph(recipe_name)
+        return [self.get_recipe(x) for x in graph.direct_rdeps(recipe_name)]
+
+    def _recipe_graph(self, recipe_name):
+        graph = self.dependency_graph()
+        if recipe_name not in graph:
+            # Raises the error, or loads all the recipes if it's not indexed
+            self.get_recipe(recipe_name)
+            graph = self.dependency_graph()
+        return graph
+
+    def dependency_graph(self):
+        '''
+        Gets the graph of the dependencies between all the recipes
 
-    def _runtime_deps (self):
-        return [x.name for x in list(self.recipes.values()) if x.runtime_dep]
+        @return: the graph
+        @rtype: L{cerbero.build.depgraph.DependencyGraph}
+        '''
+        with self._lock:
+            if self._graph is None:
+                if self._index is not None:
+                    # Don't load all the recipes just for their dependencies
+                    recipes = dict([(n, (e['deps'], e['runtime_dep'])) for
+                                    n, e in self._index.recipes.items()])
+                else:
+                    recipes = dict([(r.name, (r.list_deps(), r.runtime_dep))
+                                    for r in self.recipes.values()])
+                runtime_deps = sorted([n for n, (d, rt) in recipes.items()
+                                       if rt])
+                deps = {}
+                for name, (recipe_deps, runtime_dep) in recipes.items():
+                    if not runtime_dep:
+                        recipe_deps = runtime_deps + list(recipe_deps)
+                    deps[name] = recipe_deps
+                self._graph = DependencyGraph(deps)
+            return self._graph
 
     def _cache_file(self, config):
         if config.cache_file is not None:
@@ -279,110 +605,268 @@ class CookBook (object):
         else:
             return COOKBOOK_FILE
 
+    def _status_store(self):
+        path = store_path(self._cache_file(self.get_config()))
+        if self._store is None or self._store.path != path:
+            if self._store is not None:
+                self._store.close()
+            self._store = StatusStore(path)
+        return self._store
+
     def _restore_cache(self):
+        cache_file = self._cache_file(self.get_config())
         try:
-            with open(self._cache_file(self.get_config()), 'rb') as f:
+            store = self._status_store()
+            if store.exists() or not os.path.exists(cache_file):
+                self.status = store.load()
+                return
+            # Migrate the status of older versions, pickled in a single file
+            with open(cache_file, 'rb') as f:
                 self.status = pickle.load(f)
+            store.save(self.status)
+            m.action(_("Migrated the recipes status from %s to %s") %
+                     (cache_file, store.path))
         except Exception:
             self.status = {}
             m.warning(_("Could not recover status"))
 
-    def save(self):
+    def save(self, recipe_name=None):
+        '''
+        Saves the recipes status
+
+        @param recipe_name: name of the only recipe whose status changed or
+                            None to save all of them
+        @type recipe_name: str
+        '''
+        names = recipe_name is not None and [recipe_name] or None
         try:
-            cache_file = self._cache_file(self.get_config())
-            if not os.path.exists(os.path.dirname(cache_file)):
-                os.makedirs(os.path.dirname(cache_file))
-            with open(cache_file, 'wb') as f:
-                pickle.dump(self.status, f)
-        except IOError as ex:
+            with self._lock:
+                self._status_store().save(self.status, names)
+        except (sqlite3.Error, OSError) as ex:
             m.warning(_("Could not cache the CookBook: %s") % ex)
 
-    def _find_deps(self, recipe, state={}, ordered=[]):
-        if state.get(recipe, 'clean') == 'processed':
-            return
-        if state.get(recipe, 'clean') == 'in-progress':
-            raise FatalError(_("Dependency Cycle: {0}".format(recipe.name)))
-        state[recipe] = 'in-progress'
-        recipe_deps = recipe.list_deps()
-        if not recipe.runtime_dep:
-            recipe_deps = self._runtime_deps () + recipe_deps
-        for recipe_name in recipe_deps:
-            try:
-                recipedep = self.get_recipe(recipe_name)
-            except RecipeNotFoundError as e:
-                raise FatalError(_("Recipe %s has a unknown dependency %s"
-                                 % (recipe.name, recipe_name)))
-            try:
-                self._find_deps(recipedep, state, ordered)
-            except FatalError:
-                m.error('Error finding deps of "{0}"'.format(recipe.name))
-                raise
-        state[recipe] = 'processed'
-        ordered.append(recipe)
-        return ordered
+    def _fingerprint(self, recipe_name, status):
+        return self._hash_fingerprint(recipe_name, status.built_version,
+                                      getattr(status, 'file_hash', 0),
+                                      status.deps_fingerprints)
+
+    def _hash_fingerprint(self, recipe_name, built_version, file_hash, deps):
+        data = repr((recipe_name, built_version, file_hash,
+                     sorted(deps.items())))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _next_fingerprint(self, recipe_name, fingerprints):
+        # Fingerprint a recipe will have once built again, with the ones
+        # expected for its dependencies being rebuilt
+        recipe = self.get_recipe(recipe_name)
+        try:
+            built_version = recipe.built_version()
+            file_hash = shell.file_hash(recipe.__file__)
+        except Exception:
+            return None
+        deps = dict([(x, fingerprints.get(x, self.recipe_fingerprint(x)))
+                     for x in self.list_recipe_direct_deps(recipe_name)])
+        return self._hash_fingerprint(recipe_name, built_version, file_hash,
+                                      deps)
+
+    def _rebuild_reason(self, recipe_name, status, fingerprints=None):
+        if status is None or status.needs_build:
+            reason = getattr(status, 'reset_reason', None)
+            if reason is not None:
+                return reason
+            if getattr(status, 'fingerprint', None) is not None:
+                return _("status reset")
+            if status is not None and status.steps:
+                return _("previous build not finished")
+            return _("never built")
+        changed = self._changed_deps(recipe_name, status, fingerprints)
+        if not changed:
+            return None
+        return _("dependencies changed: %s") % ', '.join(changed)
+
+    def _changed_deps(self, recipe_name, status, fingerprints=None):
+        if fingerprints is None:
+            fingerprints = {}
+        # deps_fingerprints was added afterwards, nothing to compare with
+        # for recipes built before
+        built_against = getattr(status, 'deps_fingerprints', None)
+        if built_against is None:
+            return []
+        deps = self.list_recipe_direct_deps(recipe_name)
+        changed = [x for x in built_against if x not in deps]
+        changed += [x for x in deps if x not in built_against or
+                    built_against[x] != fingerprints.get(x,
+                        self.recipe_fingerprint(x))]
+        return changed
 
     def _recipe_status(self, recipe_name):
         recipe = self.get_recipe(recipe_name)
-        if recipe_name not in self.status:
-            filepath = None
-            if hasattr(recipe, '__file__'):
-                filepath = recipe.__file__
-            self.status[recipe_name] = RecipeStatus(filepath, steps=[],
-                    file_hash=shell.file_hash(filepath))
-        return self.status[recipe_name]
+        with self._lock:
+            if recipe_name not in self.status:
+                filepath = None
+                if hasattr(recipe, '__file__'):
+                    filepath = recipe.__file__
+                self.status[recipe_name] = RecipeStatus(filepath, steps=[],
+                        file_hash=shell.file_hash(filepath))
+            return self.status[recipe_name]
 
     def _load_recipes(self):
         self.recipes = {}
+        self._index = None
+        self._graph = None
         recipes = defaultdict(dict)
         recipes_repos = self._config.get_recipes_repos()
+        self._code_cache = CodeCache(os.path.join(self._config.home_dir,
+                                                  RECIPES_CODE_CACHE))
+        # Compute the signature before loading in case the files change
+        signature = self._index_signature()
+        entries = {}
         for reponame, (repodir, priority) in recipes_repos.items():
-            recipes[int(priority)].update(self._load_recipes_from_dir(repodir))
+            repo_recipes = self._load_recipes_from_dir(repodir)
+            recipes[int(priority)].update(repo_recipes)
+            for recipe in repo_recipes.values():
+                entries.setdefault(int(priority), {})[recipe.name] = \
+                    recipe_entry(recipe, repodir)
+        self._code_cache.save()
         # Add recipes by asceding pripority
+        index = {}
         for key in sorted(recipes.keys()):
             self.recipes.update(recipes[key])
+            index.update(entries.get(key, {}))
+        RecipesIndex(self._index_file()).save(signature, index)
 
         # Check for updates in the recipe file to reset the status
         for recipe in list(self.recipes.values()):
-            if recipe.name not in self.status:
+            self._check_recipe_file(recipe)
+
+    def _load_all(self):
+        # Lazy loading is not worth it anymore
+        if self._index is None:
+            return
+        with self._lock:
+            loaded = self.recipes
+            self.update()
+            # Keep the recipes already in use
+            for name, recipe in loaded.items():
+                if name in self.recipes:
+                    self.recipes[name] = recipe
+
+    def _load_index(self):
+        index = RecipesIndex(self._index_file())
+        if not index.load(self._index_signature()):
+            return False
+        self._index = index
+        self._code_cache = CodeCache(os.path.join(self._config.home_dir,
+                                                  RECIPES_CODE_CACHE))
+        return True
+
+    def _load_indexed_recipe(self, name):
+        with self._lock:
+            if name in self.recipes or self._index is None:
+                return
+            if name not in self._index.recipes:
+                # Maybe an invalid recipe, which are not indexed
+                self._load_all()
+                return
+            entry = self._index.recipes[name]
+            repo = entry['repo']
+            if repo not in self._customs:
+                self._customs[repo] = self._load_custom(repo)
+            recipe = self._load_recipe_from_file(entry['file'],
+                                                 self._customs[repo])
+            self._code_cache.save()
+            if recipe is None or recipe.name != name:
+                self._load_all()
+                return
+            self.recipes[name] = recipe
+            self._check_recipe_file(recipe)
+            self.save(name)
+
+    def _index_file(self):
+        return index_path(self._cache_file(self.get_config()))
+
+    def _index_signature(self):
+        '''
+        Hashes everything the recipes metadata depends on: the configuration,
+        the recipe files and custom.py of each repository and the cerbero
+        modules defining the recipes
+        '''
+        h = hashlib.sha1()
+        config = self.get_config()
+        for prop in sorted(getattr(config, '_properties', [])):
+            value = getattr(config, prop, None)
+            if prop == 'variants':
+                value = sorted(getattr(value, '__dict__', {}).items())
+            h.update(('%s=%r\n' % (prop, value)).encode('utf-8'))
+        builddir = os.path.dirname(os.path.abspath(__file__))
+        files = shell.find_files('*.py', builddir)
+        repos = sorted(config.get_recipes_repos().items())
+        for reponame, (repodir, priority) in repos:
+            h.update(('%s=%s:%s\n' % (reponame, repodir, priority)).encode(
+                'utf-8'))
+            files += self._recipes_files(repodir)
+            files.append(os.path.join(repodir, 'custom.py'))
+        for f in sorted(files):
+            try:
+                st = os.stat(f)
+            except OSError:
                 continue
-            st = self.status[recipe.name]
-            # filepath attribute was added afterwards
-            if not hasattr(st, 'filepath') or not getattr(st, 'filepath'):
-                st.filepath = recipe.__file__
-            if recipe.__file__ != st.filepath:
-                self.reset_recipe_status(recipe.name)
-            # Need to check the version too, because the version can be
-            # inherited from a different file, f.ex. recipes/custom.py
-            elif recipe.built_version() != st.built_version:
-                self.reset_recipe_status(recipe.name)
-            else:
-                rmtime = os.path.getmtime(recipe.__file__)
-                if rmtime > st.mtime:
-                    # The mtime is different, check the file hash now
-                    # Use getattr as file_hash we added later
-                    saved_hash = getattr(st, 'file_hash', 0)
-                    current_hash = shell.file_hash(st.filepath)
-                    if saved_hash == current_hash:
-                        # Update the status with the mtime
-                        st.touch()
-                    else:
-                        self.reset_recipe_status(recipe.name)
+            h.update(('%s %d %d\n' % (f, st.st_mtime_ns, st.st_size)).encode(
+                'utf-8'))
+        return h.hexdigest()
 
-    def _load_recipes_from_dir(self, repo):
-        recipes = {}
+    def _check_recipe_file(self, recipe):
+        if recipe.name not in self.status:
+            return
+        st = self.status[recipe.name]
+        # filepath attribute was added afterwards
+        if not hasattr(st, 'filepath') or not getattr(st, 'filepath'):
+            st.filepath = recipe.__file__
+        if recipe.__file__ != st.filepath:
+            self.reset_recipe_status(recipe.name,
+                                     _("recipe file moved"))
+        # Need to check the version too, because the version can be
+        # inherited from a different file, f.ex. recipes/custom.py
+        elif recipe.built_version() != st.built_version:
+            self.reset_recipe_status(recipe.name,
+                    _("version changed from %s to %s") %
+                    (st.built_version, recipe.built_version()))
+        else:
+            rmtime = os.path.getmtime(recipe.__file__)
+            if rmtime > st.mtime:
+                # The mtime is different, check the file hash now
+                # Use getattr as file_hash we added later
+                saved_hash = getattr(st, 'file_hash', 0)
+                current_hash = shell.file_hash(st.filepath)
+                if saved_hash == current_hash:
+                    # Update the status with the mtime
+                    st.touch()
+                else:
+                    self.reset_recipe_status(recipe.name,
+                                             _("recipe file changed"))
+
+    def _recipes_files(self, repo):
         recipes_files = shell.find_files('*%s' % self.RECIPE_EXT, repo)
         recipes_files.extend(shell.find_files('*/*%s' % self.RECIPE_EXT, repo))
+        return recipes_files
+
+    def _load_custom(self, repo):
+        # Try to load the custom.py module located in the recipes dir
+        # which can contain private classes to extend cerbero's recipes
+        # and reuse them in our private repository
         try:
-            custom = None
             m_path = os.path.join(repo, 'custom.py')
             if os.path.exists(m_path):
-                custom = imp.load_source('custom', m_path)
+                return self._code_cache.load_module('custom', m_path)
         except Exception:
-            custom = None
+            pass
+        return None
+
+    def _load_recipes_from_dir(self, repo):
+        recipes = {}
+        recipes_files = self._recipes_files(repo)
+        custom = self._load_custom(repo)
         for f in recipes_files:
-            # Try to load the custom.py module located in the recipes dir
-            # which can contain private classes to extend cerbero's recipes
-            # and reuse them in our private repository
             try:
                 recipe = self._load_recipe_from_file(f, custom)
             except RecipeNotFoundError:
@@ -393,38 +877,46 @@ class CookBook (object):
         return recipes
 
     def _load_recipe_from_file(self, filepath, custom=None):
-        mod_name, file_ext = os.path.splitext(os.path.split(filepath)[-1])
         if self._config.target_arch == Architecture.UNIVERSAL:
             if self._config.target_platform in [Platform.IOS, Platform.DARWIN]:
                 recipe = crecipe.UniversalFlatRecipe(self._config)
             else:
                 recipe = crecipe.UniversalRecipe(self._config)
+        try:
+            d = {'Platform': Platform, 'Architecture': Architecture,
+                 'BuildType': BuildType, 'SourceType': SourceType,
+                 'Distro': Distro, 'DistroVersion': DistroVersion,
+                 'License': License, 'recipe': crecipe, 'os': os,
+                 'BuildSteps': crecipe.BuildSteps,
+                 'InvalidRecipeError': InvalidRecipeError,
+                 'FatalError': FatalError,
+                 'custom': custom, '_': _, 'shell': shell}
+            # The recipe is parsed once and instantiated for each arch
+            parse_file(filepath, d, self._code_cache)
+            recipe_class = d['Recipe']
+        except Exception as ex:
+            m.warning("Error loading recipe in file %s %s" %
+                      (filepath, ex))
+            return None
         for c in list(self._config.arch_config.keys()):
             try:
-                d = {'Platform': Platform, 'Architecture': Architecture,
-                     'BuildType': BuildType, 'SourceType': SourceType,
-                     'Distro': Distro, 'DistroVersion': DistroVersion,
-                     'License': License, 'recipe': crecipe, 'os': os,
-                     'BuildSteps': crecipe.BuildSteps,
-                     'InvalidRecipeError': InvalidRecipeError,
-                     'FatalError': FatalError,
-                     'custom': custom, '_': _, 'shell': shell}
-                parse_file(filepath, d)
                 conf = self._config.arch_config[c]
                 if self._config.target_arch == Architecture.UNIVERSAL:
                     if self._config.target_platform not in [Platform.IOS,
                             Platform.DARWIN]:
                         conf.prefix = os.path.join(self._config.prefix, c)
-                r = d['Recipe'](conf)
+                r = recipe_class(conf)
                 r.__file__ = os.path.abspath(filepath)
-                self._config.arch_config[c].do_setup_env()
+                # Recipes can read the environment of their arch in
+                # prepare(), that is only computed once for each arch
+                conf.set_build_env()
                 r.prepare()
                 if self._config.target_arch == Architecture.UNIVERSAL:
                     recipe.add_recipe(r)
                 else:
                     return r
             except InvalidRecipeError as e:
-                self._invalid_recipes[r.name] = e
+                self._invalid_recipes[recipe_class.name] = e
             except Exception as ex:
                 m.warning("Error loading recipe in file %s %s" %
                           (filepath, ex))
@@ -0,0 +1,205 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import threading
+
+from cerbero.errors import FatalError
+from cerbero.utils import _
+
+
+class DependencyGraph (object):
+    '''
+    Graph of the dependencies between recipes, with the recipes that must be
+    built before each recipe and the ones depending on it. The transitive
+    dependencies and reverse dependencies of each recipe are computed once.
+
+    @ivar deps: names of the direct dependencies of each recipe
+    @type deps: dict
+    @ivar rdeps: names of the recipes depending directly on each recipe
+    @type rdeps: dict
+    '''
+
+    def __init__(self, deps):
+        '''
+        @param deps: names of the direct dependencies of each recipe, in the
+                     order they are built
+        @type deps: dict
+        '''
+        self.deps = dict([(n, list(d)) for n, d in deps.items()])
+        self.rdeps = dict([(n, []) for n in sorted(self.deps)])
+        for name in sorted(self.deps):
+            for dep in self.deps[name]:
+                if dep in self.rdeps and name not in self.rdeps[dep]:
+                    self.rdeps[dep].append(name)
+        self._closures = {}
+        self._rclosures = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, name):
+        return name in self.deps
+
+    def direct_deps(self, name):
+        '''
+        Gets the direct dependencies of a recipe
+
+        @param name: name of the recipe
+        @type name: str
+        @return: names of the dependencies
+        @rtype: list
+        '''
+        return self.deps[name][:]
+
+    def direct_rdeps(self, name):
+        '''
+        Gets the recipes depending directly on a recipe
+
+        @param name: name of the recipe
+        @type name: str
+        @return: names of the reverse dependencies, sorted
+        @rtype: list
+        '''
+        return self.rdeps[name][:]
+
+    def deps_closure(self, name):
+        '''
+        Gets all the recipes needed to build a recipe, in build order and
+        ending with the recipe itself
+
+        @param name: name of the recipe
+        @type name: str
+        @return: names of the recipes
+        @rtype: list
+        '''
+        with self._lock:
+            return self._closure(name, [])[:]
+
+    def rdeps_closure(self, name):
+        '''
+        Gets all the recipes depending on a recipe, directly or not
+
+        @param name: name of the recipe
+        @type name: str
+        @return: names of the reverse dependencies, sorted
+        @rtype: list
+        '''
+        with self._lock:
+            if name not in self._rclosures:
+                found = set()
+                pending = [name]
+                while pending:
+                    for rdep in self.rdeps.get(pending.pop(), []):
+                        if rdep not in found:
+                            found.add(rdep)
+                            pending.append(rdep)
+                found.discard(name)
+                self._rclosures[name] = sorted(found)
+            return self._rclosures[name][:]
+
+    def build_order(self, names):
+        '''
+        Gets all the recipes needed to build a list of recipes, in build
+        order. The dependencies of each recipe are placed before it, and the
+        recipes follow the order of the list otherwise.
+
+        @param names: names of the recipes
+        @type names: list
+        @return: names of the recipes
+        @rtype: list
+        '''
+        ordered = []
+        seen = set()
+        for name in names:
+            for dep in self.deps_closure(name):
+                if dep not in seen:
+                    seen.add(dep)
+                    ordered.append(dep)
+        return ordered
+
+    def find_cycle(self):
+        '''
+        Looks for a dependency cycle in the graph
+
+        @return: names of the recipes in the cycle, starting and ending with
+                 the same recipe, or None if there are no cycles
+        @rtype: list
+        '''
+        state = {}
+        for name in sorted(self.deps):
+            if state.get(name) is not None:
+                continue
+            # Iterative depth-first search keeping the current path
+            path = [name]
+            state[name] = 'in-progress'
+            stack = [iter(self.deps[name])]
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    state[path.pop()] = 'processed'
+                    stack.pop()
+                    continue
+                if dep not in self.deps:
+                    continue
+                if state.get(dep) == 'in-progress':
+                    return path[path.index(dep):] + [dep]
+                if state.get(dep) is None:
+                    state[dep] = 'in-progress'
+                    path.append(dep)
+                    stack.append(iter(self.deps[dep]))
+        return None
+
+    def to_dict(self):
+        '''
+        Serializes the graph
+
+        @return: the direct dependencies of each recipe
+        @rtype: dict
+        '''
+        return dict([(n, d[:]) for n, d in self.deps.items()])
+
+    @staticmethod
+    def from_dict(data):
+        '''
+        Creates a graph serialized with L{to_dict}
+
+        @param data: the direct dependencies of each recipe
+        @type data: dict
+        @rtype: L{DependencyGraph}
+        '''
+        return DependencyGraph(data)
+
+    def _closure(self, name, path):
+        if name in self._closures:
+            return self._closures[name]
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise FatalError(_("Dependency Cycle: %s") % ' -> '.join(cycle))
+        path.append(name)
+        ordered = []
+        seen = set()
+        for dep in self.deps[name]:
+            if dep not in self.deps:
+                raise FatalError(_("Recipe %s has a unknown dependency %s") %
+                                 (name, dep))
+            for x in self._closure(dep, path):
+                if x not in seen:
+                    seen.add(x)
+                    ordered.append(x)
+        path.pop()
+        ordered.append(name)
+        self._closures[name] = ordered
+        return ordered
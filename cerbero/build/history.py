@@ -0,0 +1,329 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sqlite3
+import threading
+import time
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+HISTORY_NAME = 'build-history.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    recipes TEXT,
+    jobs INTEGER,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT,
+    load REAL
+);
+CREATE TABLE IF NOT EXISTS recipes (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    recipe TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    status TEXT NOT NULL,
+    cache_hit INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    recipe TEXT NOT NULL,
+    step TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    status TEXT NOT NULL,
+    load REAL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    recipe TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recipes_by_name ON recipes (recipe, run_id);
+CREATE INDEX IF NOT EXISTS steps_by_recipe ON steps (recipe, step, run_id);
+CREATE INDEX IF NOT EXISTS targets_by_kind ON targets (kind, run_id);
+'''
+
+
+class RecipeResult (object):
+    '''
+    Enumeration factory for the result of a recipe in a build run
+    '''
+
+    BUILT = 'built'
+    FAILED = 'failed'
+    UP_TO_DATE = 'up-to-date'
+    BLOCKED = 'blocked'
+
+
+class StepResult (object):
+    '''
+    Enumeration factory for the result of a step in a build run
+    '''
+
+    OK = 'ok'
+    FAILED = 'failed'
+
+
+def host_load():
+    '''
+    Gets the host load average over the last minute
+
+    @return: the load or None if it's not available on this platform
+    @rtype: float
+    '''
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def mean(durations):
+    '''
+    Gets the average of a list of durations, like the ones returned by
+    L{BuildHistory.recipes_durations}
+
+    @param durations: list of durations in seconds
+    @type durations: list
+    @return: the average in seconds
+    @rtype: float
+    '''
+    return sum(durations) / len(durations)
+
+
+class BuildHistory (object):
+    '''
+    Database with the results and timings of the steps of every build run,
+    stored in the home dir and shared by all the targets
+
+    @ivar path: path of the database
+    @type path: str
+    @ivar target: name of the target the runs are recorded for
+    @type target: str
+    '''
+
+    def __init__(self, config, path=None):
+        self.path = path or os.path.join(config.home_dir, HISTORY_NAME)
+        if config.cache_file is not None:
+            self.target = os.path.splitext(config.cache_file)[0]
+        else:
+            self.target = '%s_%s' % (config.target_platform,
+                                     config.target_arch)
+        self._lock = threading.Lock()
+        self._db = None
+        self._failed = False
+
+    def start_run(self, recipes, jobs=1):
+        '''
+        Records the start of a build run
+
+        @param recipes: names of the recipes requested
+        @type recipes: list
+        @param jobs: number of recipes built concurrently
+        @type jobs: int
+        @return: id of the run or None if it could not be recorded
+        @rtype: int
+        '''
+        cursor = self._execute('INSERT INTO runs (target, recipes, jobs, '
+                'started, load) VALUES (?, ?, ?, ?, ?)', (self.target,
+                ' '.join(recipes), jobs, time.time(), host_load()))
+        if cursor is None:
+            return None
+        return cursor.lastrowid
+
+    def finish_run(self, run_id, status):
+        '''
+        Records the end of a build run
+
+        @param run_id: id of the run
+        @type run_id: int
+        @param status: 'success', 'failed' or 'aborted'
+        @type status: str
+        '''
+        if run_id is None:
+            return
+        self._execute('UPDATE runs SET finished = ?, status = ? WHERE id = ?',
+                      (time.time(), status, run_id))
+
+    def add_step(self, run_id, recipe, step, started, duration, status):
+        '''
+        Records the result of a step
+
+        @param run_id: id of the run
+        @type run_id: int
+        @param recipe: name of the recipe
+        @type recipe: str
+        @param step: name of the step
+        @type step: str
+        @param started: start time as returned by time.time()
+        @type started: float
+        @param duration: duration in seconds
+        @type duration: float
+        @param status: a L{StepResult}
+        @type status: str
+        '''
+        if run_id is None:
+            return
+        self._execute('INSERT INTO steps (run_id, recipe, step, started, '
+                'duration, status, load) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (run_id, recipe, step, started, duration, status,
+                 host_load()))
+
+    def add_recipe(self, run_id, recipe, started, duration, status,
+                   cache_hit=False):
+        '''
+        Records the result of a recipe
+
+        @param run_id: id of the run
+        @type run_id: int
+        @param recipe: name of the recipe
+        @type recipe: str
+        @param started: start time as returned by time.time()
+        @type started: float
+        @param duration: duration in seconds
+        @type duration: float
+        @param status: a L{RecipeResult}
+        @type status: str
+        @param cache_hit: whether the recipe was restored from a cache
+        @type cache_hit: bool
+        '''
+        if run_id is None:
+            return
+        self._execute('INSERT INTO recipes (run_id, recipe, started, '
+                'duration, status, cache_hit) VALUES (?, ?, ?, ?, ?, ?)',
+                (run_id, recipe, started, duration, status, int(cache_hit)))
+
+    def add_targets(self, run_id, recipe, targets):
+        '''
+        Records the slowest targets built by the compile step of a recipe
+
+        @param run_id: id of the run
+        @type run_id: int
+        @param recipe: name of the recipe
+        @type recipe: str
+        @param targets: list of (kind, output, duration) of the targets
+        @type targets: list
+        '''
+        if run_id is None:
+            return
+        for kind, target, duration in targets:
+            self._execute('INSERT INTO targets (run_id, recipe, kind, '
+                    'target, duration) VALUES (?, ?, ?, ?, ?)',
+                    (run_id, recipe, kind, target, duration))
+
+    def recipes_durations(self):
+        '''
+        Gets the durations of the recipes built in the runs of the target,
+        leaving out the failed ones and the ones restored from a cache
+
+        @return: dictionary of recipe names with the list of their durations,
+                 most recent first
+        @rtype: dict
+        '''
+        rows = self._query('SELECT r.recipe, r.duration FROM recipes r '
+                'JOIN runs ON runs.id = r.run_id WHERE runs.target = ? AND '
+                'r.status = ? AND r.cache_hit = 0 ORDER BY r.run_id DESC',
+                (self.target, RecipeResult.BUILT))
+        durations = {}
+        for recipe, duration in rows:
+            durations.setdefault(recipe, []).append(duration)
+        return durations
+
+    def steps_durations(self):
+        '''
+        Gets the durations of the successful steps in the runs of the target
+
+        @return: dictionary of (recipe, step) with the list of their
+                 durations, most recent first
+        @rtype: dict
+        '''
+        rows = self._query('SELECT s.recipe, s.step, s.duration FROM steps s '
+                'JOIN runs ON runs.id = s.run_id WHERE runs.target = ? AND '
+                's.status = ? ORDER BY s.run_id DESC',
+                (self.target, StepResult.OK))
+        durations = {}
+        for recipe, step, duration in rows:
+            durations.setdefault((recipe, step), []).append(duration)
+        return durations
+
+    def slowest_targets(self, kind, count):
+        '''
+        Gets the slowest targets of a kind, with the duration of the last
+        time each of them was built
+
+        @param kind: a L{cerbero.build.ninjalog.TargetKind}
+        @type kind: str
+        @param count: maximum number of targets
+        @type count: int
+        @return: list of (recipe, target, duration), slowest first
+        @rtype: list
+        '''
+        rows = self._query('SELECT t.recipe, t.target, t.duration FROM '
+                'targets t JOIN runs ON runs.id = t.run_id WHERE '
+                'runs.target = ? AND t.kind = ? ORDER BY t.run_id DESC',
+                (self.target, kind))
+        targets = {}
+        for recipe, target, duration in rows:
+            targets.setdefault((recipe, target), duration)
+        targets = [(r, t, d) for (r, t), d in targets.items()]
+        targets.sort(key=lambda x: x[2], reverse=True)
+        return targets[:count]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self._db = sqlite3.connect(self.path, timeout=30,
+                                       check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _execute(self, sql, params):
+        # The history is informative, never fail a build because of it
+        if self._failed:
+            return None
+        with self._lock:
+            try:
+                db = self._connect()
+                with db:
+                    return db.execute(sql, params)
+            except (sqlite3.Error, OSError) as ex:
+                self._failed = True
+                m.warning(_("Could not record the build history in %s: %s") %
+                          (self.path, ex))
+                return None
+
+    def _query(self, sql, params):
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            return self._connect().execute(sql, params).fetchall()
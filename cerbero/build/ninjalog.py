@@ -0,0 +1,198 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+
+
+NINJA_LOG = '.ninja_log'
+# Number of compilation units and link steps kept per recipe
+SLOWEST_COUNT = 5
+
+COMPILE_EXTENSIONS = ['.o', '.obj']
+LINK_EXTENSIONS = ['.so', '.dll', '.dylib', '.a', '.lib', '.exe']
+# Versioned shared libraries, like libfoo.so.1.2.3
+_VERSIONED_LIB = re.compile(r'\.so(\.\d+)+$')
+
+
+class TargetKind (object):
+    '''
+    Enumeration factory for the kinds of targets built by ninja
+    '''
+
+    COMPILE = 'compile'
+    LINK = 'link'
+
+
+def target_kind(output):
+    '''
+    Gets the kind of a target from the name of its output
+
+    @param output: path of the output, relative to the build dir
+    @type output: str
+    @return: a L{TargetKind}, or None for the other targets, like the
+             generated sources
+    @rtype: str
+    '''
+    ext = os.path.splitext(output)[1]
+    if ext in COMPILE_EXTENSIONS:
+        return TargetKind.COMPILE
+    if ext in LINK_EXTENSIONS or _VERSIONED_LIB.search(output):
+        return TargetKind.LINK
+    # Executables have no extension, but they are not in the private dirs of
+    # the targets, like 'foo@exe/' or 'foo.p/'
+    if not ext and '@' not in output and '.p/' not in output and \
+            not output.endswith('.p'):
+        return TargetKind.LINK
+    return None
+
+
+class NinjaLog (object):
+    '''
+    Reads the timings of the targets built by ninja from its log, which
+    ninja appends to with every build.
+
+    The log starts with a '# ninja log v5' header followed by a line per
+    target with its start and end time in milliseconds since the ninja run
+    started, its modification time, its output and the hash of its command,
+    separated by tabs.
+
+    @ivar path: path of the log
+    @type path: str
+    '''
+
+    def __init__(self, build_dir):
+        '''
+        @param build_dir: directory where ninja runs
+        @type build_dir: str
+        '''
+        self.path = os.path.join(build_dir, NINJA_LOG)
+        self._offset = 0
+
+    def mark(self):
+        '''
+        Marks the end of the log, to only read the targets built by the next
+        ninja run with L{read_new}
+        '''
+        try:
+            self._offset = os.path.getsize(self.path)
+        except OSError:
+            self._offset = 0
+
+    def read_new(self):
+        '''
+        Reads the targets built since the log was marked
+
+        @return: list of (start, end, output) of the targets, with the times
+                 in seconds since the ninja run started
+        @rtype: list
+        '''
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                # ninja recompacts the log when it grows too much, and then
+                # the targets it kept are read again
+                if f.tell() < self._offset:
+                    self._offset = 0
+                f.seek(self._offset)
+                data = f.read().decode('utf-8', 'replace')
+        except OSError:
+            return []
+        targets = {}
+        for line in data.splitlines():
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) < 5:
+                continue
+            try:
+                start, end = int(fields[0]), int(fields[1])
+            except ValueError:
+                continue
+            # A target built twice only keeps the last entry
+            targets[fields[3]] = (start / 1000.0, end / 1000.0, fields[3])
+        return sorted(targets.values())
+
+
+def slowest_targets(timings, count=SLOWEST_COUNT):
+    '''
+    Gets the slowest compilation units and link steps
+
+    @param timings: list of (kind, output, duration) of the targets
+    @type timings: list
+    @param count: number of targets kept of each kind
+    @type count: int
+    @return: list of (kind, output, duration) of the slowest targets of each
+             kind, slowest first
+    @rtype: list
+    '''
+    slowest = []
+    for kind in [TargetKind.COMPILE, TargetKind.LINK]:
+        targets = [x for x in timings if x[0] == kind]
+        targets.sort(key=lambda x: x[2], reverse=True)
+        slowest += targets[:count]
+    return slowest
+
+
+def targets_timings(targets):
+    '''
+    Gets the kind and the duration of the targets read from the log,
+    leaving out the ones that are neither compiled nor linked
+
+    @param targets: list of (start, end, output) returned by
+                    L{NinjaLog.read_new}
+    @type targets: list
+    @return: list of (kind, output, duration)
+    @rtype: list
+    '''
+    timings = []
+    for start, end, output in targets:
+        kind = target_kind(output)
+        if kind is not None:
+            timings.append((kind, output, end - start))
+    return timings
+
+
+def trace_targets(tracer, targets, started, lane):
+    '''
+    Adds the targets built by a ninja run to a trace, spread in as many lanes
+    as targets were built concurrently
+
+    @param tracer: the tracer
+    @type tracer: L{cerbero.utils.trace.Tracer}
+    @param targets: list of (start, end, output) returned by
+                    L{NinjaLog.read_new}
+    @type targets: list
+    @param started: time the ninja run started, as returned by time.time()
+    @type started: float
+    @param lane: prefix of the name of the lanes
+    @type lane: str
+    '''
+    # end time of the last target of each lane
+    lanes = []
+    for start, end, output in sorted(targets):
+        for i, lane_end in enumerate(lanes):
+            if lane_end <= start:
+                break
+        else:
+            i = len(lanes)
+            lanes.append(0)
+        lanes[i] = end
+        tracer.add_span(output, 'ninja', started + start, started + end,
+                        '%s %d' % (lane, i + 1),
+                        {'kind': target_kind(output) or 'other'})
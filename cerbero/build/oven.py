@@ -16,16 +16,29 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
-import tempfile
+import os
+import queue
 import shutil
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from cerbero.errors import BuildStepError, FatalError, AbortedError
+from cerbero.build.artifacts import ArtifactCache
+from cerbero.build import ninjalog
+from cerbero.build.history import BuildHistory, RecipeResult, StepResult
 from cerbero.build.recipe import Recipe, BuildSteps
-from cerbero.utils import _, N_, shell
+from cerbero.utils import _, N_, shell, jobserver, trace
 from cerbero.utils import messages as m
 
 
+def _step_category(step):
+    if step in [BuildSteps.FETCH[1], BuildSteps.EXTRACT[1]]:
+        return step
+    return 'step'
+
+
 class RecoveryActions(object):
     '''
     Enumeration factory for recovery actions after an error
@@ -57,12 +70,24 @@ class Oven (object):
     @type: bool
     @ivar missing_files: check for files missing in the recipe
     @type missing_files: bool
+    @ivar jobs: number of recipes built concurrently
+    @type jobs: int
+    @ivar prefetch: number of recipes ahead of the current one whose sources
+                    are fetched in the background
+    @type prefetch: int
+    @ivar prefetch_extract: also extract the prefetched sources
+    @type prefetch_extract: bool
+    @ivar keep_going: when a recipe fails, keep building the recipes that
+                      don't depend on it instead of stopping
+    @type keep_going: bool
     '''
 
     STEP_TPL = '[(%s/%s) %s -> %s ]'
 
     def __init__(self, recipes, cookbook, force=False, no_deps=False,
-                 missing_files=False, dry_run=False):
+                 missing_files=False, dry_run=False, jobs=1, prefetch=0,
+                 prefetch_extract=False, keep_going=False,
+                 force_configure=None):
         if isinstance(recipes, Recipe):
             recipes = [recipes]
         self.recipes = recipes
@@ -72,6 +97,25 @@ class Oven (object):
         self.missing_files = missing_files
         self.config = cookbook.get_config()
         self.interactive = self.config.interactive
+        self.jobs = max(1, jobs or 1)
+        self.prefetch = max(0, prefetch or 0)
+        self.prefetch_extract = prefetch_extract
+        self.keep_going = keep_going
+        if force_configure is None:
+            force_configure = force
+        self.force_configure = force_configure
+        self.prefetcher = None
+        self.history = None
+        self.artifacts = None
+        self._run_id = None
+        # recipe name -> BuildStepError, for the failures when keep_going
+        self._failed = {}
+        # recipe name -> names of the failed recipes it depends on
+        self._blocked = {}
+        # recipe name -> hits and misses of the compiler cache
+        self._compiler_cache_stats = {}
+        # recipe name -> slowest targets of its compile step
+        self._slowest_targets = {}
         shell.DRY_RUN = dry_run
 
     def start_cooking(self):
@@ -82,34 +126,81 @@ class Oven (object):
             ordered_recipes = [self.cookbook.get_recipe(x) for x in
                                self.recipes]
         else:
-            ordered_recipes = []
-            for recipe in self.recipes:
-                recipes = self.cookbook.list_recipe_deps(recipe)
-                # remove recipes already scheduled to be built
-                recipes = [x for x in recipes if x not in ordered_recipes]
-                ordered_recipes.extend(recipes)
+            ordered_recipes = self.cookbook.list_recipes_deps(
+                [str(x) for x in self.recipes])
         m.message(_("Building the following recipes: %s") %
                   ' '.join([x.name for x in ordered_recipes]))
 
+        if not shell.DRY_RUN:
+            self.history = BuildHistory(self.config)
+            self._run_id = self.history.start_run(
+                [str(x) for x in self.recipes], self.jobs)
+        if (self.config.artifact_cache or self.config.artifact_cache_remote) \
+                and not shell.DRY_RUN:
+            self.artifacts = ArtifactCache(self.config, self.cookbook)
+            if not self.force:
+                self.artifacts.prefetch([x for x in ordered_recipes if
+                    self.cookbook.recipe_needs_build(x.name)])
+        if self.prefetch and not shell.DRY_RUN:
+            self.prefetcher = Prefetcher(ordered_recipes, self.cookbook,
+                                         self.prefetch, self.prefetch_extract,
+                                         self.force, self._record_step)
+        # Share the job budget among all the recipes being built
+        own_jobserver = jobserver.get() is None and not shell.DRY_RUN
+        if own_jobserver:
+            jobserver.start(self.config.num_of_cpus)
+        status = 'failed'
+        try:
+            if self.jobs > 1:
+                self._cook_in_parallel(ordered_recipes)
+            else:
+                self._cook_serially(ordered_recipes)
+            if self._compiler_cache_stats:
+                self._print_compiler_cache_stats()
+            if self._slowest_targets:
+                self._print_slowest_targets()
+            if self._failed:
+                self._print_failures()
+                raise FatalError(_("%d recipes failed to build") %
+                                 len(self._failed))
+            status = 'success'
+        except AbortedError:
+            status = 'aborted'
+            raise
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.shutdown()
+                self.prefetcher = None
+            if own_jobserver:
+                jobserver.stop()
+            if self.artifacts is not None:
+                self.artifacts.close()
+                self.artifacts = None
+            if self.history is not None:
+                self.history.finish_run(self._run_id, status)
+                self.history.close()
+                self.history = None
+
+    def _cook_serially(self, ordered_recipes):
         i = 1
         for recipe in ordered_recipes:
+            if self._failed and self._block(recipe, i, len(ordered_recipes)):
+                i += 1
+                continue
             try:
                 self._cook_recipe(recipe, i, len(ordered_recipes))
             except BuildStepError as be:
+                if self.keep_going:
+                    self._recipe_failed(recipe, be)
+                    i += 1
+                    continue
                 if not self.interactive:
                     raise be
-                msg = be.msg
-                msg += _("Select an action to proceed:")
-                action = shell.prompt_multiple(msg, RecoveryActions())
+                action = self._recovery_action(recipe, be)
                 if action == RecoveryActions.SHELL:
-                    shell.enter_build_environment(self.config.target_platform,
-                            be.arch, recipe.get_for_arch (be.arch, 'build_dir'))
                     break
-                elif action == RecoveryActions.RETRY_ALL:
-                    shutil.rmtree(recipe.get_for_arch (be.arch, 'build_dir'))
-                    self.cookbook.reset_recipe_status(recipe.name)
-                    self._cook_recipe(recipe, i, len(ordered_recipes))
-                elif action == RecoveryActions.RETRY_STEP:
+                elif action in [RecoveryActions.RETRY_ALL,
+                                RecoveryActions.RETRY_STEP]:
                     self._cook_recipe(recipe, i, len(ordered_recipes))
                 elif action == RecoveryActions.SKIP:
                     continue
@@ -117,44 +208,297 @@ class Oven (object):
                     raise AbortedError()
             i += 1
 
+    def _cook_in_parallel(self, ordered_recipes):
+        '''
+        Cooks the recipes following the dependency graph, starting each recipe
+        in a worker thread as soon as all its dependencies are built. Among
+        the recipes ready to be built, the ones with the longest chain of
+        recipes depending on them go first.
+        '''
+        total = len(ordered_recipes)
+        counts = dict([(r.name, i + 1) for i, r in enumerate(ordered_recipes)])
+        priorities = self.cookbook.critical_path(list(counts.keys()),
+                                                 not self.force)
+
+        def sort_key(recipe):
+            return (-priorities[recipe.name], counts[recipe.name])
+
+        # Only wait for the dependencies that are part of this build
+        waiting = {}
+        for recipe in ordered_recipes:
+            deps = self.cookbook.list_recipe_direct_deps(recipe.name)
+            waiting[recipe] = set([x for x in deps if x in counts])
+        ready = [r for r in ordered_recipes if not waiting[r]]
+        for recipe in ready:
+            del waiting[recipe]
+        ready.sort(key=sort_key)
+        running = {}
+        finished = queue.Queue()
+        error = None
+
+        def cook(recipe):
+            try:
+                self._cook_recipe(recipe, counts[recipe.name], total)
+                finished.put((recipe, None))
+            except Exception as ex:
+                finished.put((recipe, ex))
+
+        while ready or running:
+            while ready and error is None and len(running) < self.jobs:
+                recipe = ready.pop(0)
+                thread = threading.Thread(target=cook, args=(recipe,),
+                                          name=recipe.name)
+                thread.daemon = True
+                running[recipe] = thread
+                thread.start()
+            if not running:
+                break
+
+            recipe, ex = finished.get()
+            running.pop(recipe).join()
+            if ex is not None and error is None and self.keep_going and \
+                    isinstance(ex, BuildStepError):
+                self._recipe_failed(recipe, ex)
+                # None of the recipes depending on it can be built now
+                for r in list(waiting.keys()):
+                    if self._block(r, counts[r.name], total):
+                        del waiting[r]
+                continue
+            elif ex is not None and error is None:
+                if not self.interactive or \
+                        not isinstance(ex, BuildStepError):
+                    # Let the running recipes finish before raising
+                    error = ex
+                    continue
+                action = self._recovery_action(recipe, ex)
+                if action == RecoveryActions.SHELL:
+                    error = AbortedError()
+                    continue
+                elif action in [RecoveryActions.RETRY_ALL,
+                                RecoveryActions.RETRY_STEP]:
+                    ready.insert(0, recipe)
+                    continue
+                elif action == RecoveryActions.ABORT:
+                    error = AbortedError()
+                    continue
+            elif ex is not None:
+                continue
+
+            # The recipe is built (or skipped), schedule the ones depending
+            # on it that have all their dependencies ready
+            for r, deps in list(waiting.items()):
+                deps.discard(recipe.name)
+                if not deps:
+                    del waiting[r]
+                    ready.append(r)
+            ready.sort(key=sort_key)
+
+        if error is not None:
+            raise error
+
+    def _recipe_failed(self, recipe, error):
+        self._failed[recipe.name] = error
+        m.warning(error.msg)
+        m.warning(_("Building the recipes that don't depend on %s") %
+                  recipe.name)
+
+    def _block(self, recipe, count, total):
+        '''
+        Skips a recipe if any of its dependencies failed to build
+
+        @return: whether the recipe was blocked
+        @rtype: bool
+        '''
+        deps = [x.name for x in self.cookbook.list_recipe_deps(recipe.name)]
+        failed = [x for x in deps if x in self._failed and x != recipe.name]
+        if not failed:
+            return False
+        self._blocked[recipe.name] = failed
+        m.build_step(count, total, recipe.name,
+                     _("blocked by %s") % ', '.join(failed))
+        self._record_recipe(recipe, time.time(), RecipeResult.BLOCKED)
+        return True
+
+    def _print_failures(self):
+        m.message(_("The following recipes failed to build:"))
+        for name, error in self._failed.items():
+            recipe = self.cookbook.get_recipe(name)
+            m.message('  %s (%s): %s' % (name, error.step,
+                      self._step_log(recipe, error.step, error.arch)))
+        if self._blocked:
+            m.message(_("The following recipes were not built because "
+                        "they depend on them:"))
+            for name, failed in self._blocked.items():
+                m.message('  %s (%s)' % (name, ', '.join(failed)))
+
+    def _print_compiler_cache_stats(self):
+        m.message(_("Compiler cache hits:"))
+        total_hits = total_misses = 0
+        for name, (hits, misses) in sorted(
+                self._compiler_cache_stats.items()):
+            m.message('  %s: %s' % (name, self._cache_ratio(hits, misses)))
+            total_hits += hits
+            total_misses += misses
+        m.message('  %s: %s' % (_("total"),
+                  self._cache_ratio(total_hits, total_misses)))
+
+    def _print_slowest_targets(self):
+        timings = []
+        for name, targets in self._slowest_targets.items():
+            timings += [(k, '%s: %s' % (name, t), d) for k, t, d in targets]
+        for kind, title in [
+                (ninjalog.TargetKind.COMPILE, _("Slowest compilation units:")),
+                (ninjalog.TargetKind.LINK, _("Slowest link steps:"))]:
+            targets = [x for x in ninjalog.slowest_targets(timings)
+                       if x[0] == kind]
+            if not targets:
+                continue
+            m.message(title)
+            for kind, target, duration in targets:
+                m.message('  %-60s %8.1fs' % (target, duration))
+
+    def _cache_ratio(self, hits, misses):
+        ratio = 0
+        if hits + misses:
+            ratio = 100 * hits // (hits + misses)
+        return _("%d hits, %d misses (%d%%)") % (hits, misses, ratio)
+
+    def _step_log(self, recipe, step, arch):
+        log = "%s/%s-%s.log" % (recipe.config.logs, recipe, step)
+        if arch:
+            # the architectures of universal recipes built concurrently
+            # have their own log
+            arch_log = os.path.join(recipe.get_for_arch(arch, 'config').logs,
+                                    '%s-%s-%s.log' % (recipe.name, step, arch))
+            if os.path.exists(arch_log):
+                return arch_log
+        return log
+
+    def _recovery_action(self, recipe, be):
+        msg = be.msg
+        msg += _("Select an action to proceed:")
+        action = shell.prompt_multiple(msg, RecoveryActions())
+        if action == RecoveryActions.SHELL:
+            shell.enter_build_environment(self.config.target_platform,
+                    be.arch, recipe.get_for_arch (be.arch, 'build_dir'))
+        elif action == RecoveryActions.RETRY_ALL:
+            shutil.rmtree(recipe.get_for_arch (be.arch, 'build_dir'))
+            self.cookbook.reset_recipe_status(recipe.name)
+        return action
+
     def _cook_recipe(self, recipe, count, total):
-        if not self.cookbook.recipe_needs_build(recipe.name) and \
-                not self.force:
+        reason = self.cookbook.rebuild_reason(recipe.name)
+        if reason is None and not self.force:
             m.build_step(count, total, recipe.name, _("already built"))
+            self._record_recipe(recipe, time.time(), RecipeResult.UP_TO_DATE)
             return
+        if self.cookbook.changed_deps(recipe.name):
+            # Built against older builds of its dependencies
+            m.action(_("Rebuilding %s, %s") % (recipe.name, reason))
+            self.cookbook.reset_recipe_status(recipe.name, reason)
 
-        if self.missing_files:
-            # create a temp file that will be used to find newer files
-            tmp = tempfile.NamedTemporaryFile()
+        start = time.time()
+        if self.artifacts is not None and not self.force:
+            with trace.span(recipe.name, 'artifact'):
+                restored = self.artifacts.restore(recipe)
+            if restored:
+                m.build_step(count, total, recipe.name,
+                             _("restored from the artifact cache"))
+                for desc, step in recipe.steps:
+                    if not self.cookbook.step_done(recipe.name, step):
+                        self.cookbook.update_step_status(recipe.name, step)
+                self.cookbook.update_build_status(recipe.name,
+                                                  recipe.built_version())
+                self._record_recipe(recipe, start, RecipeResult.BUILT, True)
+                return
+
+        try:
+            with trace.span(recipe.name, 'recipe'):
+                self._cook_recipe_steps(recipe, count, total)
+        except Exception:
+            self._record_recipe(recipe, start, RecipeResult.FAILED)
+            raise
+        self._record_recipe(recipe, start, RecipeResult.BUILT)
+        if self.artifacts is not None:
+            # the cache key depends on the sources, which are fetched now
+            self.artifacts.invalidate(recipe.name)
+            with trace.span(recipe.name, 'artifact'):
+                files = self.cookbook.recipe_manifest(recipe.name)
+                if files is None:
+                    files = recipe.files_list()
+                self.artifacts.save(recipe, sorted(files))
+
+    def _record_recipe(self, recipe, start, status, cache_hit=False):
+        if self.history is not None:
+            self.history.add_recipe(self._run_id, recipe.name, start,
+                                    time.time() - start, status, cache_hit)
+
+    def _record_step(self, recipe, step, start, status):
+        if self.history is not None:
+            self.history.add_step(self._run_id, recipe.name, step, start,
+                                  time.time() - start, status)
+
+    def _cook_recipe_steps(self, recipe, count, total):
+        if self.prefetcher is not None:
+            self.prefetcher.advance(recipe)
 
         recipe.force = self.force
+        recipe.force_configure = self.force_configure
+        recipe.deps_fingerprints = self.cookbook.deps_fingerprints(
+            recipe.name)
         for desc, step in recipe.steps:
             m.build_step(count, total, recipe.name, step)
+            if self.prefetcher is not None:
+                # wait for the step if it's being run in the background and
+                # treat a failure like one of the step run here
+                try:
+                    self.prefetcher.wait(recipe, step)
+                except FatalError as e:
+                    self._handle_build_step_error(recipe, step, e.arch)
+                except Exception:
+                    raise BuildStepError(recipe, step, traceback.format_exc())
             # check if the current step needs to be done
             if self.cookbook.step_done(recipe.name, step) and not self.force:
                 m.action(_("Step done"))
                 continue
+            start = time.time()
             try:
                 # call step function
-                stepfunc = getattr(recipe, step)
-                if not stepfunc:
+                if not getattr(recipe, step, None):
                     raise FatalError(_('Step %s not found') % step)
                 shell.set_logfile_output("%s/%s-%s.log" % (recipe.config.logs, recipe, step))
-                stepfunc()
+                with trace.span(step, _step_category(step), recipe=recipe.name):
+                    manifest = recipe.run_step(step)
+                if manifest is not None:
+                    self.cookbook.update_manifest(recipe.name, manifest,
+                        step == BuildSteps.INSTALL[1])
+                if step == BuildSteps.COMPILE[1]:
+                    stats = recipe.compiler_cache_stats()
+                    if stats is not None:
+                        self._compiler_cache_stats[recipe.name] = stats
+                    targets = recipe.slowest_targets()
+                    if targets:
+                        self._slowest_targets[recipe.name] = targets
+                        if self.history is not None:
+                            self.history.add_targets(self._run_id,
+                                                     recipe.name, targets)
                 # update status successfully
-                self.cookbook.update_step_status(recipe.name, step)
+                self.cookbook.update_step_status(recipe.name, step,
+                                                 time.time() - start)
+                self._record_step(recipe, step, start, StepResult.OK)
                 shell.close_logfile_output()
             except FatalError as e:
+                self._record_step(recipe, step, start, StepResult.FAILED)
                 shell.close_logfile_output(dump=True)
                 self._handle_build_step_error(recipe, step, e.arch)
             except Exception:
+                self._record_step(recipe, step, start, StepResult.FAILED)
                 shell.close_logfile_output(dump=True)
                 raise BuildStepError(recipe, step, traceback.format_exc())
         self.cookbook.update_build_status(recipe.name, recipe.built_version())
 
         if self.missing_files:
-            self._print_missing_files(recipe, tmp)
-            tmp.close()
+            self._print_missing_files(recipe)
 
     def _handle_build_step_error(self, recipe, step , arch):
         if step in [BuildSteps.FETCH, BuildSteps.EXTRACT]:
@@ -164,10 +508,9 @@ class Oven (object):
             self.cookbook.reset_recipe_status(recipe.name)
         raise BuildStepError(recipe, step, arch=arch)
 
-    def _print_missing_files(self, recipe, tmp):
+    def _print_missing_files(self, recipe):
         recipe_files = set(recipe.files_list())
-        installed_files = set(shell.find_newer_files(recipe.config.prefix,
-                                                     tmp.name))
+        installed_files = set(self.cookbook.recipe_manifest(recipe.name) or [])
         not_in_recipe = list(installed_files - recipe_files)
         not_installed = list(recipe_files - installed_files)
 
@@ -180,3 +523,134 @@ class Oven (object):
             m.message(_("The following files are listed in the recipe, but "
                         "were not installed:"))
             m.message('\n'.join(sorted(not_installed)))
+
+
+class Prefetcher (object):
+    '''
+    Runs the source steps of the recipes that are going to be cooked next in a
+    pool of background workers, so that downloads and extractions overlap with
+    the build of the current recipes
+
+    @ivar recipes: recipes in build order
+    @type recipes: list
+    @ivar cookbook: Cookbook with the recipes status
+    @type: L{cerberos.cookbook.CookBook}
+    @ivar lookahead: number of recipes after the current one to prefetch
+    @type lookahead: int
+    @ivar steps: steps run in the background
+    @type steps: list
+    @ivar force: run the steps ignoring their cached state
+    @type force: bool
+    @ivar record_step: function called with the recipe, the step, its start
+                       time and its L{StepResult} after running a step
+    @type record_step: function
+    '''
+
+    def __init__(self, recipes, cookbook, lookahead, extract=False,
+                 force=False, record_step=None):
+        self.recipes = recipes
+        self.cookbook = cookbook
+        self.lookahead = lookahead
+        self.force = force
+        self.record_step = record_step
+        self.steps = [BuildSteps.FETCH[1]]
+        if extract:
+            self.steps.append(BuildSteps.EXTRACT[1])
+        self._positions = dict([(r.name, i) for i, r in enumerate(recipes)])
+        self._next = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=lookahead)
+
+    def advance(self, recipe):
+        '''
+        Schedules the prefetch of the recipes following @recipe in the build
+        order, up to the lookahead
+
+        @param recipe: recipe starting to be cooked
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        '''
+        with self._lock:
+            pos = self._positions.get(recipe.name)
+            if pos is None:
+                return
+            start = max(self._next, pos + 1)
+            end = min(pos + self.lookahead + 1, len(self.recipes))
+            for r in self.recipes[start:end]:
+                steps = self._pending_steps(r)
+                if steps:
+                    self._jobs[r.name] = self._pool.submit(self._prefetch, r,
+                                                           steps)
+            self._next = max(self._next, end)
+
+    def wait(self, recipe, step):
+        '''
+        Waits for a step of a recipe being prefetched and raises the error
+        if it failed. If the prefetch did not start yet, it's cancelled and
+        the step is left to the caller.
+
+        @param recipe: recipe being cooked
+        @type recipe: L{cerbero.build.recipe.Recipe}
+        @param step: name of the step
+        @type step: str
+        '''
+        if step not in self.steps:
+            return
+        with self._lock:
+            job = self._jobs.get(recipe.name)
+            if job is None:
+                return
+            if job.cancel():
+                del self._jobs[recipe.name]
+                return
+        result = job.result()
+        if result is None or result[0] != step:
+            return
+        with self._lock:
+            self._jobs.pop(recipe.name, None)
+        failed_step, logfile, ex = result
+        if os.path.exists(logfile):
+            with open(logfile, 'r') as f:
+                m.error(f.read().rstrip('\n'))
+        raise ex
+
+    def shutdown(self):
+        '''
+        Cancels the pending prefetches and waits for the running ones
+        '''
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
+            self._jobs = {}
+        self._pool.shutdown(wait=True)
+
+    def _pending_steps(self, recipe):
+        if not self.force and \
+                not self.cookbook.recipe_needs_build(recipe.name):
+            return []
+        return [s for d, s in recipe.steps if s in self.steps and
+                (self.force or not self.cookbook.step_done(recipe.name, s))]
+
+    def _record_step(self, recipe, step, start, status):
+        if self.record_step is not None:
+            self.record_step(recipe, step, start, status)
+
+    def _prefetch(self, recipe, steps):
+        recipe.force = self.force
+        for step in steps:
+            logfile = "%s/%s-%s.log" % (recipe.config.logs, recipe, step)
+            shell.set_logfile_output(logfile)
+            start = time.time()
+            try:
+                with trace.span(step, _step_category(step), recipe=recipe.name,
+                                prefetch=True):
+                    getattr(recipe, step)()
+            except Exception as ex:
+                self._record_step(recipe, step, start, StepResult.FAILED)
+                shell.close_logfile_output()
+                return (step, logfile, ex)
+            self.cookbook.update_step_status(recipe.name, step,
+                                             time.time() - start)
+            self._record_step(recipe, step, start, StepResult.OK)
+            shell.close_logfile_output()
+        return None
@@ -18,22 +18,29 @@
 
 import os
 import logging
-import shutil
-import tempfile
-import time
 
-from cerbero.build import build, source
+from cerbero.build import build, ninjalog, source, staging
 from cerbero.build.filesprovider import FilesProvider
 from cerbero.config import Platform
 from cerbero.errors import FatalError
 from cerbero.ide.vs.genlib import GenLib
 from cerbero.tools.osxuniversalgenerator import OSXUniversalGenerator
 from cerbero.utils import N_, _
-from cerbero.utils import shell
+from cerbero.utils import shell, trace
 from cerbero.utils import messages as m
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
 
+def _copy_container(value):
+    # Copies the lists and dicts without copying the objects they contain
+    if isinstance(value, list):
+        return [_copy_container(x) for x in value]
+    if isinstance(value, dict):
+        return dict([(k, _copy_container(v)) for k, v in value.items()])
+    return value
+
+
 class MetaRecipe(type):
     ''' This metaclass modifies the base classes of a Receipt, adding 2 new
     base classes based on the class attributes 'stype' and 'btype'.
@@ -125,6 +132,11 @@ class Recipe(FilesProvider, metaclass=MetaRecipe):
 
     def __init__(self, config):
         self.config = config
+        # The class of the recipe is shared by the recipes of each
+        # architecture, which must not modify its lists and dicts in prepare()
+        for name, value in list(type(self).__dict__.items()):
+            if isinstance(value, (list, dict)):
+                setattr(self, name, _copy_container(value))
         if self.package_name is None:
             self.package_name = "%s-%s" % (self.name, self.version)
         if not hasattr(self, 'repo_dir'):
@@ -254,6 +266,32 @@ class Recipe(FilesProvider, metaclass=MetaRecipe):
         '''
         return os.path.abspath(os.path.join(self.recipe_dir(), path))
 
+    def run_step(self, step, dest_prefix=None, exclude=None):
+        '''
+        Runs a build step
+
+        @param step: name of the step
+        @type step: str
+        @param dest_prefix: where the files installed are moved, defaults to
+                            the prefix
+        @type dest_prefix: str
+        @param exclude: top level directories of the prefix not owned by
+                        this recipe
+        @type exclude: list
+        @return: for the install steps, the manifest of the installed files
+                 as returned by L{cerbero.build.staging.install}
+        @rtype: dict
+        '''
+        if step not in staging.INSTALL_STEPS:
+            getattr(self, step)()
+            return None
+        if step == BuildSteps.INSTALL[1]:
+            scan = not staging.stages_install(self)
+        else:
+            # Most recipes don't have a post install step
+            scan = type(self).post_install is not Recipe.post_install
+        return staging.install(self, step, scan, dest_prefix, exclude)
+
     @property
     def steps(self):
         return self._steps
@@ -335,10 +373,55 @@ class UniversalRecipe(object, metaclass=MetaUniversalRecipe):
         else:
             return getattr (self, name)
 
+    def compiler_cache_stats(self):
+        '''
+        Gets the hits and misses of the compiler cache in the last compile
+        step of all the architectures
+
+        @return: number of hits and misses, or None if they are unknown
+        @rtype: tuple
+        '''
+        stats = [r.compiler_cache_stats() for r in self._recipes.values()]
+        stats = [x for x in stats if x is not None]
+        if not stats:
+            return None
+        return tuple([sum(x) for x in zip(*stats)])
+
+    def slowest_targets(self):
+        '''
+        Gets the slowest compilation units and link steps of the last
+        compile step of all the architectures
+
+        @return: list of (kind, output, duration), or None if they are
+                 unknown
+        @rtype: list
+        '''
+        timings = [r.slowest_targets() for r in self._recipes.values()]
+        timings = [x for x in timings if x is not None]
+        if not timings:
+            return None
+        return ninjalog.slowest_targets(sum(timings, []))
+
+    def _arch_lane(self, arch):
+        return '%s (%s)' % (self.name, arch)
+
+    def run_step(self, step):
+        '''
+        Runs a build step for all the architectures
+
+        @param step: name of the step
+        @type step: str
+        @return: for the install steps, the manifest of the files installed
+                 for all the architectures, relative to the prefix
+        @rtype: dict
+        '''
+        return getattr(self, step)()
+
     def _do_step(self, step):
         if step in BuildSteps.FETCH:
             # No, really, let's not download a million times...
-            stepfunc = getattr(list(self._recipes.values())[0], step)
+            arch, recipe = list(self._recipes.items())[0]
+            stepfunc = getattr(recipe, step)
             try:
                 stepfunc()
             except FatalError as e:
@@ -346,17 +429,73 @@ class UniversalRecipe(object, metaclass=MetaUniversalRecipe):
                 raise e
             return
 
-        for arch, recipe in self._recipes.items():
-            config = self._config.arch_config[arch]
-            config.do_setup_env()
-            stepfunc = getattr(recipe, step)
+        return self._do_archs_step(step)
 
-            # Call the step function
-            try:
-                stepfunc()
-            except FatalError as e:
-                e.arch = arch
-                raise e
+    def _do_archs_step(self, step):
+        '''
+        Runs a step for all the architectures concurrently, as each one has
+        its own config, build dir and prefix. Returns when all of them are
+        done, raising the error of the first one that failed.
+        '''
+        archs = list(self._recipes.keys())
+        if len(archs) == 1:
+            return self._do_arch_step(archs[0], step)
+        if self._concurrent_step(step):
+            with ThreadPoolExecutor(len(archs)) as executor:
+                futures = [executor.submit(self._do_arch_step, arch, step,
+                                           True) for arch in archs]
+            results = [future.result() for future in futures]
+        else:
+            # Run in the caller's thread, logging to its log file
+            results = [self._do_arch_step(arch, step) for arch in archs]
+        manifest = None
+        for result in results:
+            if result is not None:
+                manifest = manifest or {}
+                manifest.update(result)
+        return manifest
+
+    def _do_arch_step(self, arch, step, own_logfile=False):
+        recipe = self._recipes[arch]
+        config = self._config.arch_config[arch]
+        if own_logfile:
+            shell.set_logfile_output(os.path.join(config.logs,
+                '%s-%s-%s.log' % (self.name, step, arch)))
+        # Call the step function
+        try:
+            with shell.environment(config.get_build_env()), \
+                    trace.span(step, 'arch', self._arch_lane(arch)):
+                dest_prefix = self._arch_prefix(arch)
+                manifest = recipe.run_step(step, dest_prefix,
+                                           self._arch_exclude())
+        except FatalError as e:
+            e.arch = arch
+            if own_logfile:
+                shell.close_logfile_output(dump=True)
+            raise e
+        except Exception:
+            if own_logfile:
+                shell.close_logfile_output(dump=True)
+            raise
+        if own_logfile:
+            shell.close_logfile_output()
+        if manifest is None:
+            return None
+        # Make the paths relative to the universal prefix
+        dest_prefix = dest_prefix or recipe.config.prefix
+        return dict([(os.path.relpath(os.path.join(dest_prefix, f),
+                                      self._config.prefix), e)
+                     for f, e in manifest.items()])
+
+    def _concurrent_step(self, step):
+        return True
+
+    def _arch_prefix(self, arch):
+        # Each architecture is configured with its own prefix
+        return None
+
+    def _arch_exclude(self):
+        return []
 
 
 class UniversalFlatRecipe(UniversalRecipe):
@@ -406,53 +545,18 @@ class UniversalFlatRecipe(UniversalRecipe):
             stepfunc()
             return
 
-        # For the universal build we need to configure both architectures with
-        # with the same final prefix, but we want to install each architecture
-        # on a different path (eg: /path/to/prefix/x86).
+        return self._do_archs_step(step)
 
-        archs_prefix = list(self._recipes.keys())
+    def _concurrent_step(self, step):
+        # All the architectures install in the same prefix before their files
+        # are moved to their own directory
+        return step not in staging.INSTALL_STEPS
 
-        for arch, recipe in self._recipes.items():
-            config = self._config.arch_config[arch]
-            config.do_setup_env()
-            stepfunc = getattr(recipe, step)
-
-            # Create a stamp file to list installed files based on the
-            # modification time of this file
-            if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
-                time.sleep(2) #wait 2 seconds to make sure new files get the
-                              #proper time difference, this fixes an issue of
-                              #the next recipe to be built listing the previous
-                              #recipe files as their own
-                tmp = tempfile.NamedTemporaryFile()
-                # the modification time resolution depends on the filesystem,
-                # where FAT32 has a resolution of 2 seconds and ext4 1 second
-                t = time.time() - 2
-                os.utime(tmp.name, (t, t))
-
-            # Call the step function
-            stepfunc()
+    def _arch_prefix(self, arch):
+        # For the universal build we need to configure all the architectures
+        # with the same final prefix, but we want to install each
+        # architecture on a different path (eg: /path/to/prefix/x86).
+        return os.path.join(self._config.prefix, arch)
 
-            # Move installed files to the architecture prefix
-            if step in [BuildSteps.INSTALL[1], BuildSteps.POST_INSTALL[1]]:
-                installed_files = shell.find_newer_files(self._config.prefix,
-                                                         tmp.name, True)
-                tmp.close()
-                for f in installed_files:
-
-                    def not_in_prefix(src):
-                        for p in archs_prefix + ['Libraries']:
-                            if src.startswith(p):
-                                return True
-                        return False
-
-                    # skip files that are installed in the arch prefix
-                    if not_in_prefix(f):
-                        continue
-                    src = os.path.join(self._config.prefix, f)
-
-                    dest = os.path.join(self._config.prefix,
-                                        recipe.config.target_arch, f)
-                    if not os.path.exists(os.path.dirname(dest)):
-                        os.makedirs(os.path.dirname(dest))
-                    shutil.move(src, dest)
+    def _arch_exclude(self):
+        return list(self._recipes.keys()) + ['Libraries']
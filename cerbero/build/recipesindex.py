@@ -0,0 +1,115 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import os
+
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+INDEX_EXT = '.index'
+# Bumped when the format of the index changes
+INDEX_VERSION = 1
+
+
+def index_path(cache_file):
+    '''
+    Gets the path of the recipes index of the configuration using a status
+    cache file
+
+    @param cache_file: path of the cache file
+    @type cache_file: str
+    @return: path of the index
+    @rtype: str
+    '''
+    return os.path.splitext(cache_file)[0] + INDEX_EXT
+
+
+def recipe_entry(recipe, repo):
+    '''
+    Describes a recipe for the index
+
+    @param recipe: the recipe
+    @type recipe: L{cerbero.build.recipe.Recipe}
+    @param repo: recipes repository of the recipe
+    @type repo: str
+    @return: dictionary with the metadata of the recipe
+    @rtype: dict
+    '''
+    stype = recipe.stype
+    return {'file': recipe.__file__, 'repo': repo,
+            'deps': list(recipe.list_deps()), 'version': recipe.version,
+            'stype': getattr(stype, '__name__', str(stype)),
+            'runtime_dep': bool(recipe.runtime_dep)}
+
+
+class RecipesIndex (object):
+    '''
+    Metadata of the recipes of a configuration, so that only the recipes
+    needed can be loaded. The index is only valid for the signature it was
+    saved with, that changes with the configuration and the recipe files.
+
+    @ivar path: path of the index
+    @type path: str
+    @ivar recipes: L{recipe_entry} of each recipe by name
+    @type recipes: dict
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.recipes = {}
+
+    def load(self, signature):
+        '''
+        Loads the index
+
+        @param signature: signature of the current recipes
+        @type signature: str
+        @return: whether the index is up to date
+        @rtype: bool
+        '''
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != INDEX_VERSION or \
+                data.get('signature') != signature:
+            return False
+        self.recipes = data['recipes']
+        return True
+
+    def save(self, signature, recipes):
+        '''
+        Saves the index
+
+        @param signature: signature of the current recipes
+        @type signature: str
+        @param recipes: L{recipe_entry} of each recipe by name
+        @type recipes: dict
+        '''
+        self.recipes = recipes
+        data = {'version': INDEX_VERSION, 'signature': signature,
+                'recipes': recipes}
+        try:
+            with shell.atomic_write(self.path) as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+        except (OSError, TypeError, ValueError) as ex:
+            m.warning(_("Could not save the recipes index %s: %s") %
+                      (self.path, ex))
@@ -172,24 +172,20 @@ class GitCache (Source):
             self.remotes['origin'] = '%s/%s.git' % \
                                      (self.config.git_root, self.name)
         self.repo_dir = os.path.join(self.config.local_sources, self.name)
-        self._previous_env = None
 
-    def _git_env_setup(self):
+    def _git_env(self):
         # When running git commands, which is the host git, we need to make
         # sure it is run in an environment which doesn't pick up the libraries
         # we build in cerbero
-        env = os.environ.copy()
-        self._previous_env = os.environ.copy()
+        env = shell.Environment(self.config.get_build_env())
         env["LD_LIBRARY_PATH"] = self.config._pre_environ.get("LD_LIBRARY_PATH", "")
-        os.environ = env
-
-    def _git_env_restore(self):
-        if self._previous_env is not None:
-            os.environ = self._previous_env
-            self._previous_env = None
+        return env
 
     def fetch(self, checkout=True):
-        self._git_env_setup()
+        with shell.environment(self._git_env()):
+            self._fetch(checkout)
+
+    def _fetch(self, checkout):
         if not os.path.exists(self.repo_dir):
             git.init(self.repo_dir)
 
@@ -215,7 +211,6 @@ class GitCache (Source):
             commit = self.config.recipe_commit(self.name) or self.commit
             git.checkout(self.repo_dir, commit)
             git.submodules_update(self.repo_dir, cached_dir, fail=False)
-        self._git_env_restore()
 
 
     def built_version(self):
@@ -0,0 +1,320 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+# Steps installing files in the prefix
+INSTALL_STEPS = ['install', 'post_install']
+
+# Seconds subtracted from the start of an install step when looking for the
+# files it modified, as file systems store times with less precision
+MTIME_SLACK = 2
+
+# Serializes the steps whose files are found scanning the prefix, as the
+# files installed by two of them running at once can't be told apart
+_scan_lock = threading.RLock()
+# Guards the active prefix watches
+_prefix_lock = threading.Lock()
+_watches = []
+
+
+class FileType (object):
+    '''
+    Enumeration factory for the type of the files in a manifest
+    '''
+
+    FILE = 'file'
+    SYMLINK = 'symlink'
+
+
+def file_entry(path):
+    '''
+    Describes an installed file for a manifest
+
+    @param path: path of the file
+    @type path: str
+    @return: tuple with the size, the sha256 of the contents (or of the
+             target for symbolic links) and the L{FileType}
+    @rtype: tuple
+    '''
+    if os.path.islink(path):
+        target = os.readlink(path)
+        return (0, hashlib.sha256(target.encode('utf-8')).hexdigest(),
+                FileType.SYMLINK)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return (os.path.getsize(path), h.hexdigest(), FileType.FILE)
+
+
+def walk_files(root):
+    '''
+    Lists the files and symbolic links in a directory, recursively
+
+    @param root: the directory
+    @type root: str
+    @return: list of paths relative to root
+    @rtype: list
+    '''
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        # Symbolic links to directories are not followed, they are files
+        for d in dirnames:
+            if os.path.islink(os.path.join(dirpath, d)):
+                filenames.append(d)
+        for f in filenames:
+            files.append(os.path.normpath(os.path.join(rel, f)))
+    return files
+
+
+class PrefixSnapshot (object):
+    '''
+    State of the files of a prefix, used to find out which ones were
+    installed by a step writing directly in the prefix
+
+    @ivar prefix: the prefix
+    @type prefix: str
+    @ivar exclude: top level directories left out
+    @type exclude: list
+    '''
+
+    def __init__(self, prefix, exclude=None):
+        self.prefix = prefix
+        self.exclude = exclude or []
+        self.files = {}
+        if os.path.isdir(prefix):
+            self._scan(prefix, '')
+
+    def changes(self):
+        '''
+        Lists the files added or modified since the snapshot was taken
+
+        @return: list of paths relative to the prefix
+        @rtype: list
+        '''
+        current = PrefixSnapshot(self.prefix, self.exclude).files
+        return sorted([f for f, st in current.items()
+                       if self.files.get(f) != st])
+
+    def modified_since(self, started):
+        '''
+        Lists the files of the snapshot modified after a given time
+
+        @param started: the time, as returned by time.time()
+        @type started: float
+        @return: list of paths relative to the prefix
+        @rtype: list
+        '''
+        started = int(started * 1e9)
+        return sorted([f for f, st in self.files.items()
+                       if st[1] >= started])
+
+    def _scan(self, path, rel):
+        for name in os.listdir(path):
+            relpath = os.path.join(rel, name)
+            if not rel and name in self.exclude:
+                continue
+            fullpath = os.path.join(path, name)
+            st = os.lstat(fullpath)
+            if stat.S_ISDIR(st.st_mode):
+                self._scan(fullpath, relpath)
+            else:
+                self.files[relpath] = (st.st_size, st.st_mtime_ns, st.st_ino,
+                                       stat.S_ISLNK(st.st_mode))
+
+
+class PrefixWatch (object):
+    '''
+    Context recording the files moved to the prefix by the staged installs
+    while it's active, so that a step writing directly in the prefix at the
+    same time doesn't take them for its own
+
+    @ivar moved: absolute paths of the files moved
+    @type moved: set
+    '''
+
+    def __init__(self):
+        self.moved = set()
+
+    def __enter__(self):
+        with _prefix_lock:
+            _watches.append(self)
+        return self
+
+    def __exit__(self, *args):
+        with _prefix_lock:
+            _watches.remove(self)
+
+
+def _move(src, dest):
+    if os.path.isdir(dest) and not os.path.islink(dest):
+        shutil.rmtree(dest)
+    destdir = os.path.dirname(dest)
+    if not os.path.isdir(destdir):
+        os.makedirs(destdir)
+    try:
+        os.replace(src, dest)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+        if os.path.lexists(dest):
+            os.remove(dest)
+        shutil.move(src, dest)
+
+
+def _remove_empty_dirs(root, rel):
+    # Removes the directories left empty in root after moving a file
+    while rel:
+        path = os.path.join(root, rel)
+        if not os.path.isdir(path) or os.listdir(path):
+            break
+        os.rmdir(path)
+        rel = os.path.dirname(rel)
+
+
+def stages_install(recipe):
+    '''
+    Whether all the files installed by the install step of a recipe go to
+    DESTDIR. It's not the case for the custom build type, when the recipe
+    overrides the install step of its build type or when it sets
+    staged_install to False because its install step ignores DESTDIR.
+
+    @param recipe: the recipe
+    @type recipe: L{cerbero.build.recipe.Recipe}
+    @rtype: bool
+    '''
+    if not getattr(recipe, 'staged_install', False):
+        return False
+    # DESTDIR is prepended to the prefix, which is not possible with drive
+    # letters
+    if os.path.splitdrive(recipe.config.prefix)[0]:
+        return False
+    return getattr(type(recipe), 'install', None) is \
+        getattr(recipe.btype, 'install', None)
+
+
+def install(recipe, step, scan, dest_prefix=None, exclude=None):
+    '''
+    Runs an install step of a recipe and lists the files it installed.
+
+    The install step of the build systems supporting it is run with a
+    temporary DESTDIR, whose files are moved to the prefix afterwards. If it
+    ignored DESTDIR, the files it installed are the ones of the prefix
+    modified while it ran. The steps writing directly in the prefix are found
+    by comparing the prefix before and after the step, one at a time.
+
+    @param recipe: the recipe
+    @type recipe: L{cerbero.build.recipe.Recipe}
+    @param step: one of L{INSTALL_STEPS}
+    @type step: str
+    @param scan: whether the step might write directly in the prefix
+    @type scan: bool
+    @param dest_prefix: where the installed files are moved, defaults to
+                        the prefix of the recipe
+    @type dest_prefix: str
+    @param exclude: top level directories of the prefix not owned by this
+                    recipe
+    @type exclude: list
+    @return: manifest of the installed files, a dictionary with their
+             L{file_entry} by path relative to dest_prefix
+    @rtype: dict
+    '''
+    prefix = recipe.config.prefix
+    if dest_prefix is None:
+        dest_prefix = prefix
+    manifest = {}
+
+    destdir = None
+    if step == 'install' and stages_install(recipe):
+        parent = os.path.dirname(recipe.build_dir)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        destdir = tempfile.mkdtemp(prefix='%s-destdir-' % recipe.name,
+                                   dir=parent)
+    if scan:
+        _scan_lock.acquire()
+
+    recipe.destdir = destdir
+    try:
+        with PrefixWatch() as watch:
+            snapshot = None
+            if scan:
+                snapshot = PrefixSnapshot(prefix, exclude)
+            started = time.time()
+            getattr(recipe, step)()
+            changes = []
+            if destdir is not None and \
+                    not _move_destdir(destdir, prefix, dest_prefix, manifest):
+                m.warning(_("%s did not install any file in DESTDIR, looking "
+                            "for the files it installed in the prefix. Set "
+                            "staged_install to False in the recipe if its "
+                            "install step ignores DESTDIR.") % recipe.name)
+                changes = PrefixSnapshot(prefix, exclude).modified_since(
+                    started - MTIME_SLACK)
+            if snapshot is not None:
+                changes = snapshot.changes()
+        for f in changes:
+            path = os.path.join(prefix, f)
+            if path in watch.moved:
+                continue
+            if dest_prefix != prefix:
+                path = os.path.join(dest_prefix, f)
+                _move(os.path.join(prefix, f), path)
+                _remove_empty_dirs(prefix, os.path.dirname(f))
+            manifest[f] = file_entry(path)
+    finally:
+        recipe.destdir = None
+        if scan:
+            _scan_lock.release()
+        if destdir is not None:
+            shutil.rmtree(destdir, ignore_errors=True)
+    return manifest
+
+
+def _move_destdir(destdir, prefix, dest_prefix, manifest):
+    # Returns the number of files moved
+    staged_prefix = os.path.join(destdir,
+                                 os.path.normpath(prefix).lstrip(os.sep))
+    files = walk_files(destdir)
+    with _prefix_lock:
+        for f in files:
+            src = os.path.join(destdir, f)
+            path = os.path.join(os.sep, f)
+            rel = os.path.relpath(src, staged_prefix)
+            if rel.startswith(os.pardir + os.sep):
+                m.warning(_("%s was installed outside the prefix") % path)
+            else:
+                path = os.path.join(dest_prefix, rel)
+                manifest[rel] = file_entry(src)
+            _move(src, path)
+            for watch in _watches:
+                watch.moved.add(path)
+    return len(files)
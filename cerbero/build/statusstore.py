@@ -0,0 +1,149 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import pickle
+import sqlite3
+import threading
+
+from cerbero.utils import _
+from cerbero.utils import messages as m
+
+
+STORE_EXT = '.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS status (
+    recipe TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+'''
+
+
+def store_path(cache_file):
+    '''
+    Gets the path of the store replacing a pickled status cache file
+
+    @param cache_file: path of the cache file
+    @type cache_file: str
+    @return: path of the store
+    @rtype: str
+    '''
+    return os.path.splitext(cache_file)[0] + STORE_EXT
+
+
+def store_files(path):
+    '''
+    Lists the files of a store, including the write-ahead log
+
+    @param path: path of the store
+    @type path: str
+    @return: list of paths
+    @rtype: list
+    '''
+    return [path, path + '-wal', path + '-shm']
+
+
+class StatusStore (object):
+    '''
+    SQLite database with the build status of the recipes, with a row per
+    recipe so that updating the status of a step only writes that recipe.
+    It uses a write-ahead log, a crash never leaves it half written and
+    other cerbero processes can read it while a build is running.
+
+    @ivar path: path of the database
+    @type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def exists(self):
+        '''
+        Whether the store was already created
+
+        @rtype: bool
+        '''
+        return os.path.exists(self.path)
+
+    def load(self):
+        '''
+        Loads the status of all the recipes. Rows that can't be loaded are
+        skipped, so that only those recipes are built again.
+
+        @return: dictionary with the L{cerbero.build.cookbook.RecipeStatus}
+                 by recipe name
+        @rtype: dict
+        '''
+        status = {}
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT recipe, data FROM status').fetchall()
+        for name, data in rows:
+            try:
+                status[name] = pickle.loads(data)
+            except Exception as ex:
+                m.warning(_("Could not recover the status of %s: %s") %
+                          (name, ex))
+        return status
+
+    def save(self, status, names=None):
+        '''
+        Saves the status of some recipes in a single transaction
+
+        @param status: dictionary with the status by recipe name
+        @type status: dict
+        @param names: names of the recipes to save, removing the ones not in
+                      status, or None to replace all of them
+        @type names: list
+        '''
+        with self._lock:
+            db = self._connect()
+            with db:
+                if names is None:
+                    db.execute('DELETE FROM status')
+                    names = list(status.keys())
+                for name in names:
+                    if name in status:
+                        db.execute('INSERT OR REPLACE INTO status (recipe, '
+                                   'data) VALUES (?, ?)', (name,
+                                   pickle.dumps(status[name])))
+                    else:
+                        db.execute('DELETE FROM status WHERE recipe = ?',
+                                   (name,))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self._db = sqlite3.connect(self.path, timeout=30,
+                                       check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # Durable enough with WAL, a power loss can only lose the last
+            # steps done, never corrupt the database
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+        return self._db
@@ -18,7 +18,7 @@
 
 
 from cerbero.commands import Command, register_command
-from cerbero.utils import N_, _, ArgparseArgument
+from cerbero.utils import N_, _, ArgparseArgument, trace
 from cerbero.bootstrap.bootstrapper import Bootstrapper
 
 
@@ -29,12 +29,16 @@ class Bootstrap(Command):
     def __init__(self):
         args = [
             ArgparseArgument('--build-tools-only', action='store_true',
-                default=False, help=_('only bootstrap the build tools'))]
+                default=False, help=_('only bootstrap the build tools')),
+            ArgparseArgument('--trace', metavar='FILE', default=None,
+                help=_('write a Chrome trace of the bootstrap to FILE'))]
         Command.__init__(self, args)
 
     def run(self, config, args):
         bootstrappers = Bootstrapper(config, args.build_tools_only)
-        for bootstrapper in bootstrappers:
-            bootstrapper.start()
+        with trace.tracing(args.trace, 'cerbero bootstrap'):
+            for bootstrapper in bootstrappers:
+                with trace.span(type(bootstrapper).__name__, 'bootstrap'):
+                    bootstrapper.start()
 
 register_command(Bootstrap)
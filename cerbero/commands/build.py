@@ -21,7 +21,7 @@
 from cerbero.commands import Command, register_command
 from cerbero.build.cookbook import CookBook
 from cerbero.build.oven import Oven
-from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import _, N_, ArgparseArgument, trace
 
 
 class Build(Command):
@@ -38,13 +38,38 @@ class Build(Command):
                            'listed in the recipe')),
                 ArgparseArgument('--dry-run', action='store_true',
                     default=False,
-                    help=_('only print commands instead of running them '))]
+                    help=_('only print commands instead of running them ')),
+                ArgparseArgument('--jobs-recipes', type=int, default=1,
+                    metavar='N',
+                    help=_('number of recipes to build concurrently, '
+                           'following the dependency graph')),
+                ArgparseArgument('--prefetch', type=int, default=2,
+                    metavar='N',
+                    help=_('number of upcoming recipes to fetch in the '
+                           'background while building (0 to disable)')),
+                ArgparseArgument('--prefetch-extract', action='store_true',
+                    default=False,
+                    help=_('also extract the sources of the prefetched '
+                           'recipes')),
+                ArgparseArgument('--keep-going', action='store_true',
+                    default=False,
+                    help=_('keep building the recipes that do not depend '
+                           'on a failed one and report all the failures at '
+                           'the end')),
+                ArgparseArgument('--trace', metavar='FILE', default=None,
+                    help=_('write a Chrome trace of the build to FILE'))]
             if force is None:
                 args.append(
                     ArgparseArgument('--force', action='store_true',
                         default=False,
                         help=_('force the build of the recipe ingoring '
                                     'its cached state')))
+            else:
+                args.append(
+                    ArgparseArgument('--force', action='store_true',
+                        default=False,
+                        help=_('run the configure step even if its inputs '
+                               'did not change')))
             if no_deps is None:
                 args.append(
                     ArgparseArgument('--no-deps', action='store_true',
@@ -58,19 +83,29 @@ class Build(Command):
     def run(self, config, args):
         if self.force is None:
             self.force = args.force
+        self.force_configure = args.force
         if self.no_deps is None:
             self.no_deps = args.no_deps
-        self.runargs(config, args.recipe, args.missing_files, self.force,
-                     self.no_deps, dry_run=args.dry_run)
+        with trace.tracing(args.trace, 'cerbero %s' % self.name):
+            self.runargs(config, args.recipe, args.missing_files, self.force,
+                         self.no_deps, dry_run=args.dry_run,
+                         jobs=args.jobs_recipes, prefetch=args.prefetch,
+                         prefetch_extract=args.prefetch_extract,
+                         keep_going=args.keep_going,
+                         force_configure=self.force_configure)
 
     def runargs(self, config, recipes, missing_files=False, force=False,
-                no_deps=False, cookbook=None, dry_run=False):
+                no_deps=False, cookbook=None, dry_run=False, jobs=1,
+                prefetch=0, prefetch_extract=False, keep_going=False,
+                force_configure=None):
         if cookbook is None:
-            cookbook = CookBook(config)
+            cookbook = CookBook(config, lazy=True)
 
         oven = Oven(recipes, cookbook, force=self.force,
                     no_deps=self.no_deps, missing_files=missing_files,
-                    dry_run=dry_run)
+                    dry_run=dry_run, jobs=jobs, prefetch=prefetch,
+                    prefetch_extract=prefetch_extract,
+                    keep_going=keep_going, force_configure=force_configure)
         oven.start_cooking()
 
 
@@ -0,0 +1,163 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from cerbero.commands import Command, register_command
+from cerbero.build.cookbook import CookBook
+from cerbero.build.history import BuildHistory, mean
+from cerbero.build.ninjalog import TargetKind
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '%dh%02dm%02ds' % (seconds // 3600, seconds % 3600 // 60,
+                                  seconds % 60)
+    if seconds >= 60:
+        return '%dm%02ds' % (seconds // 60, seconds % 60)
+    return '%ds' % seconds
+
+
+class BuildStats(Command):
+    doc = N_('Show statistics of the build times recorded in previous builds')
+    name = 'build-stats'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('-n', '--runs', type=int, default=5,
+                help=_('number of previous builds of each recipe used to '
+                       'compute averages and find regressions')),
+             ArgparseArgument('-l', '--limit', type=int, default=10,
+                help=_('number of recipes and steps listed')),
+             ArgparseArgument('-t', '--threshold', type=int, default=20,
+                help=_('percentage of slowdown reported as a regression')),
+            ])
+
+    def run(self, config, args):
+        history = BuildHistory(config)
+        recipes = history.recipes_durations()
+        steps = history.steps_durations()
+        compiled = history.slowest_targets(TargetKind.COMPILE, args.limit)
+        linked = history.slowest_targets(TargetKind.LINK, args.limit)
+        history.close()
+        if not recipes and not steps:
+            m.message(_("No builds recorded for %s") % history.target)
+            return
+        runs = max(1, args.runs)
+
+        self._slowest_recipes(recipes, runs, args.limit)
+        self._slowest_steps(steps, runs, args.limit)
+        self._steps_averages(steps, runs)
+        self._slowest_targets(_("Slowest compilation units (last build):"),
+                              compiled)
+        self._slowest_targets(_("Slowest link steps (last build):"), linked)
+        self._regressions(recipes, runs, args.threshold)
+        self._critical_path(config, recipes, runs)
+
+    def _slowest_recipes(self, recipes, runs, limit):
+        averages = [(mean(d[:runs]), d[0], r) for r, d in recipes.items()]
+        averages.sort(reverse=True)
+        m.message(_("Slowest recipes (average of the last %d builds, "
+                    "last build):") % runs)
+        for average, last, recipe in averages[:limit]:
+            m.message('  %-40s %10s %10s' % (recipe, format_duration(average),
+                                             format_duration(last)))
+
+    def _slowest_steps(self, steps, runs, limit):
+        averages = [(mean(d[:runs]), r, s) for (r, s), d in steps.items()]
+        averages.sort(reverse=True)
+        m.message(_("Slowest steps (average of the last %d builds):") % runs)
+        for average, recipe, step in averages[:limit]:
+            m.message('  %-40s %10s' % ('%s %s' % (recipe, step),
+                                        format_duration(average)))
+
+    def _steps_averages(self, steps, runs):
+        totals = {}
+        for (recipe, step), d in steps.items():
+            totals.setdefault(step, []).append(mean(d[:runs]))
+        totals = [(sum(t), mean(t), s) for s, t in totals.items()]
+        totals.sort(reverse=True)
+        m.message(_("Time per step (total of all the recipes, average per "
+                    "recipe):"))
+        for total, average, step in totals:
+            m.message('  %-40s %10s %10s' % (step, format_duration(total),
+                                             format_duration(average)))
+
+    def _slowest_targets(self, title, targets):
+        if not targets:
+            return
+        m.message(title)
+        for recipe, target, duration in targets:
+            m.message('  %-60s %10s' % ('%s: %s' % (recipe, target),
+                                        format_duration(duration)))
+
+    def _regressions(self, recipes, runs, threshold):
+        regressions = []
+        for recipe, d in recipes.items():
+            if len(d) < 2:
+                continue
+            previous = mean(d[1:runs + 1])
+            # Ignore the noise of very short builds
+            if d[0] - previous < 1:
+                continue
+            slowdown = (d[0] - previous) * 100 / max(previous, 1)
+            if slowdown >= threshold:
+                regressions.append((slowdown, recipe, d[0], previous))
+        regressions.sort(reverse=True)
+        if not regressions:
+            m.message(_("No regressions against the previous %d builds") %
+                      runs)
+            return
+        m.message(_("Regressions against the previous %d builds:") % runs)
+        for slowdown, recipe, last, previous in regressions:
+            m.message('  %-40s %10s -> %10s (+%d%%)' % (recipe,
+                      format_duration(previous), format_duration(last),
+                      slowdown))
+
+    def _critical_path(self, config, recipes, runs):
+        cookbook = CookBook(config)
+        names = [r.name for r in cookbook.get_recipes_list()]
+        durations = dict([(r, mean(d[:runs])) for r, d in recipes.items()
+                          if r in names])
+        priorities = cookbook.critical_path(names, False, durations)
+        if not priorities:
+            return
+        rdeps = cookbook.list_recipes_reverse_deps(names)
+
+        def duration(name):
+            # The priority adds the recipe's own duration to the longest path
+            # of its reverse dependencies
+            return priorities[name] - \
+                max([priorities[r] for r in rdeps[name]] + [0])
+
+        chain = [max(priorities, key=priorities.get)]
+        while rdeps[chain[-1]]:
+            chain.append(max(rdeps[chain[-1]], key=priorities.get))
+        total = priorities[chain[0]]
+        serial = sum([duration(n) for n in names])
+        m.message(_("Estimated critical path of a full build: %s (%s "
+                    "building one recipe at a time)") %
+                  (format_duration(total), format_duration(serial)))
+        for name in chain:
+            estimated = name not in durations and _(' (estimated)') or ''
+            m.message('  %-40s %10s%s' % (name,
+                      format_duration(duration(name)), estimated))
+
+
+register_command(BuildStats)
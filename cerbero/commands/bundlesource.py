@@ -76,9 +76,7 @@ class BundleSource(Command):
             recipes += package.recipes_dependencies()
         recipes += args.add_recipe
 
-        for r in recipes:
-            bundle_recipes += cookbook.list_recipe_deps(r)
-        bundle_recipes = remove_list_duplicates(bundle_recipes)
+        bundle_recipes = cookbook.list_recipes_deps(recipes)
 
         for p in packages:
             setup_args.append('--package=' + p)
@@ -92,10 +90,7 @@ class BundleSource(Command):
             build_tools = BuildTools(config)
             bs_recipes = build_tools.BUILD_TOOLS + \
                          build_tools.PLAT_BUILD_TOOLS.get(config.platform, [])
-            b_recipes = []
-            for r in bs_recipes:
-                b_recipes += cookbook.list_recipe_deps(r)
-            b_recipes = remove_list_duplicates(b_recipes)
+            b_recipes = cookbook.list_recipes_deps(bs_recipes)
 
             for r in b_recipes:
                 if r.stype != SourceType.CUSTOM:
@@ -33,7 +33,7 @@ class CleanOne(Command):
             ])
 
     def run(self, config, args):
-        cookbook = CookBook(config)
+        cookbook = CookBook(config, lazy=True)
         recipe_name = args.recipe[0]
 
         recipe = cookbook.get_recipe(recipe_name)
@@ -39,35 +39,35 @@ class Deps(Command):
             ])
 
     def run(self, config, args):
-        cookbook = CookBook(config)
+        cookbook = CookBook(config, lazy=True)
         recipe_name = args.recipe[0]
         all_deps = args.all
-        graph = args.graph
+        show_graph = args.graph
 
+        graph = cookbook.dependency_graph()
         if all_deps:
-            recipes = cookbook.list_recipe_deps(recipe_name)
+            recipes = [x.name for x in cookbook.list_recipe_deps(recipe_name)]
         else:
-            recipes = [cookbook.get_recipe(x) for x in
-                        cookbook.get_recipe(recipe_name).list_deps()]
+            recipes = cookbook.list_recipe_direct_deps(recipe_name)
 
         if len(recipes) == 0:
             m.message(_('%s has 0 dependencies') % recipe_name)
             return
-        if not graph:
+        if not show_graph:
             for recipe in recipes:
                 # Don't print the recipe we asked for
-                if recipe.name == recipe_name:
+                if recipe == recipe_name:
                     continue
-                m.message(recipe.name)
+                m.message(recipe)
         else:
-            def print_dep(cookbook, recipe, level=0, already_shown=[]):
-                m.message("%s%s" %( " " * 3 * level, recipe.name))
-                already_shown.append(recipe)
-                for r in [cookbook.get_recipe(x) for x in recipe.list_deps()]:
-                    if not r in already_shown:
-                        print_dep(cookbook, r, level + 1, already_shown)
-                    elif not r.name == recipe.name:
-                        m.message("%s(%s)" % ( " " * 3 * (level + 1), r.name))
-            print_dep(cookbook, cookbook.get_recipe(recipe_name))
+            def print_dep(name, level, already_shown):
+                m.message("%s%s" %( " " * 3 * level, name))
+                already_shown.add(name)
+                for dep in graph.direct_deps(name):
+                    if not dep in already_shown:
+                        print_dep(dep, level + 1, already_shown)
+                    elif not dep == name:
+                        m.message("%s(%s)" % ( " " * 3 * (level + 1), dep))
+            print_dep(recipe_name, 0, set())
 
 register_command(Deps)
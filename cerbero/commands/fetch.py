@@ -20,7 +20,8 @@
 from cerbero.commands import Command, register_command
 from cerbero.build.cookbook import CookBook
 from cerbero.packages.packagesstore import PackagesStore
-from cerbero.utils import _, N_, ArgparseArgument, remove_list_duplicates
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import trace
 from cerbero.utils import messages as m
 from cerbero.build.source import Tarball
 
@@ -30,11 +31,14 @@ class Fetch(Command):
     def __init__(self, args=[]):
         args.append(ArgparseArgument('--reset-rdeps', action='store_true',
                     default=False, help=_('reset the status of reverse '
-                    'dependencies too')))
+                    'dependencies too, instead of when the updated recipes '
+                    'are rebuilt')))
         args.append(ArgparseArgument('--full-reset', action='store_true',
                     default=False, help=_('reset to extract step if rebuild is needed')))
         args.append(ArgparseArgument('--print-only', action='store_true',
                     default=False, help=_('print all source URLs to stdout')))
+        args.append(ArgparseArgument('--trace', metavar='FILE', default=None,
+                    help=_('write a Chrome trace of the fetch to FILE')))
         Command.__init__(self, args)
 
     def fetch(self, cookbook, recipes, no_deps, reset_rdeps, full_reset, print_only):
@@ -44,9 +48,7 @@ class Fetch(Command):
         elif no_deps:
             fetch_recipes = [cookbook.get_recipe(x) for x in recipes]
         else:
-            for recipe in recipes:
-                fetch_recipes += cookbook.list_recipe_deps(recipe)
-            fetch_recipes = remove_list_duplicates (fetch_recipes)
+            fetch_recipes = cookbook.list_recipes_deps(recipes)
         m.message(_("Fetching the following recipes: %s") %
                   ' '.join([x.name for x in fetch_recipes]))
         to_rebuild = []
@@ -58,7 +60,8 @@ class Fetch(Command):
                     m.message("TARBALL: {} {}".format(recipe.url, recipe.tarball_name))
                 continue
             m.build_step(i + 1, len(fetch_recipes), recipe, 'Fetch')
-            recipe.fetch()
+            with trace.span('fetch', 'fetch', recipe=recipe.name):
+                recipe.fetch()
             bv = cookbook.recipe_built_version(recipe.name)
             cv = recipe.built_version()
             if bv != cv:
@@ -67,11 +70,14 @@ class Fetch(Command):
                 #  * OR it was fully built already
                 if full_reset or not cookbook.recipe_needs_build(recipe.name):
                     to_rebuild.append(recipe)
-                    cookbook.reset_recipe_status(recipe.name)
+                    cookbook.reset_recipe_status(recipe.name,
+                            _("version changed from %s to %s") % (bv, cv))
                     if reset_rdeps:
                         for r in cookbook.list_recipe_reverse_deps(recipe.name):
                             to_rebuild.append(r)
-                            cookbook.reset_recipe_status(r.name)
+                            cookbook.reset_recipe_status(r.name,
+                                    _("dependencies changed: %s") %
+                                    recipe.name)
 
         if to_rebuild:
             to_rebuild = sorted(list(set(to_rebuild)), key=lambda r:r.name)
@@ -95,9 +101,11 @@ class FetchRecipes(Fetch):
         Fetch.__init__(self, args)
 
     def run(self, config, args):
-        cookbook = CookBook(config)
-        return self.fetch(cookbook, args.recipes, args.no_deps,
-                          args.reset_rdeps, args.full_reset, args.print_only)
+        cookbook = CookBook(config, lazy=True)
+        with trace.tracing(args.trace, 'cerbero fetch'):
+            return self.fetch(cookbook, args.recipes, args.no_deps,
+                              args.reset_rdeps, args.full_reset,
+                              args.print_only)
 
 
 class FetchPackage(Fetch):
@@ -116,9 +124,10 @@ class FetchPackage(Fetch):
     def run(self, config, args):
         store = PackagesStore(config)
         package = store.get_package(args.package[0])
-        return self.fetch(store.cookbook, package.recipes_dependencies(),
-                          args.deps, args.reset_rdeps, args.full_reset,
-                          args.print_only)
+        with trace.tracing(args.trace, 'cerbero fetch-package'):
+            return self.fetch(store.cookbook, package.recipes_dependencies(),
+                              args.deps, args.reset_rdeps, args.full_reset,
+                              args.print_only)
 
 
 register_command(FetchRecipes)
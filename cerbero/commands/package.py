@@ -20,7 +20,7 @@ import os
 
 from cerbero.config import Platform
 from cerbero.commands import Command, register_command, build
-from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import _, N_, ArgparseArgument, trace
 from cerbero.utils import messages as m
 from cerbero.errors import PackageNotFoundError, UsageError
 from cerbero.packages.packager import Packager
@@ -58,9 +58,16 @@ class Package(Command):
                     'create this package (conflicts with --skip-deps-build)')),
             ArgparseArgument('-k', '--keep-temp', action='store_true',
                 default=False, help=_('Keep temporary files for debug')),
+            ArgparseArgument('--trace', metavar='FILE', default=None,
+                help=_('write a Chrome trace of the build and packaging '
+                       'to FILE')),
             ])
 
     def run(self, config, args):
+        with trace.tracing(args.trace, 'cerbero package'):
+            self._run(config, args)
+
+    def _run(self, config, args):
         self.store = PackagesStore(config)
         p = self.store.get_package(args.package[0])
 
@@ -69,7 +76,8 @@ class Package(Command):
                     "--only-build-deps"))
 
         if not args.skip_deps_build:
-            self._build_deps(config, p, args.no_devel)
+            with trace.span('build dependencies', 'package'):
+                self._build_deps(config, p, args.no_devel)
 
         if args.only_build_deps:
             return
@@ -81,15 +89,19 @@ class Package(Command):
         else:
             pkg = Packager(config, p, self.store)
         m.action(_("Creating package for %s") % p.name)
-        if args.tarball:
-            paths = pkg.pack(os.path.abspath(args.output_dir), args.no_devel,
-                             args.force, args.keep_temp, split=not args.no_split)
-        else:
-            paths = pkg.pack(os.path.abspath(args.output_dir), args.no_devel,
-                             args.force, args.keep_temp)
+        with trace.span('pack', 'package', package=p.name,
+                        packager=type(pkg).__name__):
+            if args.tarball:
+                paths = pkg.pack(os.path.abspath(args.output_dir),
+                                 args.no_devel, args.force, args.keep_temp,
+                                 split=not args.no_split)
+            else:
+                paths = pkg.pack(os.path.abspath(args.output_dir),
+                                 args.no_devel, args.force, args.keep_temp)
         if None in paths:
             paths.remove(None)
-        p.post_install(paths)
+        with trace.span('post install', 'package', package=p.name):
+            p.post_install(paths)
         m.action(_("Package successfully created in %s") %
                  ' '.join([os.path.abspath(x) for x in paths]))
 
@@ -0,0 +1,121 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from cerbero.commands import Command, register_command
+from cerbero.commands.buildstats import format_duration
+from cerbero.build.cookbook import CookBook, DEFAULT_RECIPE_DURATION
+from cerbero.build.history import BuildHistory, mean
+from cerbero.utils import _, N_, ArgparseArgument
+from cerbero.utils import messages as m
+
+
+# Number of previous builds used to estimate the durations
+HISTORY_RUNS = 5
+
+
+class Plan(Command):
+    doc = N_('Show which recipes and steps a build would run and why, '
+             'without running anything')
+    name = 'plan'
+
+    def __init__(self):
+        Command.__init__(self,
+            [ArgparseArgument('recipes', nargs='*',
+                help=_('recipes to build (all of them if none is passed)')),
+             ArgparseArgument('--force', action='store_true', default=False,
+                help=_('plan a forced build of the recipes')),
+             ArgparseArgument('--no-deps', action='store_true',
+                default=False, help=_('do not build dependencies')),
+            ])
+
+    def run(self, config, args):
+        cookbook = CookBook(config, lazy=True)
+        # Only the recipes in the plan are loaded, the dependencies of the
+        # others are read from the recipes index
+        names = args.recipes or sorted(cookbook.dependency_graph().deps)
+        if args.no_deps:
+            ordered = names
+        else:
+            ordered = [x.name for x in cookbook.list_recipes_deps(names)]
+
+        plan = cookbook.rebuild_plan(ordered, args.force)
+        if not plan:
+            m.message(_("All the %d recipes are already built") %
+                      len(ordered))
+            return
+
+        history = BuildHistory(config)
+        recipes_durations = history.recipes_durations()
+        steps_durations = history.steps_durations()
+        history.close()
+
+        durations = dict([(n, 0) for n in ordered])
+        m.message(_("%d of %d recipes will be built:") % (len(plan),
+                                                          len(ordered)))
+        for i, (name, reason) in enumerate(plan):
+            recipe = cookbook.get_recipe(name)
+            steps = [s for d, s in recipe.steps]
+            status = cookbook.status.get(name)
+            # Recipes already built are reset before building them again
+            if not args.force and getattr(status, 'needs_build', False):
+                steps = [s for s in steps if s not in status.steps]
+            duration = self._estimate(cookbook, name, steps, recipes_durations,
+                                      steps_durations)
+            durations[name] = duration
+            estimated = duration is None and '?' or format_duration(duration)
+            m.message('  [%d/%d] %-30s %8s  %s' % (i + 1, len(plan), name,
+                                                   estimated, reason))
+            if len(steps) != len(recipe.steps):
+                m.message('  %s %s' % (' ' * len('[%d/%d]' % (i + 1,
+                          len(plan))), _("steps: %s") % ' '.join(steps)))
+
+        known = [d for d in durations.values() if d]
+        default = known and sum(known) / len(known) or DEFAULT_RECIPE_DURATION
+        for name, duration in list(durations.items()):
+            if duration is None:
+                durations[name] = default
+        serial = sum(durations.values())
+        priorities = cookbook.critical_path(ordered, False, durations)
+        m.message(_("Estimated time: %s building one recipe at a time, %s "
+                    "building in parallel") % (format_duration(serial),
+                  format_duration(max(priorities.values()))))
+
+    def _estimate(self, cookbook, name, steps, recipes_durations,
+                  steps_durations):
+        status = cookbook.status.get(name)
+        recorded = getattr(status, 'steps_duration', None) or {}
+        known = []
+        for step in steps:
+            if (name, step) in steps_durations:
+                durations = steps_durations[(name, step)]
+                known.append(mean(durations[:HISTORY_RUNS]))
+            elif step in recorded:
+                known.append(recorded[step])
+        if len(known) == len(steps):
+            return sum(known)
+        if name in recipes_durations:
+            total = mean(recipes_durations[name][:HISTORY_RUNS])
+        else:
+            total = cookbook.recipe_duration(name)
+        if total is None:
+            return None
+        # Unknown steps left, assume all the steps take the same time
+        return total * len(steps) / len(cookbook.get_recipe(name).steps)
+
+
+register_command(Plan)
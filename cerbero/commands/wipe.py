@@ -21,6 +21,7 @@ import stat
 import shutil
 
 from cerbero.commands import Command, register_command
+from cerbero.build.statusstore import store_files, store_path
 from cerbero.utils import _, N_, shell, ArgparseArgument
 import cerbero.utils.messages as m
 
@@ -44,13 +45,17 @@ class Wipe(Command):
                 ])
 
     def run(self, config, args):
-        to_remove = [os.path.join(config.home_dir, config.cache_file)]
+        cache_file = os.path.join(config.home_dir, config.cache_file)
+        to_remove = [cache_file] + store_files(store_path(cache_file))
         to_remove.append(config.prefix)
         to_remove.append(config.logs)
         if not args.keep_sources:
             to_remove.append(config.sources)
         if args.build_tools:
-            to_remove.append(os.path.join(config.home_dir, config.build_tools_cache))
+            cache_file = os.path.join(config.home_dir,
+                                      config.build_tools_cache)
+            to_remove.append(cache_file)
+            to_remove += store_files(store_path(cache_file))
             to_remove.append(config.build_tools_prefix)
             to_remove.append(config.build_tools_sources)
 
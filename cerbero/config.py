@@ -25,6 +25,7 @@ from cerbero.errors import FatalError, ConfigurationError
 from cerbero.utils import _, system_info, validate_packager, to_unixpath,\
     shell, parse_file
 from cerbero.utils import messages as m
+from cerbero.utils import compilercache, toolscache
 
 
 CONFIG_DIR = os.path.expanduser('~/.cerbero')
@@ -92,7 +93,10 @@ class Config (object):
                    'distro_packages_install', 'interactive',
                    'target_arch_flags', 'sysroot', 'isysroot',
                    'extra_lib_path', 'cached_sources', 'tools_prefix',
-                   'ios_min_version', 'toolchain_path', 'mingw_perl_prefix']
+                   'ios_min_version', 'toolchain_path', 'mingw_perl_prefix',
+                   'artifact_cache', 'artifact_cache_remote',
+                   'compiler_cache', 'compiler_cache_dir',
+                   'compiler_cache_size', 'load_limit']
 
     def __init__(self):
         self._check_uninstalled()
@@ -105,11 +109,15 @@ class Config (object):
         # Store raw os.environ data
         self._raw_environ = os.environ.copy()
         self._pre_environ = os.environ.copy()
+        self._build_env = None
+        self._envs = {}
 
     def _copy(self, arch):
         c = copy.deepcopy(self)
         c.target_arch = arch
         c._raw_environ = os.environ.copy()
+        c._build_env = None
+        c._envs = {}
         return c
 
     def load(self, filename=None):
@@ -192,7 +200,34 @@ class Config (object):
             self._create_path(c.logs)
 
     def do_setup_env(self):
-        self._restore_environment()
+        self._build_env = None
+        self._envs = {}
+        self.set_build_env()
+
+    def set_build_env(self):
+        '''
+        Sets os.environ to the build environment of this configuration,
+        computing it only if it wasn't yet
+        '''
+        env = self.get_build_env()
+        if os.environ != env:
+            # set all the variables
+            os.environ.clear()
+            os.environ.update(env)
+
+    def get_build_env(self):
+        '''
+        Gets the environment used to build with this configuration. It's
+        computed only once and it doesn't modify os.environ.
+
+        @return: the build environment, which must not be modified
+        @rtype: L{cerbero.utils.shell.Environment}
+        '''
+        # The prefix of the configuration of each architecture can be changed
+        # after it was created for universal builds
+        if self._build_env is not None and \
+                self._build_env[CERBERO_PREFIX] == self.prefix:
+            return self._build_env
         self._create_path(self.prefix)
         self._create_path(os.path.join(self.prefix, 'share', 'aclocal'))
         self._create_path(os.path.join(
@@ -200,14 +235,35 @@ class Config (object):
 
         libdir = os.path.join(self.prefix, 'lib%s' % self.lib_suffix)
         self.libdir = libdir
-        os.environ[CERBERO_PREFIX] = self.prefix
 
+        env = shell.Environment(self._raw_environ)
+        env[CERBERO_PREFIX] = self.prefix
         self.env = self.get_env(self.prefix, libdir, self.py_prefix)
-        # set all the variables
-        for e, v in self.env.items():
-            os.environ[e] = v
+        env.update(self.env)
+        env.update(compilercache.environment(self))
+        self._build_env = env
+        return env
 
     def get_env(self, prefix, libdir, py_prefix):
+        '''
+        Gets the environment variables to use a prefix. They are only
+        computed once for each prefix.
+
+        @param prefix: the prefix
+        @type prefix: str
+        @param libdir: libraries directory of the prefix
+        @type libdir: str
+        @param py_prefix: python modules directory relative to the prefix
+        @type py_prefix: str
+        @return: the environment variables
+        @rtype: dict
+        '''
+        key = (prefix, libdir, py_prefix)
+        if key not in self._envs:
+            self._envs[key] = self._get_env(prefix, libdir, py_prefix)
+        return self._envs[key].copy()
+
+    def _get_env(self, prefix, libdir, py_prefix):
         # Get paths for environment variables
         includedir = os.path.join(prefix, 'include')
         bindir = os.path.join(prefix, 'bin')
@@ -251,10 +307,10 @@ class Config (object):
             xdgdatadir += ":/usr/share:/usr/local/share"
 
         ldflags = '-L%s ' % libdir
-        if ldflags not in os.environ.get('LDFLAGS', ''):
-            ldflags += os.environ.get('LDFLAGS', '')
+        if ldflags not in self._raw_environ.get('LDFLAGS', ''):
+            ldflags += self._raw_environ.get('LDFLAGS', '')
 
-        path = os.environ.get('PATH', '')
+        path = self._raw_environ.get('PATH', '')
         if bindir not in path and self.prefix_is_executable():
             path = self._join_path(bindir, path)
         path = self._join_path(
@@ -350,6 +406,10 @@ class Config (object):
         self.set_property('extra_build_tools', {})
         self.set_property('distro_packages_install', True)
         self.set_property('interactive', True)
+        self.set_property('artifact_cache', None)
+        self.set_property('artifact_cache_remote', None)
+        self.set_property('compiler_cache', compilercache.CCACHE)
+        self.set_property('compiler_cache_size', '5G')
 
     def set_property(self, name, value, force=False):
         if name not in self._properties:
@@ -510,6 +570,11 @@ class Config (object):
         self.set_property('build_tools_sources',
                 os.path.join(self.home_dir, 'sources', 'build-tools'))
         self.set_property('build_tools_cache', 'build-tools.cache')
+        # Shared by all the configurations
+        self.set_property('compiler_cache_dir',
+                os.path.join(self.home_dir, 'compiler-cache'))
+        # Don't start new jobs while the host is busier than its CPUs
+        self.set_property('load_limit', self.num_of_cpus)
 
     def _find_data_dir(self):
         if self.uninstalled:
@@ -542,7 +607,14 @@ class Config (object):
         return os.path.abspath(p)
 
     def _perl_version(self):
-        version = shell.check_call("perl -e 'print \"$]\";'")
+        cache_path = None
+        if self.home_dir is not None:
+            cache_path = os.path.join(self.home_dir, toolscache.TOOLS_CACHE)
+        return toolscache.probe('perl', 'version', self._probe_perl_version,
+                                cache_path)
+
+    def _probe_perl_version(self, perl):
+        version = shell.check_call([perl, '-e', 'print "$]";'])
         # FIXME: when perl's mayor is >= 10
         mayor = str(version[0])
         minor = str(int(version[2:5]))
@@ -20,7 +20,7 @@ import os
 import tarfile
 
 import cerbero.utils.messages as m
-from cerbero.utils import _
+from cerbero.utils import _, trace
 from cerbero.errors import UsageError, EmptyPackageError
 from cerbero.packages import PackagerBase, PackageType
 
@@ -61,13 +61,17 @@ class DistTarball(PackagerBase):
 
         filenames = []
         if dist_files:
-            runtime = self._create_tarball(output_dir, PackageType.RUNTIME,
-                                           dist_files, force, package_prefix)
+            with trace.span('runtime tarball', 'package',
+                            package=self.package.name):
+                runtime = self._create_tarball(output_dir,
+                        PackageType.RUNTIME, dist_files, force, package_prefix)
             filenames.append(runtime)
 
         if split and devel and len(devel_files) != 0:
-            devel = self._create_tarball(output_dir, PackageType.DEVEL,
-                                         devel_files, force, package_prefix)
+            with trace.span('devel tarball', 'package',
+                            package=self.package.name):
+                devel = self._create_tarball(output_dir, PackageType.DEVEL,
+                        devel_files, force, package_prefix)
             filenames.append(devel)
         return filenames
 
@@ -24,7 +24,7 @@ from cerbero.errors import EmptyPackageError
 from cerbero.packages import PackagerBase, PackageType
 from cerbero.packages.disttarball import DistTarball
 from cerbero.packages.package import MetaPackage, App
-from cerbero.utils import _
+from cerbero.utils import _, trace
 from cerbero.utils import messages as m
 
 import shutil
@@ -48,13 +48,16 @@ class LinuxPackager(PackagerBase):
         self._empty_packages = []
 
         # Create a tmpdir for packages
-        tmpdir, packagedir, srcdir = self.create_tree(tmpdir)
+        with trace.span('create tree', 'package', package=self.package.name):
+            tmpdir, packagedir, srcdir = self.create_tree(tmpdir)
 
         # only build each package once
         if isinstance(self.package, App) and self.package.embed_deps:
             pass
         elif pack_deps:
-            self.pack_deps(output_dir, tmpdir, force)
+            with trace.span('pack dependencies', 'package',
+                            package=self.package.name):
+                self.pack_deps(output_dir, tmpdir, force)
 
         if not isinstance(self.package, MetaPackage):
             # create a tarball with all the package's files
@@ -72,10 +75,13 @@ class LinuxPackager(PackagerBase):
 
         try:
             # do the preparations, fill spec file, write debian files, etc
-            self.prepare(tarname, tmpdir, packagedir, srcdir)
+            with trace.span('prepare', 'package', package=self.package.name):
+                self.prepare(tarname, tmpdir, packagedir, srcdir)
 
             # and build the package
-            paths = self.build(output_dir, tarname, tmpdir, packagedir, srcdir)
+            with trace.span('build', 'package', package=self.package.name):
+                paths = self.build(output_dir, tarname, tmpdir, packagedir,
+                                   srcdir)
 
             stamp_path = os.path.join(tmpdir, self.package.name + '-stamp')
             open(stamp_path, 'w').close()
@@ -349,9 +349,19 @@ def remove_list_duplicates(seq):
     return [x for x in seq if x not in seen and not seen_add(x)]
 
 
-def parse_file(filename, dict):
+def parse_file(filename, dict, code_cache=None):
+    '''
+    Executes a python file in the dict namespace
+
+    @param code_cache: cache with the compiled code of the file
+    @type code_cache: L{cerbero.utils.codecache.CodeCache}
+    '''
     try:
-        exec(compile(open(filename).read(), filename, 'exec'), dict)
+        if code_cache is not None:
+            code = code_cache.compile(filename)
+        else:
+            code = compile(open(filename).read(), filename, 'exec')
+        exec(code, dict)
     except Exception as ex:
         import traceback
         traceback.print_exc()
@@ -376,11 +386,17 @@ def get_wix_prefix():
         raise FatalError("The required packaging tool 'WiX' was not found")
     return escape_path(to_unixpath(wix_prefix))
 
-def add_system_libs(config, new_env):
+def add_system_libs(config, new_env, env=None):
     '''
     Add /usr/lib/pkgconfig to PKG_CONFIG_PATH so the system's .pc file
     can be found.
+
+    @param env: environment the search paths are added to, os.environ by
+                default
+    @type env: dict
     '''
+    if env is None:
+        env = os.environ
     arch = config.target_arch
     libdir = 'lib'
 
@@ -392,7 +408,7 @@ def add_system_libs(config, new_env):
     if config.sysroot:
         sysroot = config.sysroot
 
-    search_paths = [os.environ['PKG_CONFIG_LIBDIR'],
+    search_paths = [env['PKG_CONFIG_LIBDIR'],
         os.path.join(sysroot, 'usr', libdir, 'pkgconfig'),
         os.path.join(sysroot, 'usr/share/pkgconfig')]
 
@@ -413,7 +429,7 @@ def add_system_libs(config, new_env):
 
     new_env['PKG_CONFIG_PATH'] = ':'.join(search_paths)
 
-    search_paths = [os.environ.get('ACLOCAL_PATH', ''),
+    search_paths = [env.get('ACLOCAL_PATH', ''),
         os.path.join(sysroot, 'usr/share/aclocal')]
     new_env['ACLOCAL_PATH'] = ':'.join(search_paths)
 
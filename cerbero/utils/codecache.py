@@ -0,0 +1,129 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import importlib.util
+import marshal
+import os
+import sys
+import threading
+import types
+
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+# Bumped when the format of the cache changes. The code objects are only
+# valid for the python version that compiled them.
+CACHE_VERSION = 1
+
+
+class CodeCache (object):
+    '''
+    Cache of the code objects compiled from python files, like the recipes,
+    stored on disk with marshal. Files are only compiled again when their
+    modification time or size change.
+
+    @ivar path: path of the cache file
+    @type path: str
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+        self._dirty = False
+
+    def compile(self, filename):
+        '''
+        Gets the code object of a python file, compiling it if needed
+
+        @param filename: path of the file
+        @type filename: str
+        @return: the code object
+        @rtype: code
+        '''
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entries = self._load()
+            if filename in entries and entries[filename][0] == key:
+                return entries[filename][1]
+        with open(filename) as f:
+            code = compile(f.read(), filename, 'exec')
+        with self._lock:
+            entries[filename] = (key, code)
+            self._dirty = True
+        return code
+
+    def load_module(self, name, filename):
+        '''
+        Loads a python module from a file, like imp.load_source, using the
+        cached code
+
+        @param name: name of the module
+        @type name: str
+        @param filename: path of the file
+        @type filename: str
+        @return: the module
+        @rtype: module
+        '''
+        module = types.ModuleType(name)
+        module.__file__ = filename
+        sys.modules[name] = module
+        try:
+            exec(self.compile(filename), module.__dict__)
+        except:
+            del sys.modules[name]
+            raise
+        return module
+
+    def save(self):
+        '''
+        Saves the cache if any file was compiled, forgetting the files that
+        don't exist anymore
+        '''
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict([(f, e) for f, e in self._entries.items()
+                            if os.path.exists(f)])
+            try:
+                # Other cerbero processes might be reading it
+                with shell.atomic_write(self.path, 'wb') as f:
+                    marshal.dump((CACHE_VERSION, importlib.util.MAGIC_NUMBER,
+                                  entries), f)
+                self._dirty = False
+            except (OSError, ValueError) as ex:
+                m.warning(_("Could not save the compiled code cache %s: %s")
+                          % (self.path, ex))
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        self._entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                version, magic, entries = marshal.load(f)
+            if version == CACHE_VERSION and \
+                    magic == importlib.util.MAGIC_NUMBER:
+                self._entries = entries
+        except Exception:
+            # Missing or unreadable, everything is compiled again
+            pass
+        return self._entries
@@ -0,0 +1,103 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+
+
+CCACHE = 'ccache'
+SCCACHE = 'sccache'
+STATS_LOG = 'cerbero-ccache-stats.log'
+
+HIT_RESULTS = ['direct_cache_hit', 'preprocessed_cache_hit']
+MISS_RESULTS = ['cache_miss']
+
+
+def environment(config):
+    '''
+    Gets the environment variables configuring the compiler cache of a
+    configuration, with the cache directory and its maximum size
+
+    @param config: the configuration
+    @type config: L{cerbero.config.Config}
+    @return: the environment variables
+    @rtype: dict
+    '''
+    if not config.use_ccache:
+        return {}
+    if config.compiler_cache == SCCACHE:
+        return {'SCCACHE_DIR': config.compiler_cache_dir,
+                'SCCACHE_CACHE_SIZE': config.compiler_cache_size}
+    # Paths below the base dir are hashed relative to the build dir, so that
+    # the objects of each arch and configuration can be shared
+    common = []
+    for a, b in zip(os.path.abspath(config.sources).split(os.sep),
+                    os.path.abspath(config.prefix).split(os.sep)):
+        if a != b:
+            break
+        common.append(a)
+    basedir = os.sep.join(common)
+    if not basedir or os.path.dirname(basedir) == basedir:
+        basedir = config.sources
+    return {'CCACHE_DIR': config.compiler_cache_dir,
+            'CCACHE_MAXSIZE': config.compiler_cache_size,
+            'CCACHE_BASEDIR': basedir}
+
+
+def collect_stats(config, env, build_dir):
+    '''
+    Sets up the environment of a compile step to log the results of the
+    compiler cache, that are read later with L{read_stats}. Only ccache
+    supports it.
+
+    @param config: the configuration
+    @type config: L{cerbero.config.Config}
+    @param env: environment of the step
+    @type env: dict
+    @param build_dir: build directory of the recipe
+    @type build_dir: str
+    '''
+    path = os.path.join(build_dir, STATS_LOG)
+    if os.path.exists(path):
+        os.remove(path)
+    if config.use_ccache and config.compiler_cache == CCACHE:
+        env['CCACHE_STATSLOG'] = path
+
+
+def read_stats(build_dir):
+    '''
+    Reads the results of the compiler cache in the last compile step
+
+    @param build_dir: build directory of the recipe
+    @type build_dir: str
+    @return: number of hits and misses, or None if they were not logged
+    @rtype: tuple
+    '''
+    path = os.path.join(build_dir, STATS_LOG)
+    if not os.path.exists(path):
+        return None
+    hits = misses = 0
+    with open(path) as f:
+        # Each compilation is logged as a '# <file>' line followed by the
+        # results
+        for line in f:
+            line = line.strip()
+            if line in HIT_RESULTS:
+                hits += 1
+            elif line in MISS_RESULTS:
+                misses += 1
+    return (hits, misses)
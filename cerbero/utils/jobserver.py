@@ -0,0 +1,265 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import contextlib
+import os
+import re
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+
+
+class JobServer (object):
+    '''
+    A GNU make jobserver shared by all the build steps.
+
+    The tokens are kept in a named pipe that make and ninja read from to
+    start new jobs. Each build step takes a token for the process it runs,
+    and that process takes the other tokens from the pipe, so the number of
+    jobs running across all the recipes never exceeds the budget.
+
+    @ivar jobs: maximum number of jobs running at the same time
+    @type jobs: int
+    @ivar fifo: path of the named pipe with the tokens
+    @type fifo: str
+    @ivar fd: file descriptor of the pipe opened for reading and writing
+    @type fd: int
+    '''
+
+    TOKEN = b'+'
+
+    def __init__(self, jobs):
+        self.jobs = max(1, jobs)
+        self._tmpdir = tempfile.mkdtemp(prefix='cerbero-jobserver-')
+        self.fifo = os.path.join(self._tmpdir, 'fifo')
+        os.mkfifo(self.fifo, 0o600)
+        self.fd = os.open(self.fifo, os.O_RDWR)
+        # Use a different open file for the non-blocking reads, the flag
+        # would be shared with the processes inheriting self.fd otherwise
+        self._nonblock_fd = os.open(self.fifo, os.O_RDONLY | os.O_NONBLOCK)
+        os.write(self.fd, self.TOKEN * self.jobs)
+
+    def acquire(self, count=1):
+        '''
+        Takes tokens from the pipe, waiting for the first one and taking
+        up to @count if they are available
+
+        @param count: maximum number of tokens to take
+        @type count: int
+        @return: the tokens taken
+        @rtype: bytes
+        '''
+        # make 4.3 sets the pipe it inherits as non-blocking, wait until it's
+        # readable instead of relying on a blocking read
+        while True:
+            select.select([self.fd], [], [])
+            try:
+                tokens = os.read(self.fd, 1)
+                break
+            except BlockingIOError:
+                pass
+        if count > 1:
+            try:
+                tokens += os.read(self._nonblock_fd, count - 1)
+            except BlockingIOError:
+                pass
+        return tokens
+
+    def release(self, tokens):
+        '''
+        Puts back tokens in the pipe
+
+        @param tokens: tokens returned by L{acquire}
+        @type tokens: bytes
+        '''
+        os.write(self.fd, tokens)
+
+    def makeflags(self, version=None):
+        '''
+        Gets the MAKEFLAGS pointing to this jobserver
+
+        @param version: (major, minor) version of the client, which
+                        determines how the jobserver is passed to it
+        @type version: tuple
+        @return: the flags
+        @rtype: str
+        '''
+        if version is None or version >= (4, 4):
+            return '-j%d --jobserver-auth=fifo:%s' % (self.jobs, self.fifo)
+        if version >= (4, 2):
+            return '-j%d --jobserver-auth=%d,%d' % (self.jobs, self.fd,
+                                                    self.fd)
+        return '-j%d --jobserver-fds=%d,%d' % (self.jobs, self.fd, self.fd)
+
+    def close(self):
+        os.close(self._nonblock_fd)
+        os.close(self.fd)
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+_server = None
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def start(jobs):
+    '''
+    Starts the jobserver if it's not running and the platform supports it
+
+    @param jobs: maximum number of jobs running at the same time
+    @type jobs: int
+    @return: the jobserver or None if it's not supported
+    @rtype: L{cerbero.utils.jobserver.JobServer}
+    '''
+    global _server
+    if _server is None and hasattr(os, 'mkfifo'):
+        _server = JobServer(jobs)
+    return _server
+
+
+def stop():
+    '''
+    Stops the jobserver
+    '''
+    global _server
+    if _server is not None:
+        _server.close()
+        _server = None
+
+
+def get():
+    '''
+    Gets the running jobserver
+
+    @return: the jobserver or None if it's not running
+    @rtype: L{cerbero.utils.jobserver.JobServer}
+    '''
+    return _server
+
+
+def fds():
+    '''
+    Gets the file descriptors that child processes must inherit
+
+    @return: list of file descriptors
+    @rtype: list
+    '''
+    if _server is None:
+        return []
+    return [_server.fd]
+
+
+def tool_version(tool, env=None):
+    '''
+    Gets the version of a tool like make or ninja, caching it per tool and
+    PATH
+
+    @param tool: name of the tool
+    @type tool: str
+    @param env: environment used to find the tool
+    @type env: dict
+    @return: (major, minor) version or None if it's not found
+    @rtype: tuple
+    '''
+    env = env if env is not None else os.environ
+    key = (tool, env.get('PATH'))
+    with _versions_lock:
+        if key in _versions:
+            return _versions[key]
+    version = None
+    try:
+        out = subprocess.check_output([tool, '--version'], env=env,
+                                      stderr=subprocess.STDOUT,
+                                      universal_newlines=True)
+        match = re.search(r'(\d+)\.(\d+)', out)
+        if match:
+            version = (int(match.group(1)), int(match.group(2)))
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    with _versions_lock:
+        _versions[key] = version
+    return version
+
+
+@contextlib.contextmanager
+def make_slot(env, jobs, parallel=True):
+    '''
+    Reserves a job for a make process and sets MAKEFLAGS in @env so that
+    it takes its parallel jobs from the jobserver. Without jobserver it
+    runs @jobs parallel jobs.
+
+    @param env: environment of the make process
+    @type env: dict
+    @param jobs: number of jobs to use without jobserver
+    @type jobs: int
+    @param parallel: whether make can run parallel jobs
+    @type parallel: bool
+    '''
+    server = _server
+    tokens = None
+    if server is not None:
+        tokens = server.acquire()
+    try:
+        if parallel and server is not None:
+            env['MAKEFLAGS'] = server.makeflags(tool_version('make', env))
+        elif parallel and jobs > 1:
+            env['MAKEFLAGS'] = '-j%d' % jobs
+        yield
+    finally:
+        if parallel:
+            env.pop('MAKEFLAGS', None)
+        if tokens:
+            server.release(tokens)
+
+
+@contextlib.contextmanager
+def ninja_slot(env, jobs, ninja='ninja'):
+    '''
+    Reserves jobs for a ninja process. Ninja 1.13 and newer take their jobs
+    from the jobserver passed in MAKEFLAGS, for older versions as many
+    tokens as available are taken, up to @jobs.
+
+    @param env: environment of the ninja process
+    @type env: dict
+    @param jobs: maximum number of jobs
+    @type jobs: int
+    @param ninja: ninja executable
+    @type ninja: str
+    @return: number of jobs to pass to ninja with -j, or None if it uses the
+             jobserver
+    @rtype: int
+    '''
+    server = _server
+    if server is None:
+        yield jobs
+        return
+    version = tool_version(ninja, env)
+    jobserver_client = version is not None and version >= (1, 13)
+    tokens = server.acquire(1 if jobserver_client else jobs)
+    try:
+        if jobserver_client:
+            env['MAKEFLAGS'] = server.makeflags()
+            yield None
+        else:
+            yield len(tokens)
+    finally:
+        if jobserver_client:
+            env.pop('MAKEFLAGS', None)
+        server.release(tokens)
@@ -16,6 +16,8 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import contextlib
+import filecmp
 import logging
 import subprocess
 import shlex
@@ -29,11 +31,13 @@ import time
 import glob
 import shutil
 import hashlib
+import threading
 import urllib.request, urllib.error, urllib.parse
 from distutils.version import StrictVersion
 
 from cerbero.enums import Platform
 from cerbero.utils import _, system_info, to_unixpath
+from cerbero.utils import jobserver
 from cerbero.utils import messages as m
 from cerbero.errors import FatalError
 
@@ -43,9 +47,76 @@ TAR = 'tar'
 
 
 PLATFORM = system_info()[0]
-LOGFILE = None  # open('/tmp/cerbero.log', 'w+')
 DRY_RUN = False
 
+# Log files and environments are per thread, so that recipes built
+# concurrently write their output to their own step log and run their
+# commands with their own environment
+_local = threading.local()
+
+
+def _logfile():
+    return getattr(_local, 'logfile', None)
+
+
+class Environment(dict):
+    '''
+    Environment variables used to run commands
+
+    Build steps run their commands with their own environment instead of
+    modifying os.environ, so that several of them can run at the same time
+    '''
+
+    def modify(self, append_env=None, new_env=None):
+        '''
+        Gets a copy of this environment appending the values in append_env
+        and replacing the values in new_env, where None unsets the variable
+
+        @param append_env: variables to append
+        @type append_env: dict
+        @param new_env: variables to replace
+        @type new_env: dict
+        @return: the new environment
+        @rtype: L{cerbero.utils.shell.Environment}
+        '''
+        env = Environment(self)
+        for var, val in (append_env or {}).items():
+            if var not in env:
+                env[var] = val
+            else:
+                env[var] = '%s %s' % (env[var], val)
+
+        for var, val in (new_env or {}).items():
+            if val is None:
+                env.pop(var, None)
+            else:
+                env[var] = val
+        return env
+
+
+@contextlib.contextmanager
+def environment(env):
+    '''
+    Runs the commands called from this thread within the context with the
+    given environment instead of os.environ
+
+    @param env: the environment
+    @type env: L{cerbero.utils.shell.Environment}
+    '''
+    previous = getattr(_local, 'env', None)
+    _local.env = env
+    try:
+        yield env
+    finally:
+        _local.env = previous
+
+
+def _environment(env=None):
+    # None makes subprocess inherit os.environ without copying it
+    if env is None:
+        return getattr(_local, 'env', None)
+    return env
+
 
 def set_logfile_output(location):
     '''
@@ -55,11 +126,10 @@ def set_logfile_output(location):
     @type location: str
     '''
 
-    global LOGFILE
-    if not LOGFILE is None:
+    if not _logfile() is None:
         raise Exception("Logfile was already open. Forgot to call "
                         "close_logfile_output() ?")
-    LOGFILE = open(location, "w+")
+    _local.logfile = open(location, "w+")
 
 
 def close_logfile_output(dump=False):
@@ -69,23 +139,23 @@ def close_logfile_output(dump=False):
     @param dump: dump the log file to stdout
     @type dump: bool
     '''
-    global LOGFILE
-    if LOGFILE is None:
+    logfile = _logfile()
+    if logfile is None:
         raise Exception("No logfile was open")
     if dump:
-        LOGFILE.seek(0)
+        logfile.seek(0)
         while True:
-            data = LOGFILE.read()
+            data = logfile.read()
             if data:
                 print(data)
             else:
                 break
     # if logfile is empty, remove it
-    pos = LOGFILE.tell()
-    LOGFILE.close()
+    pos = logfile.tell()
+    logfile.close()
     if pos == 0:
-        os.remove(LOGFILE.name)
-    LOGFILE = None
+        os.remove(logfile.name)
+    _local.logfile = None
 
 
 class StdOut:
@@ -111,7 +181,7 @@ def _fix_mingw_cmd(path):
     return ''.join(l_path)
 
 
-def call(cmd, cmd_dir='.', fail=True, verbose=False):
+def call(cmd, cmd_dir='.', fail=True, verbose=False, env=None):
     '''
     Run a shell command
 
@@ -121,14 +191,18 @@ def call(cmd, cmd_dir='.', fail=True, verbose=False):
     @param cmd_dir: str
     @param fail: whether or not to raise an exception if the command fails
     @type fail: bool
+    @param env: environment for the command, defaults to the one of the
+                current context or os.environ
+    @type env: L{cerbero.utils.shell.Environment}
     '''
+    logfile = _logfile()
     try:
-        if LOGFILE is None:
+        if logfile is None:
             if verbose:
                 m.message("Running command '%s'" % cmd)
         else:
-            LOGFILE.write("Running command '%s'\n" % cmd)
-            LOGFILE.flush()
+            logfile.write("Running command '%s'\n" % cmd)
+            logfile.flush()
         shell = True
         if PLATFORM == Platform.WINDOWS:
             # windows do not understand ./
@@ -140,7 +214,7 @@ def call(cmd, cmd_dir='.', fail=True, verbose=False):
             cmd = _fix_mingw_cmd(cmd)
             # Disable shell which uses cmd.exe
             shell = False
-        stream = LOGFILE or sys.stdout
+        stream = logfile or sys.stdout
         if DRY_RUN:
             # write to sdterr so it's filtered more easilly
             m.error("cd %s && %s && cd %s" % (cmd_dir, cmd, os.getcwd()))
@@ -149,7 +223,8 @@ def call(cmd, cmd_dir='.', fail=True, verbose=False):
             ret = subprocess.check_call(cmd, cwd=cmd_dir,
                                        stderr=subprocess.STDOUT,
                                        stdout=StdOut(stream),
-                                       env=os.environ.copy(), shell=shell)
+                                       env=_environment(env), shell=shell,
+                                       pass_fds=jobserver.fds())
     except subprocess.CalledProcessError:
         if fail:
             raise FatalError(_("Error running command: %s") % cmd)
@@ -158,13 +233,15 @@ def call(cmd, cmd_dir='.', fail=True, verbose=False):
     return ret
 
 
-def check_call(cmd, cmd_dir=None, shell=False, split=True, fail=False):
+def check_call(cmd, cmd_dir=None, shell=False, split=True, fail=False,
+               env=None):
     if split and isinstance(cmd, str):
         cmd = shlex.split(cmd)
     try:
         process = subprocess.Popen(cmd, cwd=cmd_dir,
                                    stdout=subprocess.PIPE,
-                                   stderr=open(os.devnull), shell=shell)
+                                   stderr=open(os.devnull), shell=shell,
+                                   env=_environment(env))
         output, unused_err = process.communicate()
         if process.poll() and fail:
             raise Exception()
@@ -239,7 +316,7 @@ def download_wget(url, destination=None, recursive=False, check_cert=True, overw
         cmd += " --no-check-certificate"
 
     if not recursive and not overwrite and os.path.exists(destination):
-        if LOGFILE is None:
+        if _logfile() is None:
             logging.info("File %s already downloaded." % destination)
     else:
         if not recursive and not os.path.exists(os.path.dirname(destination)):
@@ -247,8 +324,8 @@ def download_wget(url, destination=None, recursive=False, check_cert=True, overw
         elif recursive and not os.path.exists(destination):
             os.makedirs(destination)
 
-        if LOGFILE:
-            LOGFILE.write("Downloading %s\n" % url)
+        if _logfile():
+            _logfile().write("Downloading %s\n" % url)
         else:
             logging.info("Downloading %s", url)
         try:
@@ -283,13 +360,13 @@ def download_urllib2(url, destination=None, recursive=False, check_cert=False, o
         destination = os.path.basename(url)
 
     if not overwrite and os.path.exists(destination):
-        if LOGFILE is None:
+        if _logfile() is None:
             logging.info("File %s already downloaded." % destination)
         return
     if not os.path.exists(os.path.dirname(destination)):
         os.makedirs(os.path.dirname(destination))
-    if LOGFILE:
-        LOGFILE.write("Downloading %s\n" % url)
+    if _logfile():
+        _logfile().write("Downloading %s\n" % url)
     else:
         logging.info("Downloading %s", url)
     try:
@@ -405,6 +482,77 @@ def find_files(pattern, prefix):
     return glob.glob(os.path.join(prefix, pattern))
 
 
+def find_files_named(root, names, skip_dirs=None):
+    '''
+    Finds the regular files with some names in a directory tree, walking it
+    only once
+
+    @param root: root of the tree
+    @type root: str
+    @param names: names of the files
+    @type names: list
+    @param skip_dirs: names of the directories that are not walked
+    @type skip_dirs: list
+    @return: paths of the files found
+    @rtype: list
+    '''
+    skip_dirs = skip_dirs or []
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in skip_dirs]
+        for name in filenames:
+            if name not in names:
+                continue
+            path = os.path.join(dirpath, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                found.append(path)
+    return sorted(found)
+
+
+def copy_if_changed(src, dest):
+    '''
+    Copies a file unless the destination has the same content already, in
+    which case its modification time is kept
+
+    @param src: path of the file
+    @type src: str
+    @param dest: path of the copy
+    @type dest: str
+    @return: whether the file was copied
+    @rtype: bool
+    '''
+    if os.path.exists(dest) and filecmp.cmp(src, dest, shallow=False):
+        return False
+    shutil.copy(src, dest)
+    return True
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    '''
+    Opens a temporary file next to the given path, which replaces it once
+    it's written, so that other processes reading it never see a partial
+    file. The temporary file is removed if writing it fails.
+
+    @param path: path of the file
+    @type path: str
+    @param mode: mode used to open the file, 'w' or 'wb'
+    @type mode: str
+    '''
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
 def prompt(message, options=[]):
     ''' Prompts the user for input with the message and options '''
     if len(options) != 0:
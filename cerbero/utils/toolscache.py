@@ -0,0 +1,97 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import os
+import threading
+
+from cerbero.utils import _, shell
+from cerbero.utils import messages as m
+
+
+TOOLS_CACHE = 'host-tools.cache'
+# Bumped when the format of the cache changes
+CACHE_VERSION = 1
+
+_lock = threading.Lock()
+# Values probed by this process, by cache file
+_probed = {}
+
+
+def probe(tool, name, func, cache_path=None):
+    '''
+    Gets a value probed running a host tool, like its version. The value is
+    probed once per process and stored in a cache file for the next ones,
+    until the path or the modification time of the tool change.
+
+    @param tool: name of the tool, looked up in the PATH
+    @type tool: str
+    @param name: name of the value probed
+    @type name: str
+    @param func: function probing the value, called with the path of the
+                 tool, that must return a value that can be saved as JSON
+    @type func: function
+    @param cache_path: path of the cache file, or None to only cache the
+                       value in this process
+    @type cache_path: str
+    @return: the probed value
+    '''
+    path = shell.which(tool)
+    if path is None:
+        # Let the probe fail the same way it would without the cache
+        return func(tool)
+    mtime = os.stat(path).st_mtime_ns
+    key = '%s %s' % (path, name)
+    with _lock:
+        entries = _entries(cache_path)
+        entry = entries.get(key)
+        if entry is not None and entry['mtime'] == mtime:
+            return entry['value']
+    value = func(path)
+    with _lock:
+        entries[key] = {'mtime': mtime, 'value': value}
+        if cache_path is not None:
+            _save(cache_path, entries)
+    return value
+
+
+def _entries(cache_path):
+    if cache_path in _probed:
+        return _probed[cache_path]
+    entries = {}
+    if cache_path is not None:
+        try:
+            with open(cache_path) as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                entries = data['entries']
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable, the values are probed again
+            pass
+    _probed[cache_path] = entries
+    return entries
+
+
+def _save(cache_path, entries):
+    try:
+        with shell.atomic_write(cache_path) as f:
+            json.dump({'version': CACHE_VERSION, 'entries': entries}, f,
+                      indent=1, sort_keys=True)
+    except (OSError, TypeError, ValueError) as ex:
+        m.warning(_("Could not save the host tools cache %s: %s") %
+                  (cache_path, ex))
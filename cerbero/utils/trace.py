@@ -0,0 +1,180 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Tracer (object):
+    '''
+    Records spans of time in the Chrome trace event format, which can be
+    loaded in Perfetto or chrome://tracing.
+
+    Spans are shown in a lane per thread, unless they are given a named
+    lane, like the one of each architecture of a universal recipe.
+
+    @ivar name: name of the process shown in the trace
+    @type name: str
+    @ivar events: recorded trace events
+    @type events: list
+    '''
+
+    def __init__(self, name='cerbero'):
+        self.name = name
+        self.events = []
+        self._start = time.time()
+        self._pid = os.getpid()
+        self._lanes = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, cat, start, end, lane=None, args=None):
+        '''
+        Adds a complete span
+
+        @param name: name of the span
+        @type name: str
+        @param cat: category of the span, like 'step' or 'fetch'
+        @type cat: str
+        @param start: start time as returned by time.time()
+        @type start: float
+        @param end: end time as returned by time.time()
+        @type end: float
+        @param lane: name of the lane, defaults to the current thread's one
+        @type lane: str
+        @param args: extra information shown with the span
+        @type args: dict
+        '''
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': self._pid,
+                 'ts': int((start - self._start) * 1e6),
+                 'dur': int((end - start) * 1e6)}
+        if args:
+            event['args'] = args
+        with self._lock:
+            event['tid'] = self._lane_id(lane)
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, cat, lane=None, args=None):
+        '''
+        Records a span for the duration of the context
+
+        @see: L{add_span}
+        '''
+        args = dict(args or {})
+        start = time.time()
+        try:
+            yield
+        except BaseException as ex:
+            args['error'] = str(ex).strip()
+            raise
+        finally:
+            self.add_span(name, cat, start, time.time(), lane, args)
+
+    def save(self, filename):
+        '''
+        Writes the trace to a file
+
+        @param filename: path of the trace file
+        @type filename: str
+        '''
+        with self._lock:
+            events = [{'name': 'process_name', 'ph': 'M', 'pid': self._pid,
+                       'args': {'name': self.name}}]
+            for lane, tid in self._lanes.items():
+                events.append({'name': 'thread_name', 'ph': 'M',
+                               'pid': self._pid, 'tid': tid,
+                               'args': {'name': lane}})
+                events.append({'name': 'thread_sort_index', 'ph': 'M',
+                               'pid': self._pid, 'tid': tid,
+                               'args': {'sort_index': tid}})
+            events += self.events
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def _lane_id(self, lane):
+        if lane is None:
+            thread = threading.current_thread()
+            if thread is threading.main_thread():
+                lane = 'main'
+            else:
+                worker = self._workers.setdefault(thread.ident,
+                                                  len(self._workers) + 1)
+                lane = 'worker %d' % worker
+        if lane not in self._lanes:
+            self._lanes[lane] = len(self._lanes) + 1
+        return self._lanes[lane]
+
+
+_tracer = None
+
+
+def get():
+    '''
+    Gets the active tracer
+
+    @return: the tracer or None if not tracing
+    @rtype: L{cerbero.utils.trace.Tracer}
+    '''
+    return _tracer
+
+
+@contextlib.contextmanager
+def tracing(filename, name='cerbero'):
+    '''
+    Traces everything run in this context to @filename, doing nothing if
+    @filename is None or a trace is already being recorded
+
+    @param filename: path of the trace file
+    @type filename: str
+    @param name: name of the process shown in the trace
+    @type name: str
+    '''
+    global _tracer
+    if filename is None or _tracer is not None:
+        yield
+        return
+    _tracer = Tracer(name)
+    try:
+        yield
+    finally:
+        tracer, _tracer = _tracer, None
+        tracer.save(filename)
+
+
+@contextlib.contextmanager
+def span(name, cat, lane=None, **args):
+    '''
+    Records a span with the active tracer, if any
+
+    @param name: name of the span
+    @type name: str
+    @param cat: category of the span
+    @type cat: str
+    @param lane: name of the lane, defaults to the current thread's one
+    @type lane: str
+    '''
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    with tracer.span(name, cat, lane, args):
+        yield
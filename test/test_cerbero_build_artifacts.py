@@ -0,0 +1,253 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import importlib.util
+import io
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from cerbero.build import recipe
+from cerbero.build.artifacts import ArtifactCache, HTTPStore, check_members
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import CookBook
+from cerbero.build.history import BuildHistory
+from cerbero.build.oven import Oven
+from cerbero.build.source import SourceType
+from cerbero.config import Platform, Variants
+from test.test_common import DummyConfig
+
+
+class Config(DummyConfig):
+
+    target_platform = Platform.LINUX
+    interactive = False
+
+    def __init__(self, tmp):
+        self.home_dir = tmp
+        self.logs = tmp
+        self.sources = tmp
+        self.prefix = os.path.join(tmp, 'prefix')
+        self.artifact_cache = os.path.join(tmp, 'artifacts')
+        self.cache_file = 'test.cache'
+        self.variants = Variants([])
+
+
+class Recipe(recipe.Recipe):
+
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    version = '1.0'
+
+    def __init__(self, config, cooked):
+        recipe.Recipe.__init__(self, config)
+        self.__file__ = __file__
+        self.cooked = cooked
+
+    def install(self):
+        self.cooked.append(self.name)
+        for f in self.files_list():
+            path = os.path.join(self.config.prefix, f)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(self.name)
+
+
+class ArtifactCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config(self.tmp)
+        self.cooked = []
+        self.cookbook = self._cookbook()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _cookbook(self):
+        cookbook = CookBook(self.config, False)
+        cookbook.set_status({})
+        deps = {'a': [], 'b': ['a'], 'c': []}
+        for name, recipe_deps in deps.items():
+            klass = type(name, (Recipe,), {'__module__': __name__,
+                'name': name, 'deps': recipe_deps,
+                'files_misc': ['share/%s/file' % name]})
+            cookbook.add_recipe(klass(self.config, self.cooked))
+        return cookbook
+
+    def testKeys(self):
+        cache = ArtifactCache(self.config, self.cookbook)
+        keys = dict([(x, cache.recipe_key(x)) for x in 'abc'])
+        self.assertEqual(len(set(keys.values())), 3)
+        # keys are stable
+        other = ArtifactCache(self.config, self._cookbook())
+        self.assertEqual(keys['b'], other.recipe_key('b'))
+        # a dependency change invalidates the recipes depending on it
+        self.cookbook.get_recipe('a').version = '2.0'
+        cache.invalidate('a')
+        cache.invalidate('b')
+        self.assertNotEqual(keys['a'], cache.recipe_key('a'))
+        self.assertNotEqual(keys['b'], cache.recipe_key('b'))
+        self.assertEqual(keys['c'], cache.recipe_key('c'))
+        # and so does the configuration
+        self.config.target_arch = 'arm'
+        other = ArtifactCache(self.config, self.cookbook)
+        self.assertNotEqual(keys['c'], other.recipe_key('c'))
+
+    def testOven(self):
+        Oven(['b', 'c'], self.cookbook).start_cooking()
+        self.assertEqual(self.cooked, ['a', 'b', 'c'])
+        for name in 'abc':
+            self.assertTrue(os.path.isdir(os.path.join(self.tmp, 'artifacts',
+                                                       name)))
+
+        # a clean build restores everything from the cache
+        shutil.rmtree(self.config.prefix)
+        self.cooked = []
+        self.cookbook = self._cookbook()
+        Oven(['b', 'c'], self.cookbook).start_cooking()
+        self.assertEqual(self.cooked, [])
+        for name in 'abc':
+            with open(os.path.join(self.config.prefix, 'share', name,
+                                   'file')) as f:
+                self.assertEqual(f.read(), name)
+            self.assertFalse(self.cookbook.recipe_needs_build(name))
+
+        # changing a recipe rebuilds it and the ones depending on it
+        self.cooked = []
+        self.cookbook = self._cookbook()
+        self.cookbook.get_recipe('a').version = '2.0'
+        Oven(['b', 'c'], self.cookbook).start_cooking()
+        self.assertEqual(self.cooked, ['a', 'b'])
+
+        history = BuildHistory(self.config)
+        self.assertEqual(history.recipes_durations().keys(), set(['a', 'b',
+                                                                  'c']))
+        history.close()
+
+    def _tar(self, members):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            for name, kind, linkname in members:
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = linkname
+                tar.addfile(info, io.BytesIO(b''))
+        data.seek(0)
+        return tarfile.open(fileobj=data)
+
+    def testCheckMembers(self):
+        prefix = self.config.prefix
+        check_members(self._tar([
+            ('lib', tarfile.DIRTYPE, ''),
+            ('lib/libfoo.so.1', tarfile.REGTYPE, ''),
+            ('lib/libfoo.so', tarfile.SYMTYPE, 'libfoo.so.1'),
+            ('lib/libbar.so', tarfile.SYMTYPE, '../lib/libfoo.so.1'),
+            ('lib/libfoo2.so.1', tarfile.LNKTYPE, 'lib/libfoo.so.1')]),
+            prefix)
+        for member in [('../evil', tarfile.REGTYPE, ''),
+                       ('lib/../../evil', tarfile.REGTYPE, ''),
+                       ('/tmp/evil', tarfile.REGTYPE, ''),
+                       ('lib/evil', tarfile.SYMTYPE, '../../evil'),
+                       ('lib/evil', tarfile.SYMTYPE, '/etc/passwd'),
+                       ('lib/evil', tarfile.LNKTYPE, '/etc/passwd'),
+                       ('dev/evil', tarfile.CHRTYPE, ''),
+                       ('evil', tarfile.FIFOTYPE, '')]:
+            self.assertRaises(tarfile.TarError, check_members,
+                              self._tar([member]), prefix)
+
+
+def load_server():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tools',
+                        'artifact-cache-server.py')
+    spec = importlib.util.spec_from_file_location('artifact_cache_server',
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class RemoteArtifactCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = load_server().ArtifactsServer(('127.0.0.1', 0),
+            os.path.join(self.tmp, 'server'))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        self.cooked = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp)
+
+    def _build(self, host, url):
+        # every host has its own home and local cache, but the same prefix
+        config = Config(os.path.join(self.tmp, host))
+        config.prefix = os.path.join(self.tmp, 'prefix')
+        config.artifact_cache = None
+        config.artifact_cache_remote = url
+        cookbook = CookBook(config, False)
+        cookbook.set_status({})
+        for name, deps in {'a': [], 'b': ['a']}.items():
+            klass = type(name, (Recipe,), {'__module__': __name__,
+                'name': name, 'deps': deps,
+                'files_misc': ['share/%s/file' % name]})
+            cookbook.add_recipe(klass(config, self.cooked))
+        Oven(['b'], cookbook, jobs=2).start_cooking()
+        return config
+
+    def testStore(self):
+        store = HTTPStore(self.url)
+        src = os.path.join(self.tmp, 'src')
+        dest = os.path.join(self.tmp, 'dest')
+        with open(src, 'w') as f:
+            f.write('artifact')
+        self.assertFalse(store.get('a/key.tar.gz', dest))
+        store.put('a/key.tar.gz', src)
+        self.assertTrue(store.get('a/key.tar.gz', dest))
+        with open(dest) as f:
+            self.assertEqual(f.read(), 'artifact')
+
+    def testShared(self):
+        self._build('host1', self.url)
+        self.assertEqual(self.cooked, ['a', 'b'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp, 'server'))),
+                         ['a', 'b'])
+        self.cooked = []
+        shutil.rmtree(os.path.join(self.tmp, 'prefix'))
+        config = self._build('host2', self.url)
+        self.assertEqual(self.cooked, [])
+        self.assertTrue(os.path.exists(os.path.join(config.prefix, 'share',
+                                                    'b', 'file')))
+
+    def testUnreachable(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        sock.close()
+        self._build('host1', url)
+        self.assertEqual(self.cooked, ['a', 'b'])
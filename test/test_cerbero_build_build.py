@@ -18,9 +18,18 @@
 
 import unittest
 import os
+import shutil
+import tempfile
 
 from test.test_common import DummyConfig
 from cerbero.build import build
+from cerbero.utils import shell
+
+
+class Config(DummyConfig):
+
+    def get_build_env(self):
+        return shell.Environment(os.environ)
 
 
 class MakefilesBase(build.MakefilesBase):
@@ -34,9 +43,9 @@ class MakefilesBase(build.MakefilesBase):
 
     @build.modify_environment
     def get_env_var(self, var):
-        if var not in os.environ:
+        if var not in self.env:
             return None
-        return os.environ[var]
+        return self.env[var]
 
     @build.modify_environment
     def get_env_var_nested(self, var):
@@ -49,7 +58,7 @@ class ModifyEnvTest(unittest.TestCase):
         self.var = 'TEST_VAR'
         self.val1 = 'test'
         self.val2 = 'test2'
-        self.mk = MakefilesBase(DummyConfig())
+        self.mk = MakefilesBase(Config())
 
     def testAppendEnv(self):
         os.environ[self.var] = self.val1
@@ -88,6 +97,19 @@ class ModifyEnvTest(unittest.TestCase):
         val = self.mk.get_env_var('PKG_CONFIG_LIBDIR')
         self.assertEqual(val,'/path/2')
 
+    def testEnvNotModified(self):
+        os.environ[self.var] = self.val1
+        self.mk.new_env = {self.var: self.val2}
+        self.mk.get_env_var(self.var)
+        self.assertEqual(os.environ[self.var], self.val1)
+        self.assertIsNone(self.mk.env)
+
+    def testCommandsEnv(self):
+        self.mk.new_env = {self.var: self.val2}
+        self.mk.make_dir = '.'
+        self.mk.make = 'test "$%s" = "%s"' % (self.var, self.val2)
+        self.mk.compile()
+
     def testNestedModif(self):
         os.environ[self.var] = self.val1
         self.mk.append_env = {self.var: self.val2}
@@ -95,3 +117,120 @@ class ModifyEnvTest(unittest.TestCase):
         self.assertEqual(val, "%s %s" % (self.val1, self.val2))
         val = self.mk.get_env_var_nested(self.var)
         self.assertEqual(val, "%s %s" % (self.val1, self.val2))
+
+
+CONFIGURE = '''#!/bin/sh
+echo "$@" >> configure.log
+touch Makefile
+'''
+
+
+class ConfigureStampTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.libdir = '/test/lib'
+        self.config.host = self.config.build = self.config.target = None
+        self.configure = os.path.join(self.tmp, 'configure')
+        with open(self.configure, 'w') as f:
+            f.write(CONFIGURE)
+        os.chmod(self.configure, 0o755)
+        self.mk = MakefilesBase(self.config)
+        self.mk.make_dir = self.mk.config_src_dir = self.tmp
+        self.mk.config_sh = './configure'
+        self.mk.configure_tpl = '%(config-sh)s %(options)s'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _runs(self):
+        with open(os.path.join(self.tmp, 'configure.log')) as f:
+            return f.read().split('\n')[:-1]
+
+    def testSkipConfigure(self):
+        self.mk.configure()
+        self.mk.configure()
+        self.assertEqual(self._runs(), [''])
+        self.mk.configure_options = '--enable-foo'
+        self.mk.configure()
+        self.assertEqual(self._runs(), ['', '--enable-foo'])
+        self.mk.new_env = {'CFLAGS': '-O0'}
+        self.mk.configure()
+        self.assertEqual(len(self._runs()), 3)
+
+    def testConfigureScriptChanged(self):
+        self.mk.configure()
+        st = os.stat(self.configure)
+        os.utime(self.configure, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.mk.configure()
+        self.assertEqual(len(self._runs()), 2)
+
+    def testForceConfigure(self):
+        self.mk.configure()
+        self.mk.force_configure = True
+        self.mk.configure()
+        self.assertEqual(len(self._runs()), 2)
+
+    def testDepsRebuilt(self):
+        self.mk.deps_fingerprints = {'dep': 'a'}
+        self.mk.configure()
+        self.mk.configure()
+        self.assertEqual(len(self._runs()), 1)
+        self.mk.deps_fingerprints = {'dep': 'b'}
+        self.mk.configure()
+        self.assertEqual(len(self._runs()), 2)
+
+    def testMissingOutput(self):
+        self.mk.configure()
+        os.remove(os.path.join(self.tmp, 'Makefile'))
+        self.mk.configure()
+        self.assertEqual(len(self._runs()), 2)
+
+
+class ConfigScriptsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp, 'data')
+        self.src = os.path.join(self.tmp, 'src')
+        self._write(os.path.join(self.data, 'autotools', 'config.guess'),
+                    'guess')
+        self._write(os.path.join(self.data, 'autotools', 'config.sub'),
+                    'sub')
+        config = Config()
+        config._relative_path = lambda path: os.path.join(self.tmp, path)
+        self.mk = MakefilesBase(config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, path, content):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _read(self, path):
+        with open(os.path.join(self.src, path)) as f:
+            return f.read()
+
+    def testUpdateConfigScripts(self):
+        self._write(os.path.join(self.src, 'config.guess'), 'old')
+        self._write(os.path.join(self.src, 'build-aux', 'config.sub'), 'old')
+        self._write(os.path.join(self.src, 'config.status'), 'old')
+        self._write(os.path.join(self.src, '.git', 'config.sub'), 'old')
+        self._write(os.path.join(self.src, 'tests', 'config.sub'), 'old')
+        self.mk.update_config_scripts(self.src)
+        self.assertEqual(self._read('config.guess'), 'guess')
+        self.assertEqual(self._read('build-aux/config.sub'), 'sub')
+        self.assertEqual(self._read('config.status'), 'old')
+        self.assertEqual(self._read('.git/config.sub'), 'old')
+        self.assertEqual(self._read('tests/config.sub'), 'old')
+
+    def testUnchangedScriptsNotCopied(self):
+        path = os.path.join(self.src, 'config.guess')
+        self._write(path, 'guess')
+        os.utime(path, (1, 1))
+        self.mk.update_config_scripts(self.src)
+        self.assertEqual(os.stat(path).st_mtime, 1)
@@ -0,0 +1,92 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.configurecache import ConfigureCache, fingerprint
+from test.test_common import DummyConfig
+
+
+class Config(DummyConfig):
+
+    host = 'x86_64-linux-gnu'
+    build = 'x86_64-linux-gnu'
+    target = None
+
+
+class ConfigureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.sources = os.path.join(self.tmp, 'sources')
+        self.build_dir = os.path.join(self.tmp, 'build')
+        os.makedirs(self.build_dir)
+        self.cc = os.path.join(self.tmp, 'gcc')
+        with open(self.cc, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(self.cc, 0o755)
+        self.env = {'CC': 'ccache gcc', 'CFLAGS': '-O2', 'PATH': self.tmp,
+                    'HOME': '/home/cerbero'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testFingerprint(self):
+        key = fingerprint(self.config, self.env)
+        self.assertEqual(fingerprint(self.config, dict(self.env)), key)
+        # variables not affecting the checks are ignored
+        env = dict(self.env, HOME='/home/other')
+        self.assertEqual(fingerprint(self.config, env), key)
+        # unless the recipe sets them
+        self.assertNotEqual(fingerprint(self.config, env, ['HOME']),
+                            fingerprint(self.config, self.env, ['HOME']))
+        env = dict(self.env, CFLAGS='-O0')
+        self.assertNotEqual(fingerprint(self.config, env), key)
+        env = dict(self.env, ac_cv_func_foo='yes')
+        self.assertNotEqual(fingerprint(self.config, env), key)
+        self.config.host = 'i686-linux-gnu'
+        self.assertNotEqual(fingerprint(self.config, self.env), key)
+
+    def testToolchainChanged(self):
+        key = fingerprint(self.config, self.env)
+        st = os.stat(self.cc)
+        os.utime(self.cc, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(fingerprint(self.config, self.env), key)
+
+    def testSharedCache(self):
+        cache = ConfigureCache(self.config, self.env, self.build_dir)
+        path = cache.prepare()
+        self.assertFalse(os.path.exists(path))
+        with open(path, 'w') as f:
+            f.write('ac_cv_func_foo=yes\n')
+        cache.save()
+        self.assertTrue(os.path.exists(cache.path))
+        # other recipes start from the saved cache
+        build_dir = os.path.join(self.tmp, 'build2')
+        os.makedirs(build_dir)
+        cache = ConfigureCache(self.config, self.env, build_dir)
+        with open(cache.prepare()) as f:
+            self.assertEqual(f.read(), 'ac_cv_func_foo=yes\n')
+        # but not the ones using other flags
+        env = dict(self.env, CFLAGS='-O0')
+        cache = ConfigureCache(self.config, env, build_dir)
+        self.assertFalse(os.path.exists(cache.prepare()))
@@ -16,11 +16,15 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+import shutil
 import unittest
 import tempfile
 import pickle
 
-from cerbero.build.cookbook import CookBook
+from cerbero.build import cookbook as ccookbook
+from cerbero.build.cookbook import CookBook, RecipeStatus
+from cerbero.config import Architecture, Platform, Variants
 from cerbero.errors import RecipeNotFoundError
 from test.test_common import DummyConfig as Config
 from test.test_build_common import Recipe1
@@ -29,10 +33,15 @@ from test.test_build_common import Recipe1
 class PackageTest(unittest.TestCase):
 
     def setUp(self):
+        self.tmp = tempfile.mkdtemp()
         self.config = Config()
-        self.config.cache_file = '/dev/null'
+        self.config.home_dir = self.tmp
+        self.config.cache_file = 'test.cache'
         self.cookbook = CookBook(self.config, False)
 
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
     def testSetGetConfig(self):
         self.assertEqual(self.config, self.cookbook.get_config())
         self.cookbook.set_config(None)
@@ -45,21 +54,36 @@ class PackageTest(unittest.TestCase):
         self.assertEqual(self.cookbook.status, {})
 
     def testSaveCache(self):
-        tmp = tempfile.NamedTemporaryFile()
-        status = {'test': 'test'}
+        status = {'test': RecipeStatus('test', steps=['fetch'])}
         self.cookbook.set_status(status)
-        self.cookbook.get_config().cache_file = tmp.name
         self.cookbook.save()
-        with open(self.cookbook._cache_file(self.config), 'rb') as f:
-            loaded_status = pickle.load(f)
-            self.assertEqual(status, loaded_status)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'test.db')))
+        cookbook = CookBook(self.config, False)
+        cookbook._restore_cache()
+        self.assertEqual(list(cookbook.status.keys()), ['test'])
+        self.assertEqual(cookbook.status['test'].steps, ['fetch'])
+
+        # only the status of the recipe passed is saved
+        status['test'].steps.append('extract')
+        status['other'] = RecipeStatus('other')
+        self.cookbook.save('test')
+        cookbook._restore_cache()
+        self.assertEqual(list(cookbook.status.keys()), ['test'])
+        self.assertEqual(cookbook.status['test'].steps, ['fetch', 'extract'])
+        del status['test']
+        self.cookbook.save('test')
+        cookbook._restore_cache()
+        self.assertEqual(cookbook.status, {})
 
     def testLoad(self):
-        tmp = tempfile.NamedTemporaryFile()
         status = {'test': 'test'}
-        self.cookbook.get_config().cache_file = tmp.name
-        with open(tmp.name, 'wb') as f:
+        with open(os.path.join(self.tmp, 'test.cache'), 'wb') as f:
             pickle.dump(status, f)
+        # the pickled status of older versions is migrated
+        self.cookbook._restore_cache()
+        self.assertEqual(status, self.cookbook.status)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'test.db')))
+        os.remove(os.path.join(self.tmp, 'test.cache'))
         self.cookbook._restore_cache()
         self.assertEqual(status, self.cookbook.status)
 
@@ -121,3 +145,180 @@ class PackageTest(unittest.TestCase):
         status = self.cookbook._recipe_status(recipe.name)
         self.assertEqual(status.steps, [])
         self.assertTrue(self.cookbook.status[recipe.name].needs_build)
+
+
+RECIPE_TPL = '''
+class Recipe(recipe.Recipe):
+    name = '%s'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    deps = %r
+'''
+
+
+class LazyConfig(Config):
+
+    interactive = False
+
+    def __init__(self, tmp):
+        self.home_dir = tmp
+        self.recipes_dir = os.path.join(tmp, 'recipes')
+        self.cache_file = 'test.cache'
+        self.sources = tmp
+        self.prefix = os.path.join(tmp, 'prefix')
+        self.variants = Variants([])
+        self.arch_config = {self.target_arch: self}
+
+    def get_recipes_repos(self):
+        return {'default': (self.recipes_dir, 0)}
+
+    def set_build_env(self):
+        pass
+
+
+class LazyCookBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = LazyConfig(self.tmp)
+        os.makedirs(self.config.recipes_dir)
+        deps = {'a': [], 'b': ['a'], 'c': ['b'], 'd': []}
+        for name, recipe_deps in deps.items():
+            self._write(name, recipe_deps)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name, deps):
+        path = os.path.join(self.config.recipes_dir, '%s.recipe' % name)
+        with open(path, 'w') as f:
+            f.write(RECIPE_TPL % (name, deps))
+
+    def testLazy(self):
+        # the first load scans all the recipes and writes the index
+        cookbook = CookBook(self.config, lazy=True)
+        self.assertEqual(sorted(cookbook.recipes), ['a', 'b', 'c', 'd'])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'test.index')))
+
+        cookbook = CookBook(self.config, lazy=True)
+        self.assertEqual(cookbook.recipes, {})
+        self.assertEqual([r.name for r in cookbook.list_recipe_deps('b')],
+                         ['a', 'b'])
+        self.assertEqual(sorted(cookbook.recipes), ['a', 'b'])
+        self.assertEqual([r.name for r in
+                          cookbook.list_recipe_reverse_deps('b')], ['c'])
+        self.assertEqual(sorted(cookbook.recipes), ['a', 'b', 'c'])
+        self.assertRaises(RecipeNotFoundError, cookbook.get_recipe, 'e')
+        self.assertEqual(sorted(cookbook.recipes), ['a', 'b', 'c', 'd'])
+
+    def testStaleIndex(self):
+        CookBook(self.config, lazy=True)
+        self._write('e', ['d'])
+        cookbook = CookBook(self.config, lazy=True)
+        self.assertEqual(sorted(cookbook.recipes), ['a', 'b', 'c', 'd', 'e'])
+        cookbook = CookBook(self.config, lazy=True)
+        self.assertEqual([r.name for r in cookbook.list_recipe_deps('e')],
+                         ['d', 'e'])
+        self.assertEqual(sorted(cookbook.recipes), ['d', 'e'])
+
+
+class DurationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = LazyConfig(self.tmp)
+        os.makedirs(self.config.recipes_dir)
+        deps = {'a': [], 'b': ['a'], 'c': ['b'], 'd': []}
+        for name, recipe_deps in deps.items():
+            path = os.path.join(self.config.recipes_dir, '%s.recipe' % name)
+            with open(path, 'w') as f:
+                f.write(RECIPE_TPL % (name, recipe_deps))
+        self.cookbook = CookBook(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testStepDuration(self):
+        self.assertIsNone(self.cookbook.recipe_duration('a'))
+        self.cookbook.update_step_status('a', 'fetch', 2.0)
+        self.cookbook.update_step_status('a', 'compile', 10.0)
+        status = self.cookbook._recipe_status('a')
+        self.assertEqual(status.steps_duration, {'fetch': 2.0,
+                                                 'compile': 10.0})
+        self.assertEqual(self.cookbook.recipe_duration('a'), 12.0)
+        # the durations are kept when the status is reset and saved
+        self.cookbook.reset_recipe_status('a')
+        self.assertEqual(self.cookbook.recipe_duration('a'), 12.0)
+        cookbook = CookBook(self.config)
+        self.assertEqual(cookbook.recipe_duration('a'), 12.0)
+
+    def testCriticalPath(self):
+        names = ['a', 'b', 'c', 'd']
+        self.assertEqual(self.cookbook.critical_path(names),
+                         {'a': 180.0, 'b': 120.0, 'c': 60.0, 'd': 60.0})
+        for name, duration in [('a', 10.0), ('b', 5.0), ('d', 3.0)]:
+            self.cookbook.update_step_status(name, 'compile', duration)
+        # c was never built, it takes the average of the others
+        self.assertEqual(self.cookbook.critical_path(names),
+                         {'a': 21.0, 'b': 11.0, 'c': 6.0, 'd': 3.0})
+        self.cookbook.update_build_status('d', '1.0')
+        self.assertEqual(self.cookbook.critical_path(names)['d'], 0)
+        self.assertEqual(self.cookbook.critical_path(names, False)['d'], 3.0)
+
+
+UNIVERSAL_RECIPE = '''
+class Recipe(recipe.Recipe):
+    name = 'u'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    files_libs = ['libu']
+
+    def prepare(self):
+        self.files_libs.append('libu-%s' % self.config.target_arch)
+'''
+
+
+class UniversalCookBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = LazyConfig(self.tmp)
+        self.config.target_arch = Architecture.UNIVERSAL
+        self.config.target_platform = Platform.IOS
+        self.config.arch_config = {}
+        self.envs = []
+        for arch in [Architecture.ARMv7, Architecture.ARM64]:
+            conf = LazyConfig(self.tmp)
+            conf.target_arch = arch
+            conf.target_platform = Platform.IOS
+            conf.set_build_env = lambda arch=arch: self.envs.append(arch)
+            self.config.arch_config[arch] = conf
+        os.makedirs(self.config.recipes_dir)
+        with open(os.path.join(self.config.recipes_dir, 'u.recipe'), 'w') as f:
+            f.write(UNIVERSAL_RECIPE)
+        self.parsed = []
+        self._parse_file = ccookbook.parse_file
+        ccookbook.parse_file = self._count_parse
+
+    def tearDown(self):
+        ccookbook.parse_file = self._parse_file
+        shutil.rmtree(self.tmp)
+
+    def _count_parse(self, filename, *args):
+        self.parsed.append(os.path.basename(filename))
+        return self._parse_file(filename, *args)
+
+    def testSingleParse(self):
+        cookbook = CookBook(self.config)
+        recipe = cookbook.get_recipe('u')
+        self.assertEqual(self.parsed, ['u.recipe'])
+        self.assertEqual(self.envs, [Architecture.ARMv7, Architecture.ARM64])
+        armv7 = recipe._recipes[Architecture.ARMv7]
+        arm64 = recipe._recipes[Architecture.ARM64]
+        self.assertIs(type(armv7), type(arm64))
+        # prepare() doesn't modify the class shared by the archs
+        self.assertEqual(armv7.files_libs, ['libu', 'libu-armv7'])
+        self.assertEqual(arm64.files_libs, ['libu', 'libu-arm64'])
+        self.assertEqual(type(armv7).files_libs, ['libu'])
@@ -0,0 +1,75 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import unittest
+
+from cerbero.build.depgraph import DependencyGraph
+from cerbero.errors import FatalError
+
+
+DEPS = {'a': [], 'b': ['a'], 'c': ['a'], 'd': ['c', 'b'], 'e': [],
+        'f': ['e', 'd']}
+
+
+class DependencyGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = DependencyGraph(DEPS)
+
+    def testDeps(self):
+        self.assertEqual(self.graph.direct_deps('d'), ['c', 'b'])
+        self.assertEqual(self.graph.deps_closure('d'), ['a', 'c', 'b', 'd'])
+        self.assertEqual(self.graph.deps_closure('f'),
+                         ['e', 'a', 'c', 'b', 'd', 'f'])
+        self.assertEqual(self.graph.deps_closure('a'), ['a'])
+        # the memoised closures are not modified by the callers
+        self.graph.deps_closure('d').append('x')
+        self.assertEqual(self.graph.deps_closure('d'), ['a', 'c', 'b', 'd'])
+
+    def testRDeps(self):
+        self.assertEqual(self.graph.direct_rdeps('a'), ['b', 'c'])
+        self.assertEqual(self.graph.rdeps_closure('a'), ['b', 'c', 'd', 'f'])
+        self.assertEqual(self.graph.rdeps_closure('f'), [])
+
+    def testBuildOrder(self):
+        self.assertEqual(self.graph.build_order(['b', 'e', 'd']),
+                         ['a', 'b', 'e', 'c', 'd'])
+
+    def testCycle(self):
+        self.assertIsNone(self.graph.find_cycle())
+        deps = dict(DEPS)
+        deps['a'] = ['d']
+        graph = DependencyGraph(deps)
+        self.assertEqual(graph.find_cycle(), ['a', 'd', 'c', 'a'])
+        try:
+            graph.deps_closure('f')
+            self.fail('FatalError not raised')
+        except FatalError as e:
+            self.assertIn('d -> c -> a -> d', e.msg)
+
+    def testUnknownDep(self):
+        graph = DependencyGraph({'a': ['x']})
+        self.assertRaises(FatalError, graph.deps_closure, 'a')
+        self.assertIsNone(graph.find_cycle())
+
+    def testSerialization(self):
+        data = json.loads(json.dumps(self.graph.to_dict()))
+        graph = DependencyGraph.from_dict(data)
+        self.assertEqual(graph.deps, self.graph.deps)
+        self.assertEqual(graph.rdeps, self.graph.rdeps)
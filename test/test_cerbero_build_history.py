@@ -0,0 +1,99 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build.history import BuildHistory, RecipeResult, StepResult
+from test.test_common import DummyConfig
+
+
+class Config(DummyConfig):
+
+    def __init__(self, tmp, cache_file):
+        self.home_dir = tmp
+        self.cache_file = cache_file
+
+
+class BuildHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.history = BuildHistory(Config(self.tmp, 'linux_x86_64.cache'))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.tmp)
+
+    def _add_run(self, history, durations, status=RecipeResult.BUILT):
+        run = history.start_run(list(durations.keys()))
+        for recipe, duration in durations.items():
+            history.add_step(run, recipe, 'compile', 0, duration,
+                             StepResult.OK)
+            history.add_recipe(run, recipe, 0, duration, status)
+        history.finish_run(run, 'success')
+        return run
+
+    def testDurations(self):
+        self.assertEqual(self.history.recipes_durations(), {})
+        self.assertEqual(self.history.target, 'linux_x86_64')
+        self._add_run(self.history, {'a': 10, 'b': 5})
+        self._add_run(self.history, {'a': 12}, RecipeResult.FAILED)
+        self._add_run(self.history, {'a': 20})
+        self.assertTrue(os.path.exists(os.path.join(self.tmp,
+                                                    'build-history.db')))
+        self.assertEqual(self.history.recipes_durations(),
+                         {'a': [20, 10], 'b': [5]})
+        self.assertEqual(self.history.steps_durations(),
+                         {('a', 'compile'): [20, 12, 10],
+                          ('b', 'compile'): [5]})
+        # Runs are kept per target
+        other = BuildHistory(Config(self.tmp, 'build-tools.cache'))
+        self.assertEqual(other.recipes_durations(), {})
+        self._add_run(other, {'a': 1})
+        self.assertEqual(other.recipes_durations(), {'a': [1]})
+        self.assertEqual(self.history.recipes_durations()['a'], [20, 10])
+        other.close()
+
+    def testSlowestTargets(self):
+        self.assertEqual(self.history.slowest_targets('compile', 5), [])
+        run = self._add_run(self.history, {'a': 10})
+        self.history.add_targets(run, 'a', [('compile', 'x.c.o', 3),
+                                            ('compile', 'y.c.o', 2),
+                                            ('link', 'liba.so', 1)])
+        run = self._add_run(self.history, {'a': 10})
+        self.history.add_targets(run, 'a', [('compile', 'x.c.o', 1)])
+        # Only the last time each target was built counts
+        self.assertEqual(self.history.slowest_targets('compile', 5),
+                         [('a', 'y.c.o', 2), ('a', 'x.c.o', 1)])
+        self.assertEqual(self.history.slowest_targets('compile', 1),
+                         [('a', 'y.c.o', 2)])
+        self.assertEqual(self.history.slowest_targets('link', 5),
+                         [('a', 'liba.so', 1)])
+
+    def testNotWritable(self):
+        # A file where the directory of the database should be
+        path = os.path.join(self.tmp, 'file')
+        open(path, 'w').close()
+        history = BuildHistory(Config(self.tmp, None),
+                               os.path.join(path, 'dir', 'db'))
+        self.assertIsNone(history.start_run(['a']))
+        history.add_step(None, 'a', 'compile', 0, 1, StepResult.OK)
+        history.finish_run(None, 'failed')
@@ -0,0 +1,106 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build import ninjalog
+from cerbero.build.ninjalog import NinjaLog, TargetKind
+from cerbero.utils import trace
+
+
+LOG_HEADER = '# ninja log v5\n'
+
+
+class NinjaLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = NinjaLog(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, lines, mode='a'):
+        with open(os.path.join(self.tmp, ninjalog.NINJA_LOG), mode) as f:
+            for start, end, output in lines:
+                f.write('%d\t%d\t0\t%s\t0123abcd\n' % (start, end, output))
+
+    def testNoLog(self):
+        self.log.mark()
+        self.assertEqual(self.log.read_new(), [])
+
+    def testReadNew(self):
+        self._write([], 'w')
+        with open(self.log.path, 'a') as f:
+            f.write(LOG_HEADER)
+        self._write([(0, 1000, 'a.p/a.c.o')])
+        self.log.mark()
+        self._write([(0, 2500, 'a.p/a.c.o'), (10, 500, 'b.p/b.c.o'),
+                     (2500, 3000, 'liba.so')])
+        self.assertEqual(self.log.read_new(),
+                         [(0, 2.5, 'a.p/a.c.o'), (0.01, 0.5, 'b.p/b.c.o'),
+                          (2.5, 3.0, 'liba.so')])
+        # Built again, only the last entry is kept
+        self.log.mark()
+        self._write([(0, 100, 'b.p/b.c.o'), (0, 200, 'b.p/b.c.o')])
+        self.assertEqual(self.log.read_new(), [(0, 0.2, 'b.p/b.c.o')])
+
+    def testRecompacted(self):
+        self._write([(0, 100, 'a.p/a.c.o')] * 10, 'w')
+        self.log.mark()
+        self._write([(0, 200, 'a.p/a.c.o')], 'w')
+        self.assertEqual(self.log.read_new(), [(0, 0.2, 'a.p/a.c.o')])
+
+    def testTargetKind(self):
+        for output, kind in [
+                ('libfoo.so.p/foo.c.o', TargetKind.COMPILE),
+                ('foo@exe/foo.cpp.obj', TargetKind.COMPILE),
+                ('libfoo.so.1.2.3', TargetKind.LINK),
+                ('libfoo.a', TargetKind.LINK),
+                ('foo-1.0.dll', TargetKind.LINK),
+                ('tools/foo', TargetKind.LINK),
+                ('gst/enumtypes.h', None),
+                ('build.ninja', None)]:
+            self.assertEqual(ninjalog.target_kind(output), kind, output)
+
+    def testSlowestTargets(self):
+        targets = [(0, 1, 'a.c.o'), (0, 5, 'b.c.o'), (0, 3, 'c.c.o'),
+                   (5, 6, 'libfoo.so'), (0, 1, 'foo.h')]
+        timings = ninjalog.targets_timings(targets)
+        self.assertEqual(len(timings), 4)
+        self.assertEqual(ninjalog.slowest_targets(timings, 2),
+                         [(TargetKind.COMPILE, 'b.c.o', 5),
+                          (TargetKind.COMPILE, 'c.c.o', 3),
+                          (TargetKind.LINK, 'libfoo.so', 1)])
+
+    def testTrace(self):
+        tracer = trace.Tracer()
+        targets = [(0, 2, 'a.c.o'), (0, 1, 'b.c.o'), (1, 3, 'c.c.o'),
+                   (3, 4, 'libfoo.so')]
+        ninjalog.trace_targets(tracer, targets, tracer._start + 10, 'foo')
+        lanes = dict([(v, k) for k, v in tracer._lanes.items()])
+        spans = dict([(e['name'], (lanes[e['tid']], e['ts'])) for e in
+                      tracer.events])
+        # Targets built concurrently are in their own lanes
+        self.assertEqual(spans, {'a.c.o': ('foo 2', 10000000),
+                                 'b.c.o': ('foo 1', 10000000),
+                                 'c.c.o': ('foo 1', 11000000),
+                                 'libfoo.so': ('foo 1', 13000000)})
@@ -0,0 +1,277 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import unittest
+import shutil
+import tempfile
+import threading
+
+from cerbero.build import recipe
+from cerbero.build.build import BuildType
+from cerbero.build.cookbook import CookBook, DEFAULT_RECIPE_DURATION
+from cerbero.build.history import BuildHistory
+from cerbero.build.oven import Oven
+from cerbero.build.source import SourceType
+from cerbero.config import Platform, Variants
+from cerbero.errors import BuildStepError, FatalError
+from cerbero.utils import compilercache
+from test.test_common import DummyConfig
+
+
+class Config(DummyConfig):
+
+    target_platform = Platform.LINUX
+    interactive = False
+
+    def __init__(self, tmp):
+        self.home_dir = tmp
+        self.logs = tmp
+        self.sources = tmp
+        self.cache_file = 'test.cache'
+        self.variants = Variants([])
+
+
+class Recipe(recipe.Recipe):
+
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+    version = '1.0'
+    fail = False
+    fail_fetch = False
+    cache_results = None
+
+    def __init__(self, config, cooked, lock):
+        recipe.Recipe.__init__(self, config)
+        self.__file__ = __file__
+        self.cooked = cooked
+        self.lock = lock
+        self.fetch_thread = None
+
+    def fetch(self):
+        self.fetch_thread = threading.current_thread()
+        if self.fail_fetch:
+            raise FatalError('fetch failed')
+
+    def compile(self):
+        # Results of the compiler cache, like ccache logs them
+        if self.cache_results is not None:
+            os.makedirs(self.build_dir)
+            with open(os.path.join(self.build_dir, compilercache.STATS_LOG),
+                      'w') as f:
+                for result in self.cache_results:
+                    f.write('# %s.c\n%s\n' % (self.name, result))
+
+    def install(self):
+        if self.fail:
+            raise FatalError('failed')
+        with self.lock:
+            self.cooked.append(self.name)
+
+
+class OvenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config(self.tmp)
+        self.cookbook = CookBook(self.config, False)
+        self.cookbook.set_status({})
+        self.cooked = []
+        lock = threading.Lock()
+        deps = {'a': [], 'b': ['a'], 'c': ['a'], 'd': ['b', 'c'], 'e': []}
+        for name, recipe_deps in deps.items():
+            klass = type(name, (Recipe,), {'__module__': __name__,
+                                           'name': name,
+                                           'deps': recipe_deps})
+            self.cookbook.add_recipe(klass(self.config, self.cooked, lock))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testParallelFollowsDeps(self):
+        oven = Oven(['d', 'e'], self.cookbook, jobs=3)
+        oven.start_cooking()
+        self.assertEqual(sorted(self.cooked), ['a', 'b', 'c', 'd', 'e'])
+        self.assertTrue(self.cooked.index('a') < self.cooked.index('b'))
+        self.assertTrue(self.cooked.index('a') < self.cooked.index('c'))
+        self.assertTrue(self.cooked.index('b') < self.cooked.index('d'))
+        self.assertTrue(self.cooked.index('c') < self.cooked.index('d'))
+        for name in self.cooked:
+            self.assertFalse(self.cookbook.recipe_needs_build(name))
+
+    def testParallelFailure(self):
+        self.cookbook.get_recipe('b').fail = True
+        oven = Oven(['d', 'e'], self.cookbook, jobs=2)
+        self.assertRaises(BuildStepError, oven.start_cooking)
+        self.assertNotIn('d', self.cooked)
+        self.assertTrue(self.cookbook.recipe_needs_build('b'))
+
+    def _keep_going(self, jobs):
+        self.cookbook.get_recipe('b').fail = True
+        oven = Oven(['d', 'e'], self.cookbook, jobs=jobs, keep_going=True)
+        self.assertRaises(FatalError, oven.start_cooking)
+        self.assertEqual(sorted(self.cooked), ['a', 'c', 'e'])
+        self.assertEqual(list(oven._failed.keys()), ['b'])
+        self.assertEqual(oven._blocked, {'d': ['b']})
+        self.assertTrue(self.cookbook.recipe_needs_build('d'))
+
+    def testKeepGoing(self):
+        self._keep_going(1)
+
+    def testParallelKeepGoing(self):
+        self._keep_going(3)
+
+    def testCompilerCacheStats(self):
+        self.cookbook.get_recipe('a').cache_results = \
+            ['direct_cache_hit', 'cache_miss', 'preprocessed_cache_hit']
+        self.cookbook.get_recipe('b').cache_results = ['cache_miss']
+        oven = Oven(['d'], self.cookbook)
+        oven.start_cooking()
+        self.assertEqual(oven._compiler_cache_stats, {'a': (2, 1),
+                                                      'b': (0, 1)})
+
+    def testPrefetch(self):
+        oven = Oven(['d', 'e'], self.cookbook, prefetch=2)
+        oven.start_cooking()
+        self.assertEqual(self.cooked, ['a', 'b', 'c', 'd', 'e'])
+        recipes = [self.cookbook.get_recipe(x) for x in self.cooked]
+        # the first recipe is fetched by the oven, the others in background
+        self.assertEqual(recipes[0].fetch_thread, threading.current_thread())
+        for r in recipes[1:]:
+            self.assertNotEqual(r.fetch_thread, threading.current_thread())
+            self.assertTrue(self.cookbook.step_done(r.name, 'fetch'))
+
+    def testPrefetchFailure(self):
+        self.cookbook.get_recipe('c').fail_fetch = True
+        oven = Oven(['d', 'e'], self.cookbook, prefetch=3)
+        try:
+            oven.start_cooking()
+            self.fail('BuildStepError not raised')
+        except BuildStepError as e:
+            self.assertEqual(e.recipe.name, 'c')
+            self.assertEqual(e.step, 'fetch')
+        self.assertEqual(self.cooked, ['a', 'b'])
+        self.assertFalse(self.cookbook.step_done('c', 'fetch'))
+
+    def testStepsDuration(self):
+        oven = Oven(['b'], self.cookbook)
+        oven.start_cooking()
+        status = self.cookbook.status['b']
+        self.assertEqual(sorted(status.steps_duration.keys()),
+                         sorted(status.steps))
+        self.assertEqual(self.cookbook.recipe_duration('b'),
+                         sum(status.steps_duration.values()))
+        self.assertIsNone(self.cookbook.recipe_duration('d'))
+        # durations survive a reset of the status
+        self.cookbook.reset_recipe_status('b')
+        self.assertEqual(self.cookbook.status['b'].steps, [])
+        self.assertEqual(self.cookbook.status['b'].steps_duration,
+                         status.steps_duration)
+
+    def testCriticalPath(self):
+        names = ['a', 'b', 'c', 'd', 'e']
+        priorities = self.cookbook.critical_path(names)
+        d = DEFAULT_RECIPE_DURATION
+        self.assertEqual(priorities, {'a': 3 * d, 'b': 2 * d, 'c': 2 * d,
+                                      'd': d, 'e': d})
+        self.cookbook.update_step_status('c', 'compile', 10)
+        self.cookbook.update_step_status('e', 'compile', 100)
+        self.cookbook.update_step_status('d', 'compile', 40)
+        priorities = self.cookbook.critical_path(names)
+        # never built recipes are estimated with the average of the others
+        self.assertEqual(priorities, {'a': 140, 'b': 90, 'c': 50, 'd': 40,
+                                      'e': 100})
+        # already built recipes don't take any time
+        self.cookbook.update_build_status('e', '1.0')
+        self.assertEqual(self.cookbook.critical_path(names)['e'], 0)
+        self.assertEqual(self.cookbook.critical_path(names, False)['e'], 100)
+
+    def testHistory(self):
+        self.cookbook.get_recipe('b').fail = True
+        oven = Oven(['b'], self.cookbook)
+        self.assertRaises(BuildStepError, oven.start_cooking)
+        self.cookbook.get_recipe('b').fail = False
+        Oven(['b'], self.cookbook).start_cooking()
+        history = BuildHistory(self.config)
+        self.assertEqual(sorted(history.recipes_durations().keys()),
+                         ['a', 'b'])
+        self.assertEqual(len(history.recipes_durations()['a']), 1)
+        steps = history.steps_durations()
+        self.assertEqual(len(steps[('b', 'install')]), 1)
+        history.close()
+
+    def testDepsFingerprints(self):
+        Oven(['d', 'e'], self.cookbook).start_cooking()
+        fingerprints = dict([(x, self.cookbook.recipe_fingerprint(x))
+                             for x in 'abcde'])
+        self.assertEqual(self.cookbook.status['d'].deps_fingerprints,
+                         {'b': fingerprints['b'], 'c': fingerprints['c']})
+
+        # rebuilding a recipe with the same inputs doesn't affect the others
+        del self.cooked[:]
+        self.cookbook.reset_recipe_status('a')
+        Oven(['d', 'e'], self.cookbook).start_cooking()
+        self.assertEqual(self.cooked, ['a'])
+        self.assertEqual(self.cookbook.recipe_fingerprint('a'),
+                         fingerprints['a'])
+
+        # a new version rebuilds only its reverse dependencies
+        del self.cooked[:]
+        self.cookbook.get_recipe('b').version = '2.0'
+        self.cookbook.reset_recipe_status('b')
+        self.assertFalse(self.cookbook.recipe_needs_build('d'))
+        Oven(['d', 'e'], self.cookbook).start_cooking()
+        self.assertEqual(self.cooked, ['b', 'd'])
+        for name in 'bd':
+            self.assertNotEqual(self.cookbook.recipe_fingerprint(name),
+                                fingerprints[name])
+
+    def testRebuildPlan(self):
+        names = ['a', 'b', 'c', 'd', 'e']
+        self.assertEqual(self.cookbook.rebuild_plan(names),
+                         [(x, 'never built') for x in names])
+        Oven(['d', 'e'], self.cookbook).start_cooking()
+        self.assertEqual(self.cookbook.rebuild_plan(names), [])
+        self.assertEqual(len(self.cookbook.rebuild_plan(names, True)), 5)
+
+        # a reset with the same inputs doesn't affect the others
+        self.cookbook.reset_recipe_status('a')
+        self.assertEqual(self.cookbook.rebuild_plan(names),
+                         [('a', 'status reset')])
+        self.cookbook.get_recipe('b').version = '2.0'
+        self.cookbook.reset_recipe_status('b', 'version changed')
+        self.assertEqual(self.cookbook.rebuild_plan(names),
+                         [('a', 'status reset'), ('b', 'version changed'),
+                          ('d', 'dependencies changed: b')])
+        # the plan doesn't change the status
+        self.assertFalse(self.cookbook.recipe_needs_build('d'))
+
+    def testNeedsBuildIsAQuery(self):
+        Oven(['d'], self.cookbook).start_cooking()
+        self.cookbook.get_recipe('b').version = '2.0'
+        self.cookbook.reset_recipe_status('b')
+        Oven(['b'], self.cookbook, no_deps=True).start_cooking()
+        self.assertEqual(self.cookbook.rebuild_reason('d'),
+                         'dependencies changed: b')
+        self.assertTrue(self.cookbook.recipe_needs_build('d'))
+        # asking doesn't reset the status, building it does
+        self.assertFalse(self.cookbook.status['d'].needs_build)
+        del self.cooked[:]
+        Oven(['d'], self.cookbook).start_cooking()
+        self.assertEqual(self.cooked, ['d'])
+        self.assertIsNone(self.cookbook.rebuild_reason('d'))
@@ -18,10 +18,16 @@
 
 import unittest
 import os
+import shutil
+import tempfile
+import threading
 
 from cerbero.build import recipe
+from cerbero.build.build import BuildType
+from cerbero.build.source import SourceType
 from cerbero.config import Platform, License, Architecture
 from cerbero.errors import FatalError
+from cerbero.utils import shell
 from test.test_common import DummyConfig
 from test.test_build_common import Recipe1
 
@@ -211,3 +217,123 @@ class TestUniversalRecipe(unittest.TestCase):
         self.recipe.add_recipe(self.recipe_x86_64)
         self.assertEqual(self.recipe.steps,
                 recipe.BuildSteps() + [recipe.BuildSteps.MERGE])
+
+
+class ArchConfig(DummyConfig):
+
+    target_platform = Platform.LINUX
+
+    def __init__(self, arch, logs):
+        self.target_arch = arch
+        self.logs = logs
+
+    def get_build_env(self):
+        return {'ARCH': self.target_arch}
+
+
+class ArchRecipe(recipe.Recipe):
+
+    name = 'arch-recipe'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+
+    def __init__(self, config, barrier):
+        recipe.Recipe.__init__(self, config)
+        self.barrier = barrier
+        self.env = None
+
+    def compile(self):
+        # Fails if the other architecture isn't compiling at the same time
+        self.barrier.wait(5)
+        self.env = shell._environment()
+        shell.call('echo building %s' % self.config.target_arch)
+
+    def install(self):
+        raise FatalError('install failed')
+
+
+class TestUniversalRecipeSteps(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.arch_config = {}
+        self.recipe = recipe.UniversalRecipe(self.config)
+        barrier = threading.Barrier(2)
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            self.config.arch_config[arch] = ArchConfig(arch, self.tmp)
+            self.recipe.add_recipe(ArchRecipe(self.config.arch_config[arch],
+                                              barrier))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testConcurrentArchs(self):
+        self.recipe.compile()
+        for arch, r in self.recipe._recipes.items():
+            self.assertEqual(r.env, {'ARCH': arch})
+            logfile = os.path.join(self.tmp, 'arch-recipe-compile-%s.log' %
+                                   arch)
+            with open(logfile) as f:
+                self.assertIn('building %s' % arch, f.read())
+
+    def testArchFailure(self):
+        try:
+            self.recipe.install()
+            self.fail('FatalError not raised')
+        except FatalError as e:
+            self.assertIn(e.arch, self.recipe._recipes)
+
+
+class FlatArchRecipe(recipe.Recipe):
+
+    name = 'flat-recipe'
+    stype = SourceType.CUSTOM
+    btype = BuildType.CUSTOM
+
+    def install(self):
+        shell.call('echo installing %s' % self.config.target_arch)
+        libdir = os.path.join(self.config.prefix, 'lib')
+        if not os.path.exists(libdir):
+            os.makedirs(libdir)
+        with open(os.path.join(libdir, 'libflat'), 'w') as f:
+            f.write(self.config.target_arch)
+
+
+class TestUniversalFlatRecipeSteps(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = DummyConfig()
+        self.config.prefix = os.path.join(self.tmp, 'prefix')
+        self.config.arch_config = {}
+        self.recipe = recipe.UniversalFlatRecipe(self.config)
+        for arch in [Architecture.X86, Architecture.X86_64]:
+            config = ArchConfig(arch, self.tmp)
+            config.prefix = self.config.prefix
+            self.config.arch_config[arch] = config
+            self.recipe.add_recipe(FlatArchRecipe(config))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testInstall(self):
+        # the oven has the log file of the step open
+        logfile = os.path.join(self.tmp, 'flat-recipe-install.log')
+        shell.set_logfile_output(logfile)
+        try:
+            manifest = self.recipe.run_step('install')
+        finally:
+            shell.close_logfile_output()
+        # each architecture is installed in its own directory
+        archs = [Architecture.X86, Architecture.X86_64]
+        self.assertEqual(sorted(manifest),
+                         ['%s/lib/libflat' % arch for arch in archs])
+        for arch in archs:
+            with open(os.path.join(self.config.prefix, arch, 'lib',
+                                   'libflat')) as f:
+                self.assertEqual(f.read(), arch)
+        with open(logfile) as f:
+            log = f.read()
+        for arch in archs:
+            self.assertIn('installing %s' % arch, log)
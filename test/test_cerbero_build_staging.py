@@ -0,0 +1,204 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.build import recipe, staging
+from cerbero.build.build import CustomBuild
+from cerbero.build.cookbook import CookBook
+from cerbero.build.oven import Oven
+from cerbero.build.source import SourceType
+from cerbero.config import Platform, Variants
+from test.test_common import DummyConfig
+
+
+def write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class Config(DummyConfig):
+
+    target_platform = Platform.LINUX
+    interactive = False
+
+    def __init__(self, tmp):
+        self.home_dir = tmp
+        self.logs = tmp
+        self.sources = os.path.join(tmp, 'sources')
+        self.prefix = os.path.join(tmp, 'prefix')
+        self.cache_file = 'test.cache'
+        self.variants = Variants([])
+
+
+class StagedBuild(CustomBuild):
+
+    staged_install = True
+
+    def install(self):
+        # like make install DESTDIR=...
+        prefix = (self.destdir or '') + self.config.prefix
+        write(os.path.join(prefix, 'lib', 'libstaged.so.1'), 'staged')
+        os.symlink('libstaged.so.1', os.path.join(prefix, 'lib',
+                                                  'libstaged.so'))
+
+
+class IgnoredDestdirBuild(CustomBuild):
+
+    staged_install = True
+
+    def install(self):
+        # like make install PREFIX=...
+        write(os.path.join(self.config.prefix, 'lib', 'libignored.so'), 'x')
+
+
+class Recipe(recipe.Recipe):
+
+    name = 'staged'
+    version = '1.0'
+    stype = SourceType.CUSTOM
+    btype = StagedBuild
+    files_libs = ['libstaged']
+
+    def __init__(self, config):
+        recipe.Recipe.__init__(self, config)
+        self.__file__ = __file__
+
+
+class CustomRecipe(Recipe):
+
+    name = 'custom'
+
+    def install(self):
+        write(os.path.join(self.config.prefix, 'share', 'custom'), 'custom')
+        write(os.path.join(self.config.prefix, 'share', 'modified'), 'new')
+
+    def post_install(self):
+        write(os.path.join(self.config.prefix, 'share', 'post'), 'post')
+
+
+def ignored_destdir_recipe(config):
+    # the build type is only added to the classes named Recipe
+    class Recipe(recipe.Recipe):
+
+        name = 'ignored'
+        version = '1.0'
+        stype = SourceType.CUSTOM
+        btype = IgnoredDestdirBuild
+
+        def __init__(self, config):
+            recipe.Recipe.__init__(self, config)
+            self.__file__ = __file__
+
+    return Recipe(config)
+
+
+class ConcurrentRecipe(CustomRecipe):
+
+    name = 'concurrent'
+
+    def install(self):
+        CustomRecipe.install(self)
+        # a staged install of another recipe finishing meanwhile
+        Recipe(self.config).run_step('install')
+
+
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config(self.tmp)
+        self.prefix = self.config.prefix
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testStagedInstall(self):
+        r = Recipe(self.config)
+        self.assertTrue(staging.stages_install(r))
+        manifest = r.run_step('install')
+        self.assertEqual(manifest, {
+            'lib/libstaged.so.1': (6, hashlib.sha256(b'staged').hexdigest(),
+                                   staging.FileType.FILE),
+            'lib/libstaged.so': (0, hashlib.sha256(
+                b'libstaged.so.1').hexdigest(), staging.FileType.SYMLINK)})
+        self.assertTrue(os.path.islink(os.path.join(self.prefix, 'lib',
+                                                    'libstaged.so')))
+        self.assertIsNone(r.destdir)
+        # the staging directory is removed
+        self.assertEqual(os.listdir(os.path.dirname(r.build_dir)), [])
+        # a default post install does not install anything
+        self.assertEqual(r.run_step('post_install'), {})
+
+    def testScannedInstall(self):
+        write(os.path.join(self.prefix, 'share', 'untouched'), 'old')
+        write(os.path.join(self.prefix, 'share', 'modified'), 'old')
+        r = CustomRecipe(self.config)
+        self.assertFalse(staging.stages_install(r))
+        self.assertEqual(sorted(r.run_step('install')),
+                         ['share/custom', 'share/modified'])
+        self.assertEqual(list(r.run_step('post_install')), ['share/post'])
+
+    def testIgnoredDestdir(self):
+        write(os.path.join(self.prefix, 'share', 'untouched'), 'old')
+        os.utime(os.path.join(self.prefix, 'share', 'untouched'), (0, 0))
+        r = ignored_destdir_recipe(self.config)
+        self.assertTrue(staging.stages_install(r))
+        self.assertEqual(list(r.run_step('install')), ['lib/libignored.so'])
+
+    def testConcurrentStagedInstall(self):
+        r = ConcurrentRecipe(self.config)
+        self.assertEqual(sorted(r.run_step('install')),
+                         ['share/custom', 'share/modified'])
+        self.assertTrue(os.path.exists(os.path.join(self.prefix, 'lib',
+                                                    'libstaged.so.1')))
+
+    def testDestPrefix(self):
+        # universal flat recipes install each architecture in its own
+        # directory of the prefix
+        write(os.path.join(self.prefix, 'x86', 'share', 'modified'), 'x86')
+        r = CustomRecipe(self.config)
+        dest = os.path.join(self.prefix, 'x86_64')
+        manifest = r.run_step('install', dest, ['x86', 'x86_64'])
+        self.assertEqual(sorted(manifest), ['share/custom', 'share/modified'])
+        self.assertEqual(sorted(os.listdir(self.prefix)), ['x86', 'x86_64'])
+        self.assertTrue(os.path.exists(os.path.join(dest, 'share', 'custom')))
+
+        r = Recipe(self.config)
+        manifest = r.run_step('install', dest, ['x86', 'x86_64'])
+        self.assertEqual(sorted(manifest), ['lib/libstaged.so',
+                                            'lib/libstaged.so.1'])
+        self.assertTrue(os.path.exists(os.path.join(dest, 'lib',
+                                                    'libstaged.so.1')))
+
+    def testOven(self):
+        cookbook = CookBook(self.config, False)
+        cookbook.set_status({})
+        cookbook.add_recipe(Recipe(self.config))
+        cookbook.add_recipe(CustomRecipe(self.config))
+        Oven(['staged', 'custom'], cookbook, missing_files=True).start_cooking()
+        self.assertEqual(sorted(cookbook.recipe_manifest('staged')),
+                         ['lib/libstaged.so', 'lib/libstaged.so.1'])
+        self.assertEqual(sorted(cookbook.recipe_manifest('custom')),
+                         ['share/custom', 'share/modified', 'share/post'])
@@ -0,0 +1,85 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import builtins
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from cerbero.utils import parse_file
+from cerbero.utils.codecache import CodeCache
+
+
+class CodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'code.cache')
+        self.recipe = os.path.join(self.tmp, 'test.recipe')
+        self._write('value = 1\n')
+        self.compiled = []
+        self._compile = builtins.compile
+        builtins.compile = self._count_compile
+
+    def tearDown(self):
+        builtins.compile = self._compile
+        shutil.rmtree(self.tmp)
+
+    def _count_compile(self, source, filename, *args, **kwargs):
+        self.compiled.append(filename)
+        return self._compile(source, filename, *args, **kwargs)
+
+    def _write(self, content):
+        with open(self.recipe, 'w') as f:
+            f.write(content)
+
+    def _parse(self):
+        d = {}
+        cache = CodeCache(self.path)
+        parse_file(self.recipe, d, cache)
+        cache.save()
+        return d['value']
+
+    def testCache(self):
+        self.assertEqual(self._parse(), 1)
+        self.assertEqual(self.compiled, [self.recipe])
+        # the code is loaded from the cache
+        self.assertEqual(self._parse(), 1)
+        self.assertEqual(self.compiled, [self.recipe])
+        # and compiled again when the file changes
+        self._write('value = 22\n')
+        self.assertEqual(self._parse(), 22)
+        self.assertEqual(self.compiled, [self.recipe, self.recipe])
+
+    def testCorruptCache(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'corrupt')
+        self.assertEqual(self._parse(), 1)
+        self.assertEqual(self._parse(), 1)
+        self.assertEqual(self.compiled, [self.recipe])
+
+    def testLoadModule(self):
+        path = os.path.join(self.tmp, 'custom.py')
+        with open(path, 'w') as f:
+            f.write('class Custom(object):\n    pass\n')
+        module = CodeCache(self.path).load_module('test_custom', path)
+        self.assertIs(sys.modules['test_custom'], module)
+        self.assertEqual(module.Custom.__module__, 'test_custom')
+        del sys.modules['test_custom']
@@ -0,0 +1,76 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.utils import compilercache
+from test.test_common import DummyConfig
+
+
+class Config(DummyConfig):
+
+    use_ccache = True
+    compiler_cache = compilercache.CCACHE
+    compiler_cache_dir = '/cerbero/compiler-cache'
+    compiler_cache_size = '2G'
+    sources = '/cerbero/sources/linux_x86'
+    prefix = '/cerbero/dist/linux_x86'
+
+
+class CompilerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = Config()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testEnvironment(self):
+        self.assertEqual(compilercache.environment(self.config),
+                         {'CCACHE_DIR': '/cerbero/compiler-cache',
+                          'CCACHE_MAXSIZE': '2G',
+                          'CCACHE_BASEDIR': '/cerbero'})
+        self.config.compiler_cache = compilercache.SCCACHE
+        self.assertEqual(compilercache.environment(self.config),
+                         {'SCCACHE_DIR': '/cerbero/compiler-cache',
+                          'SCCACHE_CACHE_SIZE': '2G'})
+        self.config.use_ccache = False
+        self.assertEqual(compilercache.environment(self.config), {})
+
+    def testBaseDirOutsideSources(self):
+        self.config.prefix = '/opt/dist'
+        env = compilercache.environment(self.config)
+        self.assertEqual(env['CCACHE_BASEDIR'], self.config.sources)
+
+    def testStats(self):
+        env = {}
+        compilercache.collect_stats(self.config, env, self.tmp)
+        log = os.path.join(self.tmp, compilercache.STATS_LOG)
+        self.assertEqual(env, {'CCACHE_STATSLOG': log})
+        self.assertIsNone(compilercache.read_stats(self.tmp))
+        with open(log, 'w') as f:
+            f.write('# a.c\ndirect_cache_hit\n# b.c\ncache_miss\n'
+                    '# c.c\ncalled_for_link\n# d.c\npreprocessed_cache_hit\n')
+        self.assertEqual(compilercache.read_stats(self.tmp), (2, 1))
+        # the results of the previous compilation are discarded
+        compilercache.collect_stats(self.config, env, self.tmp)
+        self.assertIsNone(compilercache.read_stats(self.tmp))
@@ -0,0 +1,84 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.utils import jobserver, shell
+
+
+MAKEFILE = '''
+TARGETS = 1 2 3 4 5 6
+all: $(TARGETS)
+$(TARGETS):
+\t@echo + >> log; sleep 0.2; echo - >> log
+.PHONY: all $(TARGETS)
+'''
+
+
+@unittest.skipUnless(hasattr(os, 'mkfifo') and shutil.which('make'),
+                     'make jobserver not supported')
+class JobServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp, 'Makefile'), 'w') as f:
+            f.write(MAKEFILE)
+        self.server = jobserver.start(2)
+
+    def tearDown(self):
+        jobserver.stop()
+        shutil.rmtree(self.tmp)
+
+    def _max_jobs(self):
+        running = max_running = 0
+        with open(os.path.join(self.tmp, 'log'), 'r') as f:
+            for line in f.readlines():
+                running += 1 if line.strip() == '+' else -1
+                max_running = max(running, max_running)
+        return max_running
+
+    def testTokens(self):
+        self.assertEqual(jobserver.get(), self.server)
+        self.assertEqual(jobserver.fds(), [self.server.fd])
+        tokens = self.server.acquire(5)
+        self.assertEqual(len(tokens), 2)
+        self.server.release(tokens)
+        env = {}
+        with jobserver.make_slot(env, 4):
+            self.assertIn('--jobserver-', env['MAKEFLAGS'])
+            tokens = self.server.acquire(5)
+            self.assertEqual(len(tokens), 1)
+            self.server.release(tokens)
+        self.assertNotIn('MAKEFLAGS', env)
+
+    def testMakeUsesBudget(self):
+        env = shell.Environment(os.environ)
+        env.pop('MAKEFLAGS', None)
+        with jobserver.make_slot(env, 4):
+            shell.call('make', self.tmp, env=env)
+        self.assertEqual(self._max_jobs(), 2)
+
+    def testNotParallel(self):
+        env = shell.Environment(os.environ)
+        env.pop('MAKEFLAGS', None)
+        with jobserver.make_slot(env, 4, False):
+            shell.call('make', self.tmp, env=env)
+        self.assertEqual(self._max_jobs(), 1)
@@ -0,0 +1,53 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from cerbero.utils import shell
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache', 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testAtomicWrite(self):
+        with shell.atomic_write(self.path) as f:
+            f.write('old')
+            # Nothing is visible until it's written
+            self.assertFalse(os.path.exists(self.path))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+
+        # A failed write keeps the previous file and leaves nothing behind
+        with self.assertRaises(ValueError):
+            with shell.atomic_write(self.path, 'wb') as f:
+                f.write(b'new')
+                raise ValueError()
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['file'])
@@ -0,0 +1,74 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cerbero.utils import toolscache
+
+
+class ToolsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.tool = os.path.join(self.tmp, 'cerbero-test-tool')
+        with open(self.tool, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(self.tool, 0o755)
+        self.path = os.path.join(self.tmp, 'cache', toolscache.TOOLS_CACHE)
+        self._environ_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = self.tmp
+        self.probed = []
+
+    def tearDown(self):
+        os.environ['PATH'] = self._environ_path
+        toolscache._probed.clear()
+        shutil.rmtree(self.tmp)
+
+    def _probe(self, path):
+        self.probed.append(path)
+        return '1.%d' % len(self.probed)
+
+    def _get(self):
+        return toolscache.probe('cerbero-test-tool', 'version', self._probe,
+                                self.path)
+
+    def testProbe(self):
+        self.assertEqual(self._get(), '1.1')
+        self.assertEqual(self._get(), '1.1')
+        self.assertEqual(self.probed, [self.tool])
+        # other processes use the value stored on disk
+        toolscache._probed.clear()
+        self.assertEqual(self._get(), '1.1')
+        self.assertEqual(self.probed, [self.tool])
+
+    def testToolChanged(self):
+        self.assertEqual(self._get(), '1.1')
+        st = os.stat(self.tool)
+        os.utime(self.tool, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self._get(), '1.2')
+        toolscache._probed.clear()
+        self.assertEqual(self._get(), '1.2')
+
+    def testMissingTool(self):
+        self.assertEqual(toolscache.probe('cerbero-missing-tool', 'version',
+                                          self._probe, self.path), '1.1')
+        self.assertEqual(self.probed, ['cerbero-missing-tool'])
+        self.assertFalse(os.path.exists(self.path))
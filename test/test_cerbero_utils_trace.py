@@ -0,0 +1,80 @@
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import tempfile
+import threading
+import unittest
+
+from cerbero.utils import trace
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.NamedTemporaryFile()
+
+    def tearDown(self):
+        self.tmp.close()
+
+    def _load(self):
+        with open(self.tmp.name, 'r') as f:
+            events = json.load(f)['traceEvents']
+        lanes = dict([(e['tid'], e['args']['name']) for e in events
+                      if e['name'] == 'thread_name'])
+        spans = [e for e in events if e['ph'] == 'X']
+        return lanes, spans
+
+    def testNotTracing(self):
+        with trace.span('test', 'step'):
+            self.assertIsNone(trace.get())
+
+    def testSpans(self):
+        def worker():
+            with trace.span('compile', 'step', recipe='b'):
+                pass
+
+        with trace.tracing(self.tmp.name, 'test'):
+            with trace.span('a', 'recipe'):
+                with trace.span('fetch', 'fetch', recipe='a'):
+                    pass
+                with trace.span('compile', 'arch', 'a (x86)'):
+                    pass
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+            try:
+                with trace.span('install', 'step'):
+                    raise Exception('failed')
+            except Exception:
+                pass
+        self.assertIsNone(trace.get())
+
+        lanes, spans = self._load()
+        self.assertEqual(sorted(lanes.values()),
+                         ['a (x86)', 'main', 'worker 1'])
+        names = [(s['name'], lanes[s['tid']]) for s in spans]
+        self.assertEqual(names, [('fetch', 'main'), ('compile', 'a (x86)'),
+                                 ('a', 'main'), ('compile', 'worker 1'),
+                                 ('install', 'main')])
+        recipe, fetch = spans[2], spans[0]
+        self.assertTrue(recipe['ts'] <= fetch['ts'])
+        self.assertTrue(fetch['ts'] + fetch['dur'] <=
+                        recipe['ts'] + recipe['dur'])
+        self.assertEqual(spans[3]['args'], {'recipe': 'b'})
+        self.assertEqual(spans[4]['args'], {'error': 'failed'})
@@ -32,6 +32,9 @@ class DummyConfig(object):
     git_root = ''
     allow_parallel_build = False
     num_of_cpus = 1
+    artifact_cache = None
+    use_ccache = None
+    artifact_cache_remote = None
     target_version = None
     target_distro_version = None
     packages_prefix = ''
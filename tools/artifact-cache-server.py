@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# cerbero - a multi-platform build system for Open Source software
+# Copyright (C) 2012 Andoni Morales Alastruey <ylatuya@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Library General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+Minimal server for a remote artifact cache, storing the artifacts uploaded
+with PUT requests in a directory and serving them with GET requests.
+
+Usage: artifact-cache-server.py [-b ADDRESS] [-p PORT] DIRECTORY
+
+and in the cerbero configuration:
+
+artifact_cache_remote = 'http://ADDRESS:PORT/'
+'''
+
+import argparse
+import os
+import shutil
+import socketserver
+import tempfile
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class ArtifactsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._send_file(True)
+
+    def do_HEAD(self):
+        self._send_file(False)
+
+    def do_PUT(self):
+        path = self._path()
+        length = self.headers.get('Content-Length')
+        if path is None or length is None:
+            self.send_error(400)
+            return
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                remaining = int(length)
+                while remaining > 0:
+                    data = self.rfile.read(min(remaining, 65536))
+                    if not data:
+                        raise IOError('Connection closed')
+                    f.write(data)
+                    remaining -= len(data)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_file(self, body):
+        path = self._path()
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if body:
+                shutil.copyfileobj(f, self.wfile)
+
+    def _path(self):
+        name = urllib.parse.unquote(urllib.parse.urlparse(self.path).path)
+        parts = [x for x in name.split('/') if x]
+        if not parts or any(x in ('.', '..') or x.startswith('.tmp-')
+                            for x in parts):
+            return None
+        return os.path.join(self.server.directory, *parts)
+
+
+class ArtifactsServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, directory):
+        HTTPServer.__init__(self, address, ArtifactsHandler)
+        self.directory = os.path.abspath(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Artifact cache server')
+    parser.add_argument('-b', '--bind', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8077,
+                        help='port to listen on')
+    parser.add_argument('directory', help='directory with the artifacts')
+    args = parser.parse_args()
+
+    server = ArtifactsServer((args.bind, args.port), args.directory)
+    print('Serving %s on http://%s:%d/' %
+          ((server.directory,) + tuple(server.server_address[:2])))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()